@@ -0,0 +1,258 @@
+"""Фоновые запросы к Flask-серверу для Qt-приложения"""
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, pyqtSignal
+
+REQUEST_TIMEOUT = 5
+MAX_THREADS = 4
+# Сервер шлёт пинг каждые 15 с; если за это время не пришло ничего, соединение
+# считается оборванным
+EVENTS_READ_TIMEOUT = 40
+# Задержки перед повторным подключением к /events, с
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+class ApiError(Exception):
+    """Ошибка запроса; status_code и data заполнены, если сервер ответил"""
+
+    def __init__(self, message, status_code=None, data=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.data = data
+
+
+class ApiTask(QRunnable):
+    def __init__(self, client, fn, on_success, on_error, key, on_progress=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.client = client
+        self.fn = fn
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.key = key
+        self.cancelled = False
+
+    def cancel(self):
+        """Отменяет задачу: если она ещё в очереди, она не запустится,
+        если уже выполняется, её результат будет отброшен"""
+        self.cancelled = True
+        self.client.release_key(self)
+        if self.client.pool.tryTake(self):
+            self.client.forget(self)
+
+    def report_progress(self, value):
+        """Вызывается из рабочего потока; возвращает False, если задачу отменили
+        и работу пора прекратить"""
+        if not self.cancelled:
+            self.client.progressed.emit(self, value)
+        return not self.cancelled
+
+    def run(self):
+        if self.cancelled:
+            # Доставка нужна и отменённой задаче: по ней клиент отпускает ссылку
+            self.client.completed.emit(self, False, None)
+            return
+        try:
+            if self.on_progress:
+                result = self.fn(self.client.session(), self.report_progress)
+            else:
+                result = self.fn(self.client.session())
+        except Exception as e:
+            self.client.completed.emit(self, False, e)
+        else:
+            self.client.completed.emit(self, True, result)
+
+
+class ApiClient(QObject):
+    """Выполняет запросы в пуле потоков и возвращает результат в GUI-поток.
+
+    У каждого рабочего потока своя requests.Session, поэтому соединения с сервером
+    переиспользуются (keep-alive). Задачи с одинаковым key не накапливаются:
+    пока задача выполняется, повторная с тем же ключом не ставится в очередь,
+    а с replace=True предыдущая отменяется."""
+    # Сигнал испускается из рабочего потока и доставляется в поток, где живёт клиент
+    completed = pyqtSignal(object, bool, object)
+    progressed = pyqtSignal(object, object)
+
+    def __init__(self, base_url, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(MAX_THREADS)
+        # Потоки не завершаются по простою, чтобы не терять их сессии
+        self.pool.setExpiryTimeout(-1)
+        self._local = threading.local()
+        self._in_flight = {}
+        self._tasks = set()
+        self.completed.connect(self._deliver)
+        self.progressed.connect(self._report)
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def submit(self, fn, on_success=None, on_error=None, key=None, replace=False,
+               on_progress=None):
+        """Запускает fn(session) в фоне; on_success(result) или on_error(exception)
+        вызываются в GUI-потоке. Если передан on_progress, задача вызывается как
+        fn(session, progress) и может сообщать ход работы через progress(value)."""
+        if key is not None and key in self._in_flight:
+            if not replace:
+                return self._in_flight[key]
+            self._in_flight[key].cancel()
+        task = ApiTask(self, fn, on_success, on_error, key, on_progress)
+        self._tasks.add(task)
+        if key is not None:
+            self._in_flight[key] = task
+        self.pool.start(task)
+        return task
+
+    def request(self, method, path, on_success=None, on_error=None, key=None, replace=False,
+                **kwargs):
+        """HTTP-запрос к серверу; при коде 2xx on_success получает разобранный JSON"""
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+
+        def call(session):
+            response = session.request(method, url, **kwargs)
+            return parse_response(response)
+
+        return self.submit(call, on_success, on_error, key, replace)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def release_key(self, task):
+        if task.key is not None and self._in_flight.get(task.key) is task:
+            del self._in_flight[task.key]
+
+    def forget(self, task):
+        # Ссылка на задачу держится до доставки результата: QThreadPool не владеет
+        # ей (autoDelete выключен), и без ссылки Python удалил бы её во время работы
+        self._tasks.discard(task)
+        self.release_key(task)
+
+    def cancel_key(self, key):
+        if key in self._in_flight:
+            self._in_flight[key].cancel()
+
+    def cancel_all(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _report(self, task, value):
+        if not task.cancelled:
+            task.on_progress(value)
+
+    def _deliver(self, task, ok, payload):
+        self.forget(task)
+        if task.cancelled:
+            return
+        if ok:
+            if task.on_success:
+                task.on_success(payload)
+        elif task.on_error:
+            task.on_error(payload)
+
+
+def parse_response(response):
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+    if not 200 <= response.status_code < 300:
+        message = f"Ошибка сервера: {response.status_code}"
+        if isinstance(data, dict) and data.get('message'):
+            message += f" ({data['message']})"
+        raise ApiError(message, response.status_code, data)
+    return data
+
+
+class EventStream(QThread):
+    """Подписка на поток /events (Server-Sent Events). При обрыве переподключается
+    с нарастающей задержкой, начиная с версии, которую вернёт since()."""
+    connected = pyqtSignal()
+    disconnected = pyqtSignal()
+    changes = pyqtSignal(object)
+
+    def __init__(self, base_url, since, parent=None):
+        super().__init__(parent)
+        self.url = f"{base_url}/events"
+        self.since = since
+        self._stopped = threading.Event()
+        self._response = None
+
+    def stop(self):
+        self._stopped.set()
+        response = self._response
+        if response is not None:
+            # Прерывает ожидание данных в рабочем потоке
+            response.close()
+        self.wait(REQUEST_TIMEOUT * 1000)
+
+    def run(self):
+        session = requests.Session()
+        attempt = 0
+        while not self._stopped.is_set():
+            try:
+                with session.get(self.url, params={'since': self.since()}, stream=True,
+                                 headers={'Accept': 'text/event-stream'},
+                                 timeout=(REQUEST_TIMEOUT, EVENTS_READ_TIMEOUT)) as response:
+                    if response.status_code != 200:
+                        raise ApiError(f"Ошибка сервера: {response.status_code}",
+                                       response.status_code)
+                    self._response = response
+                    attempt = 0
+                    self.connected.emit()
+                    self._read(response)
+            except Exception:
+                pass
+            finally:
+                self._response = None
+            if self._stopped.is_set():
+                break
+            self.disconnected.emit()
+            self._stopped.wait(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+        session.close()
+
+    def _read(self, response):
+        response.encoding = 'utf-8'
+        event, data = None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if self._stopped.is_set():
+                return
+            if not line:
+                # Пустая строка завершает событие
+                if event == 'changes' and data:
+                    self.changes.emit(json.loads("\n".join(data)))
+                event, data = None, []
+            elif line.startswith(':'):
+                continue
+            else:
+                field, _, value = line.partition(':')
+                if value.startswith(' '):
+                    value = value[1:]
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
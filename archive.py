@@ -0,0 +1,103 @@
+"""Перенос закрытых ремонтов из repairs в архив (repairs_archive.db).
+
+    python archive.py               # один проход
+    python archive.py --every 24    # по расписанию (APScheduler) раз в 24 часа
+
+Переносятся записи в статусе ARCHIVE_STATUS, статус которых не менялся дольше
+ARCHIVE_AFTER_DAYS дней. Работа идёт короткими порциями: порция сначала
+копируется в архив, затем удаляется из repairs, если с момента копирования не
+менялась (совпадает version). Оба шага можно безопасно повторить, поэтому
+прерванный проход просто продолжается при следующем запуске. Между порциями
+пауза, чтобы запись со стороны сервера не ждала блокировку."""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import db
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_STATUS = "выдан"
+ARCHIVE_AFTER_DAYS = int(os.environ.get('REPAIRS_ARCHIVE_AFTER_DAYS', '180'))
+BATCH_SIZE = 500
+# Пауза между порциями, секунды
+BATCH_PAUSE = 0.05
+
+COLUMNS = ', '.join(db.REPAIR_COLUMNS + tuple(db.LOOKUP_COLUMNS.values()))
+
+
+def archive_batch(cutoff, batch_size=BATCH_SIZE):
+    """Переносит одну порцию; возвращает число записей, удалённых из repairs,
+    или None, если переносить больше нечего"""
+    with db.connection() as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM main.repairs WHERE status = ? AND status_timestamp < ? "
+            "ORDER BY status_timestamp LIMIT ?", (ARCHIVE_STATUS, cutoff, batch_size)
+        )]
+        if not ids:
+            return None
+        placeholders = ', '.join('?' * len(ids))
+        # Копия, оставшаяся от прерванного прохода, заменяется
+        conn.execute(f"DELETE FROM archive.repairs WHERE id IN ({placeholders})", ids)
+        conn.execute(
+            f"INSERT INTO archive.repairs ({COLUMNS}, archived_at) "
+            f"SELECT {COLUMNS}, datetime('now', 'localtime') FROM main.repairs "
+            f"WHERE id IN ({placeholders})", ids
+        )
+    # Транзакция по двум файлам не атомарна в режиме WAL, поэтому удаление —
+    # отдельный шаг и только тех записей, что уже лежат в архиве в той же версии
+    with db.connection() as conn:
+        moved = conn.execute(
+            f"""DELETE FROM main.repairs WHERE id IN ({placeholders}) AND version = (
+                    SELECT a.version FROM archive.repairs a WHERE a.id = repairs.id
+                )""", ids
+        ).rowcount
+        # Записи, изменённые между шагами, остаются в repairs; их копии не нужны
+        conn.execute(
+            f"DELETE FROM archive.repairs WHERE id IN ({placeholders}) "
+            "AND id IN (SELECT id FROM main.repairs)", ids
+        )
+    return moved
+
+
+def run_archive(days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE):
+    """Один проход архивации; возвращает число перенесённых записей"""
+    db.init_db()
+    cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        if moved is None:
+            break
+        total += moved
+        time.sleep(BATCH_PAUSE)
+    logger.info("Перенесено в архив записей: %d", total)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос закрытых ремонтов в архив")
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="сколько дней запись должна пробыть в статусе «выдан»")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--every', type=float, metavar='HOURS',
+                        help="запускать по расписанию с этим интервалом")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+    if args.every is None:
+        run_archive(args.days, args.batch_size)
+        return
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    scheduler = BlockingScheduler()
+    # Проход, не успевший закончиться к следующему запуску, не дублируется
+    scheduler.add_job(run_archive, 'interval', hours=args.every, args=(args.days, args.batch_size),
+                      next_run_time=datetime.now(), max_instances=1, coalesce=True)
+    scheduler.start()
+
+
+if __name__ == '__main__':
+    main()
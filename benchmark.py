@@ -0,0 +1,465 @@
+"""Нагрузочный тест Flask-сервера.
+
+    python benchmark.py seed --rows 100000
+    python benchmark.py run --rows 1000 100000 1000000 --server dev gunicorn
+    python benchmark.py compare benchmark_results/old.json benchmark_results/new.json
+    python benchmark.py run --rows 100000 --no-metrics   # для сравнения накладных расходов метрик
+
+run заполняет базы синтетическими заявками (один раз, файлы переиспользуются),
+для каждого размера и сервера поднимает сервер на копии базы и по очереди
+нагружает каждый эндпоинт из нескольких потоков. Результат — JSON с
+p50/p95/p99, пропускной способностью и памятью сервера (RSS); compare сравнивает
+два таких файла и завершается с кодом 1, если что-то заметно ухудшилось."""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'benchmark_data')
+RESULTS_DIR = os.path.join(BASE_DIR, 'benchmark_results')
+
+DEFAULT_ROWS = (1000, 100000, 1000000)
+SEED_CHUNK = 10000
+# Сколько секунд нагружать каждый эндпоинт
+DURATION = 10
+CONCURRENCY = 8
+GUNICORN_WORKERS = 4
+STARTUP_TIMEOUT = 120
+REQUEST_TIMEOUT = 300
+# Ухудшение (в долях) p95 или пропускной способности, которое compare считает регрессией
+REGRESSION_THRESHOLD = 0.1
+
+STATUSES = ["принят", "сдан в ремонт", "готов", "выдан"]
+DEVICE_TYPES = ["ноутбук", "телефон", "планшет", "принтер", "монитор", "системный блок"]
+MANUFACTURERS = ["Lenovo", "HP", "Asus", "Acer", "Samsung", "Apple", "Xiaomi", "Canon"]
+ACCESSORIES = ["", "зарядное устройство", "чехол", "кабель", "коробка"]
+NAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев"]
+WORDS = ["не", "включается", "греется", "разбит", "экран", "шумит", "вентилятор", "батарея",
+         "клавиатура", "залит", "не заряжается", "перезагружается", "полосы", "печать"]
+
+
+def fake_repair(rng):
+    return {
+        "client_name": f"{rng.choice(NAMES)} {rng.choice('АБВГДЕЖЗИКЛМН')}.",
+        "device_type": rng.choice(DEVICE_TYPES),
+        "manufacturer": rng.choice(MANUFACTURERS),
+        "model": f"{rng.choice('ABCDEFXZ')}{rng.randint(100, 9999)}",
+        "serial_number": f"SN{rng.randrange(10 ** 9):09d}",
+        "accessories": rng.choice(ACCESSORIES),
+        "client_address": f"ул. Ленина, {rng.randint(1, 200)}, кв. {rng.randint(1, 300)}, "
+                          f"+7 9{rng.randrange(10 ** 9):09d}",
+        "status": rng.choice(STATUSES),
+        "issue_description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))),
+        "notes": "" if rng.random() < 0.7 else " ".join(rng.choice(WORDS) for _ in range(4)),
+    }
+
+
+def dataset_path(rows):
+    return os.path.join(DATA_DIR, f"repairs-{rows}.db")
+
+
+def seed(rows, path):
+    """Заполняет базу path заявками; вызывается в отдельном процессе, потому что
+    путь к базе db.py читает из окружения при импорте"""
+    os.environ['REPAIRS_DB'] = path
+    # Архив наборам не нужен, но подключается к каждому соединению
+    os.environ['REPAIRS_ARCHIVE_DB'] = path + '-archive'
+    sys.path.insert(0, BASE_DIR)
+    import db
+    from repair_schema import lookup_keys
+    db.init_db()
+    rng = random.Random(rows)
+    start = datetime(2020, 1, 1)
+    sql = """INSERT INTO repairs (
+        client_name, device_type, manufacturer, model, serial_number,
+        accessories, client_address, status, status_timestamp, issue_description, notes,
+        serial_key, phone_key, name_key
+    ) VALUES (:client_name, :device_type, :manufacturer, :model, :serial_number,
+              :accessories, :client_address, :status, :status_timestamp,
+              :issue_description, :notes, :serial, :phone, :name)"""
+    with db.connection() as conn:
+        existing = conn.execute("SELECT COUNT(*) FROM repairs").fetchone()[0]
+    for offset in range(existing, rows, SEED_CHUNK):
+        batch = []
+        for i in range(offset, min(offset + SEED_CHUNK, rows)):
+            record = fake_repair(rng)
+            record["status_timestamp"] = (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S")
+            record.update(lookup_keys(record))
+            batch.append(record)
+        with db.connection() as conn:
+            conn.executemany(sql, batch)
+        print(f"  {min(offset + SEED_CHUNK, rows)}/{rows}", file=sys.stderr)
+    with db.connection() as conn:
+        # Копия базы для прогона должна быть одним файлом, без -wal
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("ANALYZE")
+
+
+def ensure_dataset(rows):
+    path = dataset_path(rows)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Заполнение базы на {rows} записей...", file=sys.stderr)
+        partial = path + ".part"
+        for suffix in ("", "-wal", "-shm", "-archive", "-archive-wal", "-archive-shm"):
+            if os.path.exists(partial + suffix):
+                os.remove(partial + suffix)
+        subprocess.run([sys.executable, __file__, 'seed', '--rows', str(rows), '--db', partial],
+                       check=True)
+        os.replace(partial, path)
+    return path
+
+
+# --- Сервер ---
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, workers):
+    if kind == 'dev':
+        # Тот же встроенный сервер Werkzeug, что и app.run в site.py, но без
+        # перезапуска по изменению файлов
+        return [sys.executable, '-c',
+                f"import wsgi; wsgi.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    return ['gunicorn', '-w', str(workers), '-k', 'gthread', '--threads', '32',
+            '-b', f'127.0.0.1:{port}', '--timeout', str(REQUEST_TIMEOUT), 'wsgi:app']
+
+
+class Server:
+    """Сервер на копии базы: запись в ходе прогона не портит исходный набор"""
+
+    def __init__(self, kind, rows, workers=GUNICORN_WORKERS, metrics=True):
+        self.kind = kind
+        self.workdir = os.path.join(DATA_DIR, f"run-{kind}-{rows}")
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        os.makedirs(self.workdir)
+        self.db_path = os.path.join(self.workdir, 'repairs.db')
+        shutil.copyfile(dataset_path(rows), self.db_path)
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ, REPAIRS_DB=self.db_path,
+                   REPAIRS_ARCHIVE_DB=os.path.join(self.workdir, 'repairs_archive.db'),
+                   REPAIRS_METRICS='1' if metrics else '0')
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.process = subprocess.Popen(server_command(kind, self.port, workers), cwd=BASE_DIR,
+                                        env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Сервер {self.kind} завершился, см. {self.log.name}")
+            try:
+                if requests.get(f"{self.url}/get_repairs?limit=1", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Сервер {self.kind} не запустился за {STARTUP_TIMEOUT} с")
+
+    def rss(self):
+        """Суммарный RSS процесса сервера и его воркеров, МБ"""
+        total = 0
+        for pid in process_tree(self.process.pid):
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+            except OSError:
+                pass
+        return round(total / 1024, 1) if total else None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def process_tree(pid):
+    """pid и все его потомки (по /proc; на других системах только сам pid)"""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+# --- Нагрузка ---
+
+class Endpoint:
+    """Эндпоинт и способ построить к нему запрос; prepare вызывается один раз на
+    сервер и может запросить данные, нужные для запросов (например, id записей)"""
+
+    def __init__(self, name, method, path, body=None, prepare=None, writes=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.prepare = prepare
+        self.writes = writes
+
+    def request(self, session, url, rng, context):
+        path = self.path(rng, context) if callable(self.path) else self.path
+        json_body = self.body(rng, context) if self.body else None
+        response = session.request(self.method, url + path, json=json_body,
+                                   timeout=REQUEST_TIMEOUT)
+        # Тело читается целиком: время ответа включает сериализацию и передачу
+        response.content
+        return response.status_code < 400
+
+
+def changes_version(session, url):
+    # since больше любой версии: сервер вернёт только текущую версию журнала
+    return session.get(f"{url}/get_repairs?since={2 ** 62}",
+                       timeout=REQUEST_TIMEOUT).json()["version"]
+
+
+def record_ids(session, url):
+    items = session.get(f"{url}/get_repairs?limit=1000&sort=id&order=desc",
+                        timeout=REQUEST_TIMEOUT).json()["items"]
+    return [item["id"] for item in items]
+
+
+ENDPOINTS = [
+    Endpoint("get_repairs", "GET", "/get_repairs"),
+    Endpoint("get_repairs_page", "GET", "/get_repairs?limit=100"),
+    Endpoint("get_repairs_filtered", "GET",
+             lambda rng, ctx: f"/get_repairs?limit=100&status={rng.choice(STATUSES)}"
+                              "&sort=status_timestamp&order=desc"),
+    Endpoint("get_repairs_since", "GET",
+             lambda rng, ctx: f"/get_repairs?since={max(ctx - 100, 0)}",
+             prepare=changes_version),
+    Endpoint("search", "GET", lambda rng, ctx: f"/search?q={rng.choice(NAMES + WORDS)}"),
+    Endpoint("lookup_serial", "GET",
+             lambda rng, ctx: f"/lookup?by=serial&q=SN{rng.randrange(10 ** 5):05d}"),
+    Endpoint("lookup_name", "GET", lambda rng, ctx: f"/lookup?by=name&q={rng.choice(NAMES)}"),
+    # Начало номера с кодом страны, как его набирают в поле телефона
+    Endpoint("lookup_phone", "GET",
+             lambda rng, ctx: f"/lookup?by=phone&q=79{rng.randrange(1000):03d}"),
+    Endpoint("export_csv", "GET", "/export?format=csv"),
+    Endpoint("reviews_page", "GET", "/reviews"),
+    Endpoint("reviews_approved", "GET", "/reviews/approved"),
+    Endpoint("receive", "POST", "/receive", body=lambda rng, ctx: fake_repair(rng), writes=True),
+    Endpoint("receive_bulk", "POST", "/receive_bulk",
+             body=lambda rng, ctx: [fake_repair(rng) for _ in range(100)], writes=True),
+    Endpoint("patch_repair", "PATCH", lambda rng, ctx: f"/repairs/{rng.choice(ctx)}",
+             body=lambda rng, ctx: {"notes": " ".join(rng.choice(WORDS) for _ in range(4))},
+             prepare=record_ids, writes=True),
+    Endpoint("submit_review", "POST", "/reviews",
+             body=lambda rng, ctx: {"name": rng.choice(NAMES), "rating": rng.randint(1, 5),
+                                    "text": " ".join(rng.choice(WORDS) for _ in range(12))},
+             writes=True),
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def load(server, endpoint, duration, concurrency):
+    """Нагружает эндпоинт из concurrency потоков в течение duration секунд"""
+    with requests.Session() as session:
+        context = endpoint.prepare(session, server.url) if endpoint.prepare else None
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    peak_rss = [server.rss()]
+    stop = threading.Event()
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(number)
+        local, failed = [], 0
+        with requests.Session() as session:
+            # Хотя бы один запрос, даже если он дольше всего прогона
+            while not local and not failed or time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = endpoint.request(session, server.url, rng, context)
+                except requests.RequestException:
+                    ok = False
+                if ok:
+                    local.append(time.perf_counter() - started)
+                else:
+                    failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    def sample_rss():
+        while not stop.wait(0.5):
+            rss = server.rss()
+            if rss is not None:
+                peak_rss[0] = max(peak_rss[0] or 0, rss)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    latencies.sort()
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": round(len(latencies) / elapsed, 2),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 0.5)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "peak_rss_mb": peak_rss[0],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    endpoints = [e for e in ENDPOINTS if not args.endpoints or e.name in args.endpoints]
+    result = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec='seconds'),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "gunicorn_workers": args.workers,
+            "metrics": not args.no_metrics,
+        },
+        "runs": [],
+    }
+    for rows in args.rows:
+        ensure_dataset(rows)
+        for kind in args.server:
+            print(f"{kind}, {rows} записей", file=sys.stderr)
+            server = Server(kind, rows, args.workers, metrics=not args.no_metrics)
+            try:
+                run_result = {"server": kind, "rows": rows, "idle_rss_mb": server.rss(),
+                              "endpoints": {}}
+                # Сначала чтение, затем запись: запись меняет размер таблицы
+                for endpoint in sorted(endpoints, key=lambda e: e.writes):
+                    stats = load(server, endpoint, args.duration, args.concurrency)
+                    run_result["endpoints"][endpoint.name] = stats
+                    print(f"  {endpoint.name:22} {stats['throughput']:>9} req/s  "
+                          f"p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  "
+                          f"p99 {stats['p99_ms']} ms  errors {stats['errors']}", file=sys.stderr)
+            finally:
+                server.stop()
+            result["runs"].append(run_result)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{result['meta']['commit'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(output)
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    old = {(r["server"], r["rows"], name): stats
+           for r in baseline["runs"] for name, stats in r["endpoints"].items()}
+    regressions = 0
+    for run_result in current["runs"]:
+        for name, stats in run_result["endpoints"].items():
+            key = (run_result["server"], run_result["rows"], name)
+            if key not in old or not old[key]["p95_ms"] or not old[key]["throughput"]:
+                continue
+            p95 = stats["p95_ms"] / old[key]["p95_ms"] - 1 if stats["p95_ms"] else 0
+            throughput = stats["throughput"] / old[key]["throughput"] - 1
+            worse = p95 > args.threshold or throughput < -args.threshold
+            regressions += worse
+            print(f"{'!' if worse else ' '} {key[0]:8} {key[1]:>8} {name:22} "
+                  f"p95 {p95:+.1%}  req/s {throughput:+.1%}")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Flask-сервера")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help="заполнить базу синтетическими заявками")
+    seed_parser.add_argument('--rows', type=int, required=True)
+    seed_parser.add_argument('--db', help="путь к базе (по умолчанию benchmark_data/)")
+
+    run_parser = commands.add_parser('run', help="прогнать нагрузку")
+    run_parser.add_argument('--rows', type=int, nargs='+', default=list(DEFAULT_ROWS))
+    run_parser.add_argument('--server', nargs='+', choices=('dev', 'gunicorn'),
+                            default=['dev', 'gunicorn'])
+    run_parser.add_argument('--endpoints', nargs='+', choices=[e.name for e in ENDPOINTS])
+    run_parser.add_argument('--duration', type=float, default=DURATION)
+    run_parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    run_parser.add_argument('--workers', type=int, default=GUNICORN_WORKERS)
+    run_parser.add_argument('--no-metrics', action='store_true',
+                            help="отключить сбор метрик на сервере (замер их накладных расходов)")
+    run_parser.add_argument('--output', help="файл результатов (по умолчанию benchmark_results/)")
+
+    compare_parser = commands.add_parser('compare', help="сравнить два прогона")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        if args.db:
+            seed(args.rows, args.db)
+        else:
+            ensure_dataset(args.rows)
+    elif args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Проверка пропускной способности и задержек бота без Telegram.
+
+    python bot_harness.py --users 200
+    python bot_harness.py --users 50 --rounds 5 --latency 0.05 --output bot.json
+
+Бот собирается той же функцией tg_bot.build_application, но обращения к Bot API
+перехватывает FakeTelegram (подкласс telegram.request.BaseRequest): он отвечает
+на getMe, sendMessage и остальные методы локально и сообщает о каждом ответе
+бота. Обновления подаются в application.update_queue так же, как их подаёт
+webhook. Каждый пользователь проходит диалог заявки целиком, отправляя
+следующее сообщение только после ответа бота. Заявки ложатся во временный
+outbox и отправляются в заглушку /receive_bulk (httpx.MockTransport).
+
+--latency добавляет задержку к каждому ответу «Telegram», как у настоящей сети."""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from telegram import Update
+from telegram.request import BaseRequest
+
+import tg_bot
+from outbox import Outbox
+
+TOKEN = "123456:harness"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Repairs", "username": "repairs_harness_bot"}
+# Сообщения пользователя в диалоге заявки
+SCRIPT = ["Создать заявку", "Телефон", "Не включается после падения", "+7 900 000-00-00", "Да"]
+DELIVERY_TIMEOUT = 60
+
+
+class FakeTelegram(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+        # id чата -> ожидание следующего ответа бота в этот чат
+        self._replies = {}
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def expect_reply(self, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self._replies[chat_id] = future
+        return future
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        parameters = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method == 'sendMessage':
+            self._message_id += 1
+            chat_id = int(parameters['chat_id'])
+            result = {"message_id": self._message_id, "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER,
+                      "text": parameters.get('text', '')}
+            future = self._replies.pop(chat_id, None)
+            if future is not None and not future.done():
+                future.set_result(result['text'])
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class Users:
+    """Пользователи, пишущие боту: обновления в формате Bot API"""
+
+    def __init__(self, application, telegram):
+        self.application = application
+        self.telegram = telegram
+        self._update_id = 0
+
+    async def send(self, user_id, text):
+        """Отправляет сообщение и ждёт ответа бота; возвращает задержку, секунды"""
+        self._update_id += 1
+        update = Update.de_json({
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"Клиент {user_id}"},
+                "text": text,
+            },
+        }, self.application.bot)
+        reply = self.telegram.expect_reply(user_id)
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        await reply
+        return time.perf_counter() - started
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)] if values else None
+
+
+async def run(args):
+    received = []
+
+    def receive_bulk(request):
+        records = json.loads(request.content)
+        received.extend(records)
+        return httpx.Response(200, json={"status": "success", "inserted": len(records),
+                                         "errors": []})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        telegram = FakeTelegram(args.latency)
+        state_path = None if args.no_persistence else os.path.join(tmp, 'bot_state.pickle')
+        application = tg_bot.build_application(TOKEN, request=telegram, state_path=state_path)
+        application.bot_data['outbox'] = Outbox(os.path.join(tmp, 'outbox.db'))
+        application.bot_data['http_client'] = httpx.AsyncClient(
+            transport=httpx.MockTransport(receive_bulk)
+        )
+        users = Users(application, telegram)
+        message_latencies, conversation_times = [], []
+
+        async def conversation(user_id):
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                for text in SCRIPT:
+                    message_latencies.append(await users.send(user_id, text))
+                conversation_times.append(time.perf_counter() - started)
+
+        async with application:
+            # run_polling/run_webhook вызывают post_init сами, здесь — вручную
+            await tg_bot.post_init(application)
+            await application.start()
+            started = time.perf_counter()
+            await asyncio.gather(*(conversation(1000 + user) for user in range(args.users)))
+            elapsed = time.perf_counter() - started
+            expected = args.users * args.rounds
+            deadline = time.monotonic() + DELIVERY_TIMEOUT
+            while len(received) < expected and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            delivered = time.perf_counter() - started
+            await application.stop()
+            await tg_bot.post_shutdown(application)
+
+    conversations = len(conversation_times)
+    return {
+        "users": args.users,
+        "rounds": args.rounds,
+        "latency": args.latency,
+        "persistence": not args.no_persistence,
+        "concurrent_updates": tg_bot.CONCURRENT_UPDATES,
+        "conversations": conversations,
+        "conversations_per_s": round(conversations / elapsed, 1),
+        "messages_per_s": round(len(message_latencies) / elapsed, 1),
+        "message_p50_ms": round(percentile(message_latencies, 50) * 1000, 2),
+        "message_p95_ms": round(percentile(message_latencies, 95) * 1000, 2),
+        "message_p99_ms": round(percentile(message_latencies, 99) * 1000, 2),
+        "conversation_mean_ms": round(statistics.mean(conversation_times) * 1000, 2),
+        "conversation_p95_ms": round(percentile(conversation_times, 95) * 1000, 2),
+        "delivered": len(received),
+        "delivered_after_s": round(delivered, 2),
+        "api_calls": telegram.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка бота без Telegram")
+    parser.add_argument('--users', type=int, default=100, help="одновременных пользователей")
+    parser.add_argument('--rounds', type=int, default=1, help="заявок на пользователя")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка каждого ответа Bot API, секунды")
+    parser.add_argument('--no-persistence', action='store_true',
+                        help="без сохранения состояния диалогов")
+    parser.add_argument('--output', help="записать результат в JSON")
+    args = parser.parse_args()
+    # Журнал каждой заявки заглушил бы результат
+    logging.getLogger().setLevel(logging.WARNING)
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
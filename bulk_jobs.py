@@ -0,0 +1,149 @@
+"""Массовые операции над repairs (удаление, смена статуса) фоновыми заданиями.
+
+Задание хранится в таблице bulk_jobs и выполняется порциями по CHUNK_SIZE записей
+в порядке id: каждая порция — отдельная короткая транзакция, в которой вместе с
+изменением записей сохраняется и прогресс (last_id). Поэтому запись со стороны
+бота не ждёт конца операции, а задание, прерванное перезапуском сервера, можно
+продолжить с того же места. Выполняющий процесс держит аренду (lease_until) и
+продлевает её с каждой порцией; задание с истёкшей арендой подхватывает
+любой процесс при следующем обращении к нему."""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import db
+from events import notifier
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("delete", "status")
+CHUNK_SIZE = 200
+# Пауза между порциями, секунды
+CHUNK_PAUSE = 0.01
+LEASE_SECONDS = 30
+
+JOB_FIELDS = ("id", "action", "value", "state", "total", "processed", "affected", "error",
+              "created_at", "updated_at")
+
+
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def start(action, value, conditions, params):
+    """Создаёт задание над записями, подходящими под conditions (фрагменты WHERE
+    из разрешённых столбцов), и запускает его в этом процессе"""
+    if action not in ACTIONS:
+        raise ValueError(f"Операция {action} не поддерживается")
+    where = ' AND '.join(conditions) if conditions else '1'
+    job_id = uuid.uuid4().hex
+    owner = uuid.uuid4().hex
+    with db.connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM repairs WHERE {where}", params).fetchone()[0]
+        conn.execute(
+            "INSERT INTO bulk_jobs (id, action, value, filter_sql, params, total, owner, "
+            "lease_until, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, action, value, where, json.dumps(params), total, owner,
+             time.time() + LEASE_SECONDS, now(), now())
+        )
+    _spawn(job_id, owner)
+    return get(job_id)
+
+
+def get(job_id):
+    """Состояние задания или None; задание с истёкшей арендой продолжается здесь"""
+    resume_stale()
+    with db.connection() as conn:
+        row = conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM bulk_jobs WHERE id = ?",
+                           (job_id,)).fetchone()
+    return dict(zip(JOB_FIELDS, row)) if row else None
+
+
+def cancel(job_id):
+    """Останавливает задание; уже обработанные порции не откатываются"""
+    with db.connection() as conn:
+        conn.execute("UPDATE bulk_jobs SET state = 'cancelled', updated_at = ? "
+                     "WHERE id = ? AND state = 'running'", (now(), job_id))
+    return get(job_id)
+
+
+def resume_stale():
+    """Забирает задания, чей процесс перестал продлевать аренду (перезапуск сервера)"""
+    with db.connection() as conn:
+        stale = [row[0] for row in conn.execute(
+            "SELECT id FROM bulk_jobs WHERE state = 'running' AND lease_until < ?",
+            (time.time(),)
+        )]
+    for job_id in stale:
+        owner = uuid.uuid4().hex
+        with db.connection() as conn:
+            # Условие на аренду повторяется: задание мог уже забрать другой процесс
+            claimed = conn.execute(
+                "UPDATE bulk_jobs SET owner = ?, lease_until = ? "
+                "WHERE id = ? AND state = 'running' AND lease_until < ?",
+                (owner, time.time() + LEASE_SECONDS, job_id, time.time())
+            ).rowcount
+        if claimed:
+            logger.info("Продолжение задания %s", job_id)
+            _spawn(job_id, owner)
+
+
+def _spawn(job_id, owner):
+    threading.Thread(target=_run, args=(job_id, owner), name=f"bulk-{job_id[:8]}",
+                     daemon=True).start()
+
+
+def _run(job_id, owner):
+    try:
+        while _run_chunk(job_id, owner):
+            notifier.notify()
+            time.sleep(CHUNK_PAUSE)
+        notifier.notify()
+    except Exception as e:
+        logger.exception("Задание %s завершилось с ошибкой", job_id)
+        with db.connection() as conn:
+            conn.execute("UPDATE bulk_jobs SET state = 'failed', error = ?, updated_at = ? "
+                         "WHERE id = ? AND owner = ?", (str(e), now(), job_id, owner))
+
+
+def _run_chunk(job_id, owner):
+    """Обрабатывает одну порцию; возвращает False, когда продолжать не нужно"""
+    with db.connection() as conn:
+        # Блокировка записи берётся сразу: иначе отмена, пришедшая между чтением
+        # состояния и изменением записей, сорвала бы транзакцию
+        conn.execute("BEGIN IMMEDIATE")
+        job = conn.execute(
+            "SELECT action, value, filter_sql, params, last_id FROM bulk_jobs "
+            "WHERE id = ? AND state = 'running' AND owner = ?", (job_id, owner)
+        ).fetchone()
+        if job is None:
+            return False
+        action, value, where, params, last_id = job
+        ids = [row[0] for row in conn.execute(
+            f"SELECT id FROM repairs WHERE ({where}) AND id > ? ORDER BY id LIMIT ?",
+            json.loads(params) + [last_id, CHUNK_SIZE]
+        )]
+        if not ids:
+            conn.execute("UPDATE bulk_jobs SET state = 'done', updated_at = ? WHERE id = ?",
+                         (now(), job_id))
+            return False
+        placeholders = ', '.join('?' * len(ids))
+        if action == 'delete':
+            affected = conn.execute(f"DELETE FROM repairs WHERE id IN ({placeholders})",
+                                    ids).rowcount
+        else:
+            # Записи, уже стоящие в этом статусе, не трогаем: их версия не меняется
+            affected = conn.execute(
+                f"UPDATE repairs SET status = ?, status_timestamp = ?, version = version + 1 "
+                f"WHERE id IN ({placeholders}) AND status IS NOT ?",
+                [value, now()] + ids + [value]
+            ).rowcount
+        conn.execute(
+            "UPDATE bulk_jobs SET processed = processed + ?, affected = affected + ?, "
+            "last_id = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+            (len(ids), affected, ids[-1], time.time() + LEASE_SECONDS, now(), job_id)
+        )
+    return True
@@ -0,0 +1,49 @@
+"""Кэш последних загруженных с сервера данных для быстрого старта клиента.
+
+При выходе таблица (по столбцам), версия журнала изменений и справочники
+сохраняются в сжатый JSON; при следующем запуске они показываются сразу, а
+синхронизация продолжается с сохранённой версии и приносит только изменения."""
+import gzip
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Меняется, когда меняется формат файла: старый кэш тогда просто не читается
+CACHE_FORMAT = 1
+CACHE_FILE = "repairs_cache.json.gz"
+
+
+def load(path, server):
+    """Данные кэша или None, если кэша нет, он повреждён или от другого сервера"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось прочитать кэш %s: %s", path, e)
+        return None
+    if cache.get('format') != CACHE_FORMAT or cache.get('server') != server:
+        return None
+    return cache
+
+
+def save(path, server, version, columns, dictionaries, dictionaries_etag):
+    """Записывает кэш через временный файл, чтобы прерванная запись не
+    испортила предыдущий"""
+    cache = {
+        'format': CACHE_FORMAT,
+        'server': server,
+        'version': version,
+        'columns': columns,
+        'dictionaries': dictionaries,
+        'dictionaries_etag': dictionaries_etag,
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # Быстрое сжатие: файл пишется при закрытии окна
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
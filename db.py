@@ -0,0 +1,701 @@
+"""Общий слой доступа к repairs.db: пул соединений и настройка SQLite"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from repair_schema import LOOKUP_FIELDS, lookup_keys
+
+DB_PATH = os.environ.get('REPAIRS_DB', 'repairs.db')
+# Архив закрытых ремонтов (см. archive.py), подключается к каждому соединению как archive
+ARCHIVE_PATH = os.environ.get('REPAIRS_ARCHIVE_DB', 'repairs_archive.db')
+# Соединений на процесс (на каждый воркер gunicorn свой пул)
+POOL_SIZE = int(os.environ.get('REPAIRS_DB_POOL_SIZE', '8'))
+# Сколько секунд ждать свободное соединение или снятие блокировки записи
+POOL_TIMEOUT = float(os.environ.get('REPAIRS_DB_TIMEOUT', '5'))
+# Сколько секунд init_db ждёт, пока схему обновляет другой процесс
+MIGRATION_TIMEOUT = 300
+# Размер кэша подготовленных выражений на соединение (sqlite3 кэширует их по тексту SQL)
+STATEMENT_CACHE_SIZE = 256
+
+# Столбцы repairs в порядке таблицы
+REPAIR_COLUMNS = (
+    "id", "client_name", "device_type", "manufacturer", "model", "serial_number",
+    "accessories", "client_address", "status", "status_timestamp", "issue_description", "notes",
+    "version"
+)
+# Вид ключа поиска прежних ремонтов (repair_schema.LOOKUP_FIELDS) -> столбец
+# с нормализованным значением; заполняются при записи (site.repair_values, PATCH)
+LOOKUP_COLUMNS = {"serial": "serial_key", "phone": "phone_key", "name": "name_key"}
+# Столбцы repairs, попадающие в полнотекстовый поиск
+FTS_COLUMNS = ("client_name", "serial_number", "model", "issue_description", "notes")
+# Столбцы repairs, для которых ведутся справочники значений с числом записей
+DICTIONARY_FIELDS = ("device_type", "manufacturer", "accessories")
+# Срок ремонта считается от первого перехода в TURNAROUND_FROM до первого в TURNAROUND_TO
+TURNAROUND_FROM = "принят"
+TURNAROUND_TO = "готов"
+# Разрезы статистики сроков ремонта ('' — все ремонты вместе)
+TURNAROUND_DIMENSIONS = ("", "device_type", "manufacturer")
+# Верхние границы корзин гистограммы сроков, часы; последняя корзина — всё, что дольше
+TURNAROUND_BUCKETS = (1, 2, 4, 8, 12, 24, 48, 72, 120, 168, 240, 336, 504, 720, 1080, 1440)
+
+# Отзывы, с которыми создаётся таблица reviews: (автор, оценка, текст, дата)
+INITIAL_REVIEWS = (
+    ("Анна К.", 5, "Этот бот изменил мой подход к работе! Теперь все задачи автоматизированы "
+     "и занимают в 3 раза меньше времени. Очень удобный интерфейс и быстрая поддержка.",
+     "2023-05-15 12:00:00"),
+    ("Иван П.", 4, "Отличный функционал, пользуюсь уже 2 месяца. Есть небольшие пожелания "
+     "по доработке, но в целом очень доволен. Поддержка реагирует быстро и помогает "
+     "решить вопросы.", "2023-06-02 12:00:00"),
+    ("Елена С.", 5, "Лучший бот в своем роде! Использую для автоматизации бизнес-процессов, "
+     "экономит кучу времени. Особенно нравится система напоминаний и интеграция с Google "
+     "Календарем.", "2023-04-28 12:00:00"),
+)
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # В режиме WAL NORMAL не теряет целостность, а fsync делается только на checkpoint
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",  # ~16 МБ страничного кэша
+    "PRAGMA mmap_size=268435456",  # 256 МБ
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={int(POOL_TIMEOUT * 1000)}",
+)
+
+
+def connect(path=DB_PATH, timeout=POOL_TIMEOUT, archive_path=ARCHIVE_PATH):
+    """Новое настроенное соединение с базой и подключённым архивом"""
+    # При включённых метриках каждый запрос замеряется (metrics.DB_QUERY_DURATION)
+    factory = metrics.InstrumentedConnection if metrics.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # Поиск и выгрузка читают архив тем же запросом, что и основную таблицу
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    conn.execute("PRAGMA archive.journal_mode=WAL")
+    conn.execute("PRAGMA archive.synchronous=NORMAL")
+    return conn
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Ограниченный потокобезопасный пул соединений SQLite"""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 archive_path=ARCHIVE_PATH):
+        self.path = path
+        self.archive_path = archive_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect(self.path, self.timeout, self.archive_path)
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            metrics.DB_POOL_WAIT.observe(0)
+            return conn
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            metrics.DB_POOL_TIMEOUTS.inc()
+            raise PoolTimeout(f"Нет свободных соединений с базой за {self.timeout} с")
+        metrics.DB_POOL_WAIT.observe(time.perf_counter() - started)
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение; при успехе фиксирует транзакцию, при ошибке откатывает.
+        Соединение возвращается в пул в любом случае."""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except (sqlite3.ProgrammingError, sqlite3.InterfaceError):
+            # Закрытое или испорченное соединение в пул не возвращаем
+            self.discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.release(conn)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Пул текущего процесса. После fork (воркеры gunicorn) создаётся новый пул,
+    унаследованные от родителя соединения не используются."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool_pid != pid:
+        with _pool_lock:
+            if _pool_pid != pid:
+                _pool = ConnectionPool()
+                _pool_pid = pid
+    return _pool
+
+
+def connection():
+    return get_pool().connection()
+
+
+def pool_state():
+    """Соединения пула этого процесса: всего открыто и свободно"""
+    pool = _pool if _pool_pid == os.getpid() else None
+    if pool is None:
+        return {}
+    return {("open",): pool._created, ("idle",): pool._idle.qsize()}
+
+
+metrics.Gauge('repairs_db_pool_connections', "Соединения пула", ('state',), pool_state)
+
+
+def init_db():
+    """Создаёт и обновляет схему. Воркеры gunicorn вызывают init_db одновременно,
+    поэтому проверки и изменения схемы идут в одной транзакции BEGIN IMMEDIATE:
+    следующий процесс получает блокировку, когда схема уже обновлена, и ничего
+    не повторяет. Соединение отдельное, с долгим ожиданием блокировки: первая
+    миграция большой базы может идти дольше обычного POOL_TIMEOUT."""
+    conn = connect(timeout=MIGRATION_TIMEOUT)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        # AUTOINCREMENT: номер удалённой или перенесённой в архив записи не
+        # достаётся новой, на этом держатся архив и журнал смен статуса
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS repairs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_name TEXT,
+                device_type TEXT,
+                manufacturer TEXT,
+                model TEXT,
+                serial_number TEXT,
+                accessories TEXT,
+                client_address TEXT,
+                status TEXT,
+                status_timestamp TEXT,
+                issue_description TEXT,
+                notes TEXT,
+                version INTEGER NOT NULL DEFAULT 1
+            )
+        """)
+        # Базы, созданные до появления версии записи
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(repairs)")]
+        if 'version' not in columns:
+            cursor.execute("ALTER TABLE repairs ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        rebuild_with_autoincrement(cursor)
+        # Индексы для сортировки и фильтров списка. rowid неявно замыкает каждый
+        # индекс, поэтому индекс (столбец) упорядочен как ORDER BY столбец, id и
+        # страница по ключу читается без сортировки. Составной индекс (a, b) этого
+        # не даёт (внутри a строки упорядочены по b), поэтому для сортировки по
+        # статусу есть отдельный (status), а (status, status_timestamp) и такие же
+        # индексы типа устройства и изготовителя — для фильтра по одному значению
+        # с сортировкой по времени статуса
+        cursor.execute("CREATE INDEX IF NOT EXISTS repairs_client_name ON repairs (client_name)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS repairs_device_type ON repairs (device_type)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS repairs_manufacturer ON repairs (manufacturer)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS repairs_status ON repairs (status, status_timestamp)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS repairs_status_timestamp ON repairs (status_timestamp)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS repairs_status_order ON repairs (status)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS repairs_device_type_timestamp "
+                       "ON repairs (device_type, status_timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS repairs_manufacturer_timestamp "
+                       "ON repairs (manufacturer, status_timestamp)")
+        # Журнал изменений: по одной строке на запись, version растёт монотонно
+        # (AUTOINCREMENT не переиспользует номера), удаления хранятся как tombstone
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS repair_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                repair_id INTEGER NOT NULL UNIQUE,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        for event, ref, deleted in (("INSERT", "NEW", 0), ("UPDATE", "NEW", 0),
+                                    ("DELETE", "OLD", 1)):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS repairs_changes_{event.lower()}
+                AFTER {event} ON repairs
+                BEGIN
+                    DELETE FROM repair_changes WHERE repair_id = {ref}.id;
+                    INSERT INTO repair_changes (repair_id, deleted) VALUES ({ref}.id, {deleted});
+                END
+            """)
+        # Полнотекстовый индекс поверх repairs (external content: текст хранится только
+        # в repairs, индекс синхронизируется триггерами)
+        fts_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'repairs_fts'"
+        ).fetchone()
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS repairs_fts USING fts5(
+                {', '.join(FTS_COLUMNS)},
+                content='repairs', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+        new_values = ', '.join(f"NEW.{column}" for column in FTS_COLUMNS)
+        old_values = ', '.join(f"OLD.{column}" for column in FTS_COLUMNS)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS repairs_fts_insert AFTER INSERT ON repairs
+            BEGIN
+                INSERT INTO repairs_fts (rowid, {', '.join(FTS_COLUMNS)})
+                VALUES (NEW.id, {new_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS repairs_fts_delete AFTER DELETE ON repairs
+            BEGIN
+                INSERT INTO repairs_fts (repairs_fts, rowid, {', '.join(FTS_COLUMNS)})
+                VALUES ('delete', OLD.id, {old_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS repairs_fts_update
+            AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON repairs
+            BEGIN
+                INSERT INTO repairs_fts (repairs_fts, rowid, {', '.join(FTS_COLUMNS)})
+                VALUES ('delete', OLD.id, {old_values});
+                INSERT INTO repairs_fts (rowid, {', '.join(FTS_COLUMNS)})
+                VALUES (NEW.id, {new_values});
+            END
+        """)
+        if not fts_exists:
+            cursor.execute("INSERT INTO repairs_fts (repairs_fts) VALUES ('rebuild')")
+        # Записи, созданные до появления журнала
+        cursor.execute("""
+            INSERT INTO repair_changes (repair_id)
+            SELECT id FROM repairs WHERE id NOT IN (SELECT repair_id FROM repair_changes)
+        """)
+        init_dictionaries(cursor)
+        init_status_history(cursor)
+        init_archive(cursor)
+        # Новые номера — после всех, что были и в repairs, и в архиве
+        cursor.execute("""
+            SELECT MAX(COALESCE((SELECT MAX(id) FROM main.repairs), 0),
+                       COALESCE((SELECT MAX(id) FROM archive.repairs), 0))
+        """)
+        last_id = cursor.fetchone()[0]
+        sequence = cursor.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'repairs'"
+        ).fetchone()
+        if sequence is None:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('repairs', ?)",
+                           (last_id,))
+        elif sequence[0] < last_id:
+            cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'repairs'", (last_id,))
+        init_lookup_keys(cursor, 'main')
+        init_lookup_keys(cursor, 'archive')
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bulk_jobs (
+                id TEXT PRIMARY KEY,
+                action TEXT NOT NULL,
+                value TEXT,
+                filter_sql TEXT NOT NULL,
+                params TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'running',
+                total INTEGER NOT NULL,
+                processed INTEGER NOT NULL DEFAULT 0,
+                affected INTEGER NOT NULL DEFAULT 0,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL NOT NULL,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        init_reviews(cursor)
+        conn.commit()
+    finally:
+        # Незафиксированная транзакция при закрытии откатывается
+        conn.close()
+
+
+def rebuild_with_autoincrement(cursor):
+    """В базах, созданных раньше, id был без AUTOINCREMENT, и SQLite выдавал
+    наибольший номер повторно после удаления последних записей. Таблица
+    пересоздаётся с теми же столбцами и строками; индексы и триггеры на repairs
+    удаляются вместе со старой таблицей и создаются init_db заново. Вставка в
+    новую таблицу триггеров не вызывает, поэтому журналы и счётчики не меняются,
+    а rowid сохраняются — полнотекстовый индекс остаётся верным."""
+    sql = cursor.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'repairs'"
+    ).fetchone()[0]
+    if 'AUTOINCREMENT' in sql.upper():
+        return
+    columns = cursor.execute("PRAGMA main.table_info(repairs)").fetchall()
+    definitions = []
+    for _, name, column_type, notnull, default, primary_key in columns:
+        if primary_key:
+            definitions.append(f"{name} INTEGER PRIMARY KEY AUTOINCREMENT")
+            continue
+        definition = f"{name} {column_type}"
+        if notnull:
+            definition += " NOT NULL"
+        if default is not None:
+            definition += f" DEFAULT {default}"
+        definitions.append(definition)
+    names = ', '.join(column[1] for column in columns)
+    cursor.execute(f"CREATE TABLE main.repairs_rebuild ({', '.join(definitions)})")
+    cursor.execute(f"INSERT INTO main.repairs_rebuild ({names}) SELECT {names} FROM main.repairs")
+    cursor.execute("DROP TABLE main.repairs")
+    # Триггеры журнала смен статуса обращаются к repairs; обычный RENAME заново
+    # разбирает все триггеры и падает, пока repairs нет. В режиме legacy_alter_table
+    # переименование триггеры не трогает, а после него repairs снова существует.
+    cursor.execute("PRAGMA legacy_alter_table=ON")
+    try:
+        cursor.execute("ALTER TABLE main.repairs_rebuild RENAME TO repairs")
+    finally:
+        cursor.execute("PRAGMA legacy_alter_table=OFF")
+
+
+def init_dictionaries(cursor):
+    """Справочники значений DICTIONARY_FIELDS с числом использующих их записей.
+    Счётчики ведут триггеры на repairs, поэтому чтение справочника не сканирует
+    таблицу. dictionary_version растёт, только когда значение появляется или
+    исчезает: клиенту нужно перечитать справочник лишь в этом случае."""
+    dictionaries_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'dictionary_values'"
+    ).fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dictionary_values (
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (field, value)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE TABLE IF NOT EXISTS dictionary_version (version INTEGER NOT NULL)")
+    cursor.execute("""
+        INSERT INTO dictionary_version (version)
+        SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM dictionary_version)
+    """)
+    for event in ("INSERT", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS dictionary_values_{event.lower()}
+            AFTER {event} ON dictionary_values
+            BEGIN
+                UPDATE dictionary_version SET version = version + 1;
+            END
+        """)
+    for field in DICTIONARY_FIELDS:
+        increment = f"""
+            INSERT INTO dictionary_values (field, value, count)
+            SELECT '{field}', NEW.{field}, 1 WHERE NEW.{field} != ''
+            ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+        """
+        decrement = f"""
+            UPDATE dictionary_values SET count = count - 1
+            WHERE field = '{field}' AND value = OLD.{field};
+            DELETE FROM dictionary_values
+            WHERE field = '{field}' AND value = OLD.{field} AND count <= 0;
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS repairs_{field}_insert AFTER INSERT ON repairs
+            BEGIN {increment} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS repairs_{field}_delete AFTER DELETE ON repairs
+            BEGIN {decrement} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS repairs_{field}_update AFTER UPDATE OF {field} ON repairs
+            WHEN OLD.{field} IS NOT NEW.{field}
+            BEGIN {decrement} {increment} END
+        """)
+        if not dictionaries_exist:
+            cursor.execute(f"""
+                INSERT INTO dictionary_values (field, value, count)
+                SELECT '{field}', {field}, COUNT(*) FROM repairs
+                WHERE {field} != '' GROUP BY {field}
+            """)
+
+
+def init_status_history(cursor):
+    """Журнал смен статуса и сводки по нему. Журнал только дополняется; сводки
+    (переходы по дням, число записей в каждом статусе, гистограммы сроков
+    ремонта) ведут триггеры, поэтому их чтение не зависит от длины журнала."""
+    history_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'status_history'"
+    ).fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS status_history (
+            id INTEGER PRIMARY KEY,
+            repair_id INTEGER NOT NULL,
+            old_status TEXT,
+            new_status TEXT NOT NULL,
+            changed_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS status_history_repair "
+                   "ON status_history (repair_id, new_status, changed_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS status_history_changed_at "
+                   "ON status_history (changed_at)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS status_daily (
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, status)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS status_backlog (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS turnaround_buckets (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            total_hours REAL NOT NULL,
+            PRIMARY KEY (dimension, key, bucket)
+        ) WITHOUT ROWID
+    """)
+
+    changed_at = "COALESCE(NEW.status_timestamp, datetime('now', 'localtime'))"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS repairs_status_history_insert AFTER INSERT ON repairs
+        BEGIN
+            INSERT INTO status_history (repair_id, old_status, new_status, changed_at)
+            VALUES (NEW.id, NULL, COALESCE(NEW.status, ''), {changed_at});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS repairs_status_history_update
+        AFTER UPDATE OF status ON repairs
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO status_history (repair_id, old_status, new_status, changed_at)
+            VALUES (NEW.id, OLD.status, COALESCE(NEW.status, ''), {changed_at});
+        END
+    """)
+
+    increment = """
+        INSERT INTO status_backlog (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+        ON CONFLICT (status) DO UPDATE SET count = count + 1;
+    """
+    decrement = """
+        UPDATE status_backlog SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS repairs_backlog_insert AFTER INSERT ON repairs
+        BEGIN {increment} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS repairs_backlog_delete AFTER DELETE ON repairs
+        BEGIN {decrement} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS repairs_backlog_update AFTER UPDATE OF status ON repairs
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN {decrement} {increment} END
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS status_history_daily AFTER INSERT ON status_history
+        BEGIN
+            INSERT INTO status_daily (day, status, count)
+            VALUES (substr(NEW.changed_at, 1, 10), NEW.new_status, 1)
+            ON CONFLICT (day, status) DO UPDATE SET count = count + 1;
+        END
+    """)
+    # Номер корзины по длительности hours
+    bucket = "CASE " + " ".join(
+        f"WHEN hours <= {bound} THEN {i}" for i, bound in enumerate(TURNAROUND_BUCKETS)
+    ) + f" ELSE {len(TURNAROUND_BUCKETS)} END"
+    upserts = "".join(f"""
+        INSERT INTO turnaround_buckets (dimension, key, bucket, count, total_hours)
+        SELECT '{dimension}', {f"COALESCE(r.{dimension}, '')" if dimension else "''"},
+               {bucket}, 1, hours
+        FROM (SELECT (julianday(NEW.changed_at) - julianday(MIN(changed_at))) * 24 AS hours
+              FROM status_history
+              WHERE repair_id = NEW.repair_id AND new_status = '{TURNAROUND_FROM}'),
+             repairs r
+        WHERE r.id = NEW.repair_id AND hours IS NOT NULL
+        ON CONFLICT (dimension, key, bucket)
+        DO UPDATE SET count = count + 1, total_hours = total_hours + excluded.total_hours;
+    """ for dimension in TURNAROUND_DIMENSIONS)
+    # Учитывается только первое завершение ремонта. repair_id однозначен: номера
+    # записей не переиспользуются (AUTOINCREMENT, см. rebuild_with_autoincrement),
+    # иначе журнал новой записи смешался бы с журналом удалённой
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS status_history_turnaround AFTER INSERT ON status_history
+        WHEN NEW.new_status = '{TURNAROUND_TO}' AND NOT EXISTS (
+            SELECT 1 FROM status_history
+            WHERE repair_id = NEW.repair_id AND new_status = '{TURNAROUND_TO}' AND id < NEW.id
+        )
+        BEGIN {upserts} END
+    """)
+
+    if not history_exists:
+        # Для записей, созданных до появления журнала, известен только текущий статус
+        cursor.execute("""
+            INSERT INTO status_history (repair_id, old_status, new_status, changed_at)
+            SELECT id, NULL, COALESCE(status, ''),
+                   COALESCE(status_timestamp, datetime('now', 'localtime'))
+            FROM repairs ORDER BY id
+        """)
+        cursor.execute("""
+            INSERT INTO status_backlog (status, count)
+            SELECT COALESCE(status, ''), COUNT(*) FROM repairs GROUP BY COALESCE(status, '')
+        """)
+
+
+def init_archive(cursor):
+    """Таблица archive.repairs повторяет repairs и хранит закрытые ремонты,
+    перенесённые archive.py, со своим полнотекстовым индексом. Имена в триггерах
+    архива относятся к схеме archive."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS archive.repairs (
+            id INTEGER PRIMARY KEY,
+            {', '.join(f"{column} TEXT" for column in REPAIR_COLUMNS[1:-1])},
+            version INTEGER NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS archive.repairs_status_timestamp "
+                   "ON repairs (status_timestamp)")
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS archive.repairs_fts USING fts5(
+            {', '.join(FTS_COLUMNS)},
+            content='repairs', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    # Записи архива не меняются: перенос заново — это удаление и вставка
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS archive.repairs_fts_insert AFTER INSERT ON repairs
+        BEGIN
+            INSERT INTO repairs_fts (rowid, {', '.join(FTS_COLUMNS)})
+            VALUES (NEW.id, {', '.join(f"NEW.{column}" for column in FTS_COLUMNS)});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS archive.repairs_fts_delete AFTER DELETE ON repairs
+        BEGIN
+            INSERT INTO repairs_fts (repairs_fts, rowid, {', '.join(FTS_COLUMNS)})
+            VALUES ('delete', OLD.id, {', '.join(f"OLD.{column}" for column in FTS_COLUMNS)});
+        END
+    """)
+
+
+def init_reviews(cursor):
+    """Отзывы с сайта. Новый отзыв ждёт модерации (pending), на сайте показываются
+    только одобренные (approved). review_version растёт, только когда меняется
+    набор одобренных отзывов: по ней сайт решает, перечитывать ли список и
+    перерисовывать ли страницу отзывов."""
+    reviews_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'reviews'"
+    ).fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY,
+            author TEXT NOT NULL,
+            email TEXT,
+            rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TEXT NOT NULL,
+            moderated_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS reviews_status ON reviews (status, created_at)")
+    # updated_at — время последнего изменения одобренных отзывов (UTC), для Last-Modified
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS review_version (
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO review_version (version, updated_at)
+        SELECT 1, datetime('now') WHERE NOT EXISTS (SELECT 1 FROM review_version)
+    """)
+    bump = "UPDATE review_version SET version = version + 1, updated_at = datetime('now');"
+    for event, condition in (("INSERT", "NEW.status = 'approved'"),
+                             ("UPDATE", "OLD.status = 'approved' OR NEW.status = 'approved'"),
+                             ("DELETE", "OLD.status = 'approved'")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS reviews_version_{event.lower()}
+            AFTER {event} ON reviews WHEN {condition}
+            BEGIN {bump} END
+        """)
+    if not reviews_exist:
+        # Отзывы, которые раньше были вписаны в шаблон страницы
+        cursor.executemany("""
+            INSERT INTO reviews (author, rating, text, status, created_at, moderated_at)
+            VALUES (?, ?, ?, 'approved', ?, ?)
+        """, [(author, rating, text, created_at, created_at)
+              for author, rating, text, created_at in INITIAL_REVIEWS])
+
+
+def init_lookup_keys(cursor, schema):
+    """Столбцы нормализованных ключей для /lookup с индексами (ключ, id): поиск
+    по префиксу ключа — диапазон по индексу. В базах, созданных раньше,
+    ключи вычисляются для всех записей; в main это попадает в журнал изменений,
+    и клиенты один раз заново получат все записи."""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info(repairs)")]
+    missing = [column for column in LOOKUP_COLUMNS.values() if column not in columns]
+    for column in missing:
+        cursor.execute(f"ALTER TABLE {schema}.repairs ADD COLUMN {column} TEXT")
+    if missing:
+        fields = list(LOOKUP_FIELDS.values())
+        rows = cursor.execute(f"SELECT id, {', '.join(fields)} FROM {schema}.repairs").fetchall()
+        cursor.executemany(
+            f"UPDATE {schema}.repairs SET "
+            f"{', '.join(f'{column} = ?' for column in LOOKUP_COLUMNS.values())} WHERE id = ?",
+            ([*(keys[by] for by in LOOKUP_COLUMNS), row[0]]
+             for keys, row in ((lookup_keys(dict(zip(fields, row[1:]))), row) for row in rows))
+        )
+    for column in LOOKUP_COLUMNS.values():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.repairs_{column} "
+                       f"ON repairs ({column}, id)")
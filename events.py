@@ -0,0 +1,67 @@
+"""Оповещение о новых изменениях в repairs для потоков Server-Sent Events"""
+import os
+import threading
+
+import db
+
+# Как часто проверять журнал изменений: записи из других процессов (воркеров
+# gunicorn) видны подписчикам не позже чем через этот интервал
+POLL_INTERVAL = 0.5
+
+
+class ChangeNotifier:
+    """Один фоновый поток на процесс следит за версией журнала repair_changes
+    и будит всех подписчиков, когда она растёт. Подписчики сами не обращаются
+    к базе, пока ничего не изменилось."""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.version = 0
+        self._condition = threading.Condition()
+        self._wake = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Потоки не переживают fork, поэтому запускаем лениво в каждом процессе
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.version = self._read_version()
+                threading.Thread(target=self._run, name="change-notifier", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _read_version(self):
+        with db.connection() as conn:
+            cursor = conn.execute("SELECT COALESCE(MAX(version), 0) FROM repair_changes")
+            return cursor.fetchone()[0]
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                version = self._read_version()
+            except Exception:
+                continue
+            if version > self.version:
+                with self._condition:
+                    self.version = version
+                    self._condition.notify_all()
+
+    def notify(self):
+        """Сообщает о записи в этом процессе, чтобы не ждать очередной проверки"""
+        if self._pid == os.getpid():
+            self._wake.set()
+
+    def wait(self, version, timeout):
+        """Ждёт, пока версия журнала превысит version, не дольше timeout секунд;
+        возвращает текущую версию"""
+        self._ensure_started()
+        with self._condition:
+            self._condition.wait_for(lambda: self.version > version, timeout)
+            return self.version
+
+
+notifier = ChangeNotifier()
@@ -0,0 +1,80 @@
+"""Потоковое чтение Excel-файла с ремонтами порциями для загрузки на сервер"""
+from openpyxl import load_workbook
+
+from repair_schema import ValidationError, normalize_repair
+from repairs_model import COLUMNS
+
+# Заголовок столбца в файле -> поле записи (время статуса назначает сервер)
+IMPORT_FIELDS = {header: field for field, header, _ in COLUMNS
+                 if field not in (None, "id", "status_timestamp")}
+BATCH_SIZE = 500
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+def records(header, rows):
+    """Пары (номер строки в файле, запись); пустые строки пропускаются"""
+    missing = [name for name in IMPORT_FIELDS if name not in header]
+    if missing:
+        raise ValueError(f"В файле нет столбцов: {', '.join(missing)}")
+    positions = {field: header.index(name) for name, field in IMPORT_FIELDS.items()}
+    # Строка 1 — заголовок
+    for number, row in enumerate(rows, start=2):
+        if not any(value is not None for value in row):
+            continue
+        yield number, {field: cell_text(row[i] if i < len(row) else None)
+                       for field, i in positions.items()}
+
+
+def open_workbook(path):
+    """Возвращает (примерное число строк с данными, итератор записей).
+    .xlsx читается в режиме read_only: строки разбираются по мере чтения,
+    файл целиком в память не загружается."""
+    if path.lower().endswith('.xls'):
+        # Старый формат openpyxl не читает
+        import pandas as pd
+        df = pd.read_excel(path, dtype=object)
+        df = df.where(df.notna(), None)
+        return len(df), records(list(df.columns), df.itertuples(index=False, name=None))
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+    header = [cell_text(value).strip() for value in next(rows, ())]
+    total = (sheet.max_row - 1) if sheet.max_row else None
+
+    def generate():
+        try:
+            yield from records(header, rows)
+        finally:
+            workbook.close()
+
+    return total, generate()
+
+
+def read_batches(path, batch_size=BATCH_SIZE, errors=None):
+    """Возвращает (примерное число записей, итератор порций). Порция — пара
+    (номера строк в файле, записи) не длиннее batch_size. Строки, не прошедшие
+    проверку схемы, на сервер не попадают: если передан список errors, в него
+    добавляются пары (номер строки, сообщение)."""
+    total, items = open_workbook(path)
+
+    def batches():
+        numbers, batch = [], []
+        for number, record in items:
+            try:
+                record = normalize_repair(record)
+            except ValidationError as e:
+                if errors is not None:
+                    errors.append((number, str(e)))
+                continue
+            numbers.append(number)
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield numbers, batch
+                numbers, batch = [], []
+        if batch:
+            yield numbers, batch
+
+    return total, batches()
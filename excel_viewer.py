@@ -0,0 +1,182 @@
+"""Просмотр Excel-файлов: строки читаются из файла по мере прокрутки"""
+from openpyxl import load_workbook
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QTableView, QComboBox, QLineEdit, QLabel
+)
+
+# Сколько строк читать из файла за один fetchMore
+FETCH_BATCH = 200
+# Сколько совпадений набрать при фильтрации, прежде чем остановить чтение файла
+FILTER_MATCHES = 100
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+class ExcelSheetModel(QAbstractTableModel):
+    """Модель одного листа; первая строка листа — заголовки столбцов"""
+
+    def __init__(self, header, rows, total=None, parent=None):
+        super().__init__(parent)
+        self.header = header
+        # Итератор по ещё не прочитанным строкам
+        self._source = rows
+        self._rows = []
+        self._exhausted = False
+        self.total = total
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.header)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row = self._rows[index.row()]
+        return row[index.column()] if index.column() < len(row) else ""
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.header[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        batch = []
+        for row in self._source:
+            batch.append(tuple(cell_text(value) for value in row))
+            if len(batch) == FETCH_BATCH:
+                break
+        else:
+            self._exhausted = True
+        if batch:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(batch) - 1)
+            self._rows.extend(batch)
+            self.endInsertRows()
+
+
+class ExcelWorkbook:
+    """Открытый файл: .xlsx читается openpyxl в режиме read_only (лист не загружается
+    в память целиком), старый .xls целиком через pandas"""
+
+    def __init__(self, path):
+        self.path = path
+        if path.lower().endswith('.xls'):
+            import pandas as pd
+            self._frames = pd.read_excel(path, sheet_name=None, dtype=object)
+            self._workbook = None
+            self.sheet_names = list(self._frames)
+        else:
+            self._frames = None
+            self._workbook = load_workbook(path, read_only=True, data_only=True)
+            self.sheet_names = self._workbook.sheetnames
+
+    def sheet_model(self, name, parent=None):
+        if self._workbook is None:
+            df = self._frames[name]
+            df = df.where(df.notna(), None)
+            return ExcelSheetModel([str(column) for column in df.columns],
+                                   df.itertuples(index=False, name=None), len(df), parent)
+        sheet = self._workbook[name]
+        rows = sheet.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        width = max(len(header), sheet.max_column or 0)
+        header = [cell_text(header[i]) if i < len(header) and header[i] is not None
+                  else f"Столбец {i + 1}" for i in range(width)]
+        total = sheet.max_row - 1 if sheet.max_row else None
+        return ExcelSheetModel(header, rows, total, parent)
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+
+
+class ExcelViewerDialog(QDialog):
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Просмотр Excel")
+        self.workbook = ExcelWorkbook(path)
+
+        self.sheet_box = QComboBox(self)
+        self.sheet_box.addItems(self.workbook.sheet_names)
+        self.sheet_box.currentTextChanged.connect(self.show_sheet)
+        self.column_box = QComboBox(self)
+        self.filter_edit = QLineEdit(self)
+        self.filter_edit.setPlaceholderText("Фильтр по столбцу")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.textChanged.connect(self.apply_filter)
+        self.column_box.currentIndexChanged.connect(self.apply_filter)
+        self.status_label = QLabel(self)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Лист:", self))
+        controls.addWidget(self.sheet_box)
+        controls.addWidget(QLabel("Столбец:", self))
+        controls.addWidget(self.column_box)
+        controls.addWidget(self.filter_edit)
+
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.table = QTableView(self)
+        self.table.setModel(self.proxy)
+        self.proxy.rowsInserted.connect(self.update_status)
+        self.proxy.modelReset.connect(self.update_status)
+        self.proxy.layoutChanged.connect(self.update_status)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.table)
+        layout.addWidget(self.status_label)
+        self.resize(800, 600)
+
+        self.model = None
+        if self.workbook.sheet_names:
+            self.show_sheet(self.workbook.sheet_names[0])
+
+    def show_sheet(self, name):
+        model = self.workbook.sheet_model(name, self)
+        # Первый экран читается сразу, остальное — при прокрутке
+        model.fetchMore()
+        self.proxy.setSourceModel(model)
+        if self.model is not None:
+            self.model.deleteLater()
+        self.model = model
+        self.column_box.blockSignals(True)
+        self.column_box.clear()
+        self.column_box.addItem("Все столбцы")
+        self.column_box.addItems(model.header)
+        self.column_box.blockSignals(False)
+        self.apply_filter()
+
+    def apply_filter(self):
+        self.proxy.setFilterKeyColumn(self.column_box.currentIndex() - 1)
+        self.proxy.setFilterFixedString(self.filter_edit.text())
+        if self.filter_edit.text():
+            # Подходящих строк может не оказаться среди прочитанных: дочитываем файл,
+            # пока не наберётся экран совпадений
+            while self.proxy.rowCount() < FILTER_MATCHES and self.model.canFetchMore():
+                self.model.fetchMore()
+        self.update_status()
+
+    def update_status(self, *args):
+        if self.model is None:
+            return
+        loaded = self.model.rowCount()
+        text = f"Прочитано строк: {loaded}"
+        if self.model.total:
+            text += f" из ~{self.model.total}"
+        if self.filter_edit.text():
+            text += f", совпадений: {self.proxy.rowCount()}"
+        self.status_label.setText(text)
+
+    def done(self, result):
+        self.workbook.close()
+        super().done(result)
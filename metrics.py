@@ -0,0 +1,386 @@
+"""Метрики сервера в формате Prometheus и профилирование медленных запросов.
+
+Счётчики и гистограммы ведутся в памяти процесса: время и размеры HTTP-запросов
+по маршрутам, время SQL-запросов (по виду запроса и таблице), ожидание
+соединения из пула и блокировки записи, группы писателя (write_queue). Если
+задан REPAIRS_METRICS_DIR, каждый процесс (воркер gunicorn) раз в
+FLUSH_INTERVAL секунд сохраняет свои значения в файл этого каталога, а /metrics
+складывает файлы всех живых процессов; без него /metrics показывает только
+ответивший процесс.
+
+    REPAIRS_METRICS=0               сбор отключён (для замера накладных расходов)
+    REPAIRS_PROFILE_SLOW=0.5        профилировать запросы дольше 0,5 с
+    REPAIRS_PROFILE_DIR=profiles    куда писать профили
+
+Профилировщик сэмплирует стек потока запроса раз в PROFILE_INTERVAL и для
+запросов дольше порога пишет свёрнутые стеки (формат flamegraph.pl и
+speedscope). Пока порог не задан, поток сэмплирования не запускается."""
+import bisect
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('REPAIRS_METRICS', '1') != '0'
+METRICS_DIR = os.environ.get('REPAIRS_METRICS_DIR')
+FLUSH_INTERVAL = 5
+# Файлы процессов, не обновлявшиеся дольше этого (процесс завершился), не учитываются
+STALE_AFTER = 60
+PROFILE_SLOW = os.environ.get('REPAIRS_PROFILE_SLOW')
+PROFILE_DIR = os.environ.get('REPAIRS_PROFILE_DIR', 'profiles')
+# Интервал сэмплирования стека, секунды
+PROFILE_INTERVAL = 0.005
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                 1, 5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+GROUP_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+_registry = []
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [число наблюдений в каждой корзине (последняя — +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), [list(counts), total]]
+                    for labels, (counts, total) in self._values.items()]
+
+
+class Gauge:
+    """Текущее значение, снимаемое функцией collect() -> {метки: значение} в
+    момент выдачи; значения разных процессов различаются меткой pid"""
+    type = 'gauge'
+
+    def __init__(self, name, description, labels=(), collect=None):
+        self.name = name
+        self.description = description
+        self.labels = labels + ('pid',)
+        self.collect = collect
+        _registry.append(self)
+
+    def snapshot(self):
+        pid = str(os.getpid())
+        return [[list(labels) + [pid], value] for labels, value in self.collect().items()]
+
+
+HTTP_REQUESTS = Counter('repairs_http_requests_total', "HTTP-запросы",
+                        ('route', 'method', 'status'))
+HTTP_ERRORS = Counter('repairs_http_errors_total', "Ответы с кодом 4xx и 5xx",
+                      ('route', 'status'))
+HTTP_DURATION = Histogram('repairs_http_request_duration_seconds',
+                          "Время обработки запроса до отправки заголовков", ('route', 'method'))
+HTTP_REQUEST_SIZE = Histogram('repairs_http_request_size_bytes', "Размер тела запроса",
+                              ('route',), SIZE_BUCKETS)
+HTTP_RESPONSE_SIZE = Histogram('repairs_http_response_size_bytes',
+                               "Размер тела ответа (после сжатия; потоковые не учитываются)",
+                               ('route',), SIZE_BUCKETS)
+DB_QUERY_DURATION = Histogram('repairs_db_query_duration_seconds',
+                              "Время execute SQL-запроса (для SELECT — до первой строки)",
+                              ('query',), QUERY_BUCKETS)
+DB_ROWS = Counter('repairs_db_rows_total', "Строк изменено INSERT/UPDATE/DELETE", ('query',))
+DB_ERRORS = Counter('repairs_db_errors_total', "Ошибки SQL-запросов", ('query', 'error'))
+DB_LOCK_WAIT = Histogram('repairs_db_lock_wait_seconds',
+                         "Ожидание блокировки записи (BEGIN IMMEDIATE)", (), QUERY_BUCKETS)
+DB_POOL_WAIT = Histogram('repairs_db_pool_wait_seconds', "Ожидание соединения из пула", (),
+                         QUERY_BUCKETS)
+DB_POOL_TIMEOUTS = Counter('repairs_db_pool_timeouts_total',
+                           "Запросы, не дождавшиеся соединения из пула")
+WRITE_GROUP_SIZE = Histogram('repairs_write_group_size', "Операций в группе писателя", (),
+                             GROUP_BUCKETS)
+WRITE_GROUP_DURATION = Histogram('repairs_write_group_duration_seconds',
+                                 "Время записи группы, включая ожидание блокировки и fsync")
+
+
+# Вид запроса и первая таблица: "SELECT repairs", "INSERT repair_changes", "BEGIN IMMEDIATE"
+SQL_VERB = re.compile(r'\s*(\w+)(?:\s+(IMMEDIATE|EXCLUSIVE|DEFERRED)\b)?', re.I)
+SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+([\w.]+)', re.I)
+SQL_WRITES = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+SQL_WITH_TABLE = SQL_WRITES | {'SELECT', 'WITH'}
+# Текст SQL -> метка; тексты с переменным числом параметров не кэшируются сверх предела
+_query_labels = {}
+QUERY_LABELS_LIMIT = 2000
+
+
+def query_label(sql):
+    label = _query_labels.get(sql)
+    if label is None:
+        match = SQL_VERB.match(sql)
+        verb = ' '.join(part.upper() for part in match.groups() if part) if match else '?'
+        table = SQL_TABLE.search(sql) if verb in SQL_WITH_TABLE else None
+        label = f"{verb} {table.group(1)}" if table else verb
+        if len(_query_labels) < QUERY_LABELS_LIMIT:
+            _query_labels[sql] = label
+    return label
+
+
+def _timed(method, cursor, sql, params):
+    label = query_label(sql)
+    started = time.perf_counter()
+    try:
+        result = method(cursor, sql, params)
+    except sqlite3.Error as e:
+        DB_ERRORS.inc(label, type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        DB_QUERY_DURATION.observe(elapsed, label)
+        if label.startswith('BEGIN '):
+            DB_LOCK_WAIT.observe(elapsed)
+    if label.split()[0] in SQL_WRITES and cursor.rowcount > 0:
+        DB_ROWS.inc(label, amount=cursor.rowcount)
+    return result
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed(sqlite3.Cursor.execute, self, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _timed(sqlite3.Cursor.executemany, self, sql, seq_of_parameters)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, замеряющее каждый запрос (sqlite3.connect(factory=...))"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class SlowRequestProfiler:
+    """Сэмплирующий профилировщик: один поток на процесс раз в interval снимает
+    стеки потоков, обрабатывающих запросы"""
+
+    def __init__(self, threshold, directory=PROFILE_DIR, interval=PROFILE_INTERVAL):
+        self.threshold = None if threshold is None else float(threshold)
+        self.directory = directory
+        self.interval = interval
+        self._active = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.threshold is None:
+            return
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._active = {}
+                    threading.Thread(target=self._run, name="request-profiler",
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        self._active[threading.get_ident()] = StackCounter()
+
+    def stop(self, name, duration):
+        if self.threshold is None:
+            return
+        samples = self._active.pop(threading.get_ident(), None)
+        if samples and duration >= self.threshold:
+            self._write(name, duration, samples)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, samples in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[self._stack(frame)] += 1
+
+    @staticmethod
+    def _stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                         f"{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _write(self, name, duration, samples):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^\w-]+', '_', name).strip('_') or 'root'
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                            f"{slug}-{int(duration * 1000)}ms.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info("Медленный запрос %s (%.3f с), профиль: %s", name, duration, path)
+
+
+profiler = SlowRequestProfiler(PROFILE_SLOW)
+
+
+def observe_request(route, method, status, duration, request_size, response_size):
+    if not ENABLED:
+        return
+    HTTP_REQUESTS.inc(route, method, str(status))
+    if status >= 400:
+        HTTP_ERRORS.inc(route, str(status))
+    HTTP_DURATION.observe(duration, route, method)
+    if request_size:
+        HTTP_REQUEST_SIZE.observe(request_size, route)
+    if response_size is not None:
+        HTTP_RESPONSE_SIZE.observe(response_size, route)
+    _ensure_flusher()
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in _registry}
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    if METRICS_DIR is None or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+            _flusher_pid = os.getpid()
+
+
+def _flush_loop():
+    while True:
+        try:
+            flush()
+        except OSError:
+            logger.exception("Не удалось сохранить метрики")
+        time.sleep(FLUSH_INTERVAL)
+
+
+def flush():
+    """Сохраняет значения этого процесса в METRICS_DIR"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def collect():
+    """Значения всех процессов (если задан METRICS_DIR) или только этого"""
+    if METRICS_DIR is None:
+        return [snapshot()]
+    flush()
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            if time.time() - os.path.getmtime(path) > STALE_AFTER:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(metric, snapshots):
+    merged = {}
+    for values in snapshots:
+        for labels, value in values.get(metric.name, []):
+            key = tuple(labels)
+            if metric.type != 'histogram':
+                merged[key] = merged.get(key, 0) + value
+            elif key in merged:
+                counts, total = merged[key]
+                merged[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+            else:
+                merged[key] = value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render():
+    """Текстовый формат Prometheus (version 0.0.4)"""
+    snapshots = collect()
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for labels, value in sorted(_merge(metric, snapshots).items()):
+            if metric.type != 'histogram':
+                lines.append(f"{metric.name}{_labels(metric.labels, labels)} {value}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(list(metric.buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f"{metric.name}_bucket"
+                             f"{_labels(metric.labels, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labels, labels)} {total}")
+            lines.append(f"{metric.name}_count{_labels(metric.labels, labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
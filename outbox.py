@@ -0,0 +1,121 @@
+"""Локальная очередь заявок бота, ещё не доставленных на Flask-сервер"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = 'outbox.db'
+# Сколько заявок отправлять одним запросом /receive_bulk
+BATCH_SIZE = 50
+REQUEST_TIMEOUT = 10
+# Задержка перед повтором растёт вдвое с каждой неудачей, но не больше MAX_BACKOFF секунд
+MAX_BACKOFF = 300
+# Как часто проверять очередь, если о новых заявках не сообщили
+IDLE_INTERVAL = 30
+
+
+class Outbox:
+    """Очередь на SQLite: заявка сохраняется на диск до ответа пользователю и
+    удаляется только после того, как сервер её принял"""
+
+    def __init__(self, path=OUTBOX_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL,
+                    last_error TEXT
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt)"
+            )
+        self._pending = asyncio.Event()
+
+    def _put(self, payload):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO outbox (payload, next_attempt) VALUES (?, ?)",
+                               (json.dumps(payload, ensure_ascii=False), time.time()))
+
+    async def put(self, payload):
+        # Запись с fsync выполняется вне цикла событий
+        await asyncio.to_thread(self._put, payload)
+        self._pending.set()
+
+    def _due(self, limit):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, payload, attempts FROM outbox WHERE next_attempt <= ? "
+                "ORDER BY id LIMIT ?", (time.time(), limit)
+            ).fetchall()
+
+    def _next_attempt(self):
+        with self._lock:
+            return self._conn.execute("SELECT MIN(next_attempt) FROM outbox").fetchone()[0]
+
+    def _delete(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def _postpone(self, rows, error):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                [(attempts + 1, time.time() + backoff(attempts), error, record_id)
+                 for record_id, _, attempts in rows]
+            )
+
+    async def drain(self, client, url):
+        """Бесконечно отправляет накопившиеся заявки пачками; при ошибке сети или
+        сервера откладывает пачку с экспоненциальной задержкой"""
+        while True:
+            # Сбрасываем до чтения очереди, чтобы не пропустить заявку, добавленную
+            # между чтением и ожиданием
+            self._pending.clear()
+            rows = await asyncio.to_thread(self._due, BATCH_SIZE)
+            if not rows:
+                next_attempt = await asyncio.to_thread(self._next_attempt)
+                timeout = IDLE_INTERVAL if next_attempt is None \
+                    else min(max(next_attempt - time.time(), 0), IDLE_INTERVAL)
+                try:
+                    await asyncio.wait_for(self._pending.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                response = await client.post(url, json=[json.loads(row[1]) for row in rows],
+                                              timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                result = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning("Не удалось отправить %d заявок: %s", len(rows), e)
+                await asyncio.to_thread(self._postpone, rows, str(e))
+                continue
+            for error in result.get('errors', []):
+                # Повтор не поможет: сервер отверг саму заявку
+                logger.error("Сервер отклонил заявку %s: %s",
+                             rows[error['row'] - 1][1], error['message'])
+            await asyncio.to_thread(self._delete, [row[0] for row in rows])
+            logger.info("Отправлено заявок: %d", len(rows))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def backoff(attempts):
+    delay = min(2 ** attempts, MAX_BACKOFF)
+    # Разброс, чтобы после сбоя сервера повторы не приходили одновременно
+    return delay * random.uniform(0.5, 1.0)
@@ -1,44 +1,96 @@
+import json
+import logging
+import os
 import sys
+import time
+
+# Точка отсчёта для профиля запуска (startup_profile.py)
+STARTED = time.perf_counter()
+
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QTableWidget, QTableWidgetItem, QVBoxLayout,
+    QApplication, QMainWindow, QTableView,
     QWidget, QToolBar, QAction, QDialog, QFormLayout, QLineEdit, QTextEdit,
-    QPushButton, QComboBox, QMessageBox, QFileDialog
+    QPushButton, QComboBox, QMessageBox, QFileDialog, QAbstractItemView, QProgressDialog,
+    QCompleter, QMenu, QToolButton, QLabel
 )
-from PyQt5.QtCore import Qt, QTimer
-import pandas as pd
-import requests
+from PyQt5.QtCore import Qt, QTimer, QObject, QEvent, QStandardPaths, QStringListModel
 from datetime import datetime
 
+import client_cache
+from api_client import ApiClient, ApiError, EventStream, parse_response, REQUEST_TIMEOUT
+from repair_lookup import RepairLookup
+from repair_schema import LOOKUP_FIELDS, LOOKUP_KEYS, STATUSES, ValidationError, normalize_repair
+from repairs_model import (
+    COLUMNS, FIELDS, ACTIONS_COLUMN, RepairsModel, RepairsFilterModel, DeleteButtonDelegate
+)
+
+logger = logging.getLogger(__name__)
+
 # URL Flask-сервера (замените на актуальный домен/IP и порт при хостинге)
 FLASK_URL = "http://192.168.1.100:5000"  # При хостинге: "https://your-domain.com"
+# Файл для отметок профиля запуска; задаётся startup_profile.py
+STARTUP_PROFILE = os.environ.get("REPAIRS_STARTUP_PROFILE")
+CACHED_MESSAGE = "Показаны сохранённые данные, идёт обновление..."
+SEARCH_DELAY = 300  # мс
+# Пауза ввода перед запросом подсказок прежних ремонтов, мс
+LOOKUP_DELAY = 250
+# Поля, которые выбранный прежний ремонт заполняет, если они ещё пустые
+PREFILL_FIELDS = ("client_name", "client_address", "device_type", "manufacturer", "model",
+                  "serial_number", "accessories")
+# Как часто спрашивать сервер о ходе массовой операции, с
+BULK_POLL_INTERVAL = 0.5
+# Фильтр диалога сохранения -> формат выгрузки /export
+EXPORT_FILTERS = {
+    "Excel files (*.xlsx)": "xlsx",
+    "CSV files (*.csv)": "csv",
+    "Parquet files (*.parquet)": "parquet",
+}
+# Значения выпадающих списков, пока справочники сервера не загружены (и в дополнение к ним)
+DEFAULT_DICTIONARIES = {
+    "device_type": ["Смартфон", "Планшет", "Ноутбук", "ПК", "Другое"],
+    "manufacturer": ["Apple", "Samsung", "Xiaomi", "HP", "Dell", "Другое"],
+    "accessories": ["Коробка", "Наушники", "Блок питания", "Другое"],
+}
+
+
+def ranked_completer(values, parent):
+    """Автодополнение по подстроке; варианты идут в порядке списка, то есть
+    самые частые первыми"""
+    completer = QCompleter(values, parent)
+    completer.setCaseSensitivity(Qt.CaseInsensitive)
+    completer.setFilterMode(Qt.MatchContains)
+    return completer
 
 
 class RepairDialog(QDialog):
     def __init__(self, parent=None, data=None, device_types=None, manufacturers=None,
-                 accessories=None):
+                 accessories=None, lookup=None):
         super().__init__(parent)
         self.setWindowTitle("Ремонт")
         self.layout = QFormLayout(self)
 
         # Списки для выпадающих меню
-        self.device_types = device_types or ["Смартфон", "Планшет", "Ноутбук", "ПК", "Другое"]
-        self.manufacturers = manufacturers or ["Apple", "Samsung", "Xiaomi", "HP", "Dell", "Другое"]
-        self.accessories_list = accessories or ["Коробка", "Наушники", "Блок питания", "Другое"]
-        self.statuses = ["принят", "сдан в ремонт", "готов", "выдан"]
+        self.device_types = device_types or DEFAULT_DICTIONARIES["device_type"]
+        self.manufacturers = manufacturers or DEFAULT_DICTIONARIES["manufacturer"]
+        self.accessories_list = accessories or DEFAULT_DICTIONARIES["accessories"]
+        self.statuses = list(STATUSES)
 
         # Поля ввода
         self.client_name = QLineEdit(self)
         self.device_type = QComboBox(self)
         self.device_type.setEditable(True)
         self.device_type.addItems(self.device_types)
+        self.device_type.setCompleter(ranked_completer(self.device_types, self.device_type))
         self.manufacturer = QComboBox(self)
         self.manufacturer.setEditable(True)
         self.manufacturer.addItems(self.manufacturers)
+        self.manufacturer.setCompleter(ranked_completer(self.manufacturers, self.manufacturer))
         self.model = QLineEdit(self)
         self.serial_number = QLineEdit(self)
         self.accessories = QComboBox(self)
         self.accessories.setEditable(True)
         self.accessories.addItems(self.accessories_list)
+        self.accessories.setCompleter(ranked_completer(self.accessories_list, self.accessories))
         self.client_address = QLineEdit(self)
         self.status = QComboBox(self)
         self.status.addItems(self.statuses)
@@ -59,10 +111,38 @@ class RepairDialog(QDialog):
         self.layout.addRow("Неисправность:", self.issue_description)
         self.layout.addRow("Примечания:", self.notes)
 
+        # Прежние ремонты того же клиента или устройства (см. RepairLookup)
+        self.history_label = QLabel(self)
+        self.history_label.setWordWrap(True)
+        self.history_label.hide()
+        self.layout.addRow(self.history_label)
+
         self.save_button = QPushButton("Сохранить", self)
         self.save_button.clicked.connect(self.accept)
         self.layout.addWidget(self.save_button)
 
+        self.lookup = lookup
+        # вид ключа -> поле ввода с подсказками и {текст подсказки: ремонт}
+        self.lookup_edits = {"name": self.client_name, "serial": self.serial_number,
+                             "phone": self.client_address}
+        self.suggestions = {by: {} for by in self.lookup_edits}
+        if lookup is not None:
+            self.lookup_timer = QTimer(self)
+            self.lookup_timer.setSingleShot(True)
+            self.lookup_timer.setInterval(LOOKUP_DELAY)
+            self.lookup_timer.timeout.connect(self.request_lookup)
+            self.pending_lookup = None
+            for by, edit in self.lookup_edits.items():
+                completer = QCompleter(QStringListModel(self), edit)
+                # Сервер уже отобрал совпадения по нормализованному ключу
+                completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+                completer.activated[str].connect(
+                    lambda text, by=by: self.apply_suggestion(by, text)
+                )
+                edit.setCompleter(completer)
+                edit.textEdited.connect(lambda text, by=by: self.schedule_lookup(by))
+            lookup.found.connect(self.on_lookup_found)
+
         if data:
             self.client_name.setText(data[0])
             self.device_type.setCurrentText(data[1])
@@ -75,32 +155,112 @@ class RepairDialog(QDialog):
             self.issue_description.setText(data[9])
             self.notes.setText(data[10])
 
+    def schedule_lookup(self, by):
+        self.pending_lookup = by
+        self.lookup_timer.start()
+
+    def request_lookup(self):
+        by = self.pending_lookup
+        self.lookup.lookup(by, self.lookup_edits[by].text())
+
+    def on_lookup_found(self, by, key, repairs):
+        edit = self.lookup_edits[by]
+        # Ответ на устаревший ввод
+        if (LOOKUP_KEYS[by](edit.text(), partial=True) or "") != key:
+            return
+        suggestions = {}
+        seen = set()
+        for repair in repairs:
+            # Один вариант на устройство (серийный номер) или клиента (ФИО и телефон),
+            # по самому свежему ремонту: внутри ключа сервер отдаёт их первыми
+            if by == "serial":
+                group = LOOKUP_KEYS["serial"](repair["serial_number"])
+                text = f"{repair['serial_number']} — {repair['manufacturer']} {repair['model']}, " \
+                       f"{repair['client_name']}"
+            else:
+                group = (LOOKUP_KEYS["name"](repair["client_name"]),
+                         LOOKUP_KEYS["phone"](repair["client_address"]))
+                text = f"{repair['client_name']}, {repair['client_address']}"
+            if group in seen:
+                continue
+            seen.add(group)
+            suggestions[f"{text} ({(repair['status_timestamp'] or '')[:10]})"] = repair
+        self.suggestions[by] = suggestions
+        completer = edit.completer()
+        completer.model().setStringList(list(suggestions))
+        if suggestions and edit.hasFocus():
+            completer.complete()
+        self.show_history(by, key, repairs)
+
+    def show_history(self, by, key, repairs):
+        """Сколько ремонтов было у этого устройства или клиента и чем закончился последний"""
+        if by == "phone":
+            return
+        field = "serial_number" if by == "serial" else "client_name"
+        same = [repair for repair in repairs if LOOKUP_KEYS[by](repair[field]) == key]
+        if not same:
+            self.history_label.hide()
+            return
+        last = same[0]
+        subject = "устройства" if by == "serial" else "клиента"
+        self.history_label.setText(
+            f"Прежние ремонты {subject}: {len(same)}. Последний: "
+            f"{(last['status_timestamp'] or '')[:10]}, {last['status']} — "
+            f"{last['issue_description'] or 'без описания'}"
+        )
+        self.history_label.show()
+
+    def apply_suggestion(self, by, text):
+        repair = self.suggestions[by].get(text)
+        if repair is None:
+            return
+        # Сначала само поле: комплитер вставил в него текст подсказки целиком
+        self.lookup_edits[by].setText(repair[LOOKUP_FIELDS[by]] or "")
+        for field in PREFILL_FIELDS:
+            widget = getattr(self, field)
+            if isinstance(widget, QComboBox):
+                if not widget.currentText():
+                    widget.setCurrentText(repair[field] or "")
+            elif not widget.text():
+                widget.setText(repair[field] or "")
+
+    def done(self, result):
+        if self.lookup is not None:
+            self.lookup_timer.stop()
+            self.lookup.found.disconnect(self.on_lookup_found)
+            self.lookup = None
+        super().done(result)
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Учет ремонтов")
         self.resize(1800, 800)
+        self.api = ApiClient(FLASK_URL, self)
+        self.lookup = RepairLookup(self.api, self)
 
-        # Инициализация списков для пользовательских значений
-        self.custom_device_types = ["Смартфон", "Планшет", "Ноутбук", "ПК", "Другое"]
-        self.custom_manufacturers = ["Apple", "Samsung", "Xiaomi", "HP", "Dell", "Другое"]
-        self.custom_accessories = ["Коробка", "Наушники", "Блок питания", "Другое"]
-
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(12)
-        self.table.setHorizontalHeaderLabels(
-            [
-                "ID", "ФИО клиента", "Тип устройства", "Изготовитель", "Модель",
-                "Серийный номер", "Комплектация", "Адрес клиента", "Статус",
-                "Время статуса", "Неисправность", "Примечания", "Действия"
-            ]
-        )
+        # Значения выпадающих списков по убыванию частоты (справочники сервера)
+        self.dictionaries = {field: list(values) for field, values in DEFAULT_DICTIONARIES.items()}
+        self.dictionaries_etag = None
+
+        self.model = RepairsModel(self)
+        self.proxy = RepairsFilterModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.table = QTableView(self)
+        self.table.setModel(self.proxy)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.table.setMouseTracking(True)
+        self.delete_delegate = DeleteButtonDelegate(self.table)
+        self.delete_delegate.clicked.connect(
+            lambda index: self.delete_record(self.record_id_at(index)))
+        self.table.setItemDelegateForColumn(ACTIONS_COLUMN, self.delete_delegate)
         self.table.setColumnHidden(0, True)
-        self.table.cellDoubleClicked.connect(self.edit_record)
-        self.table.cellClicked.connect(self.show_issue_description)
-        column_widths = [0, 150, 150, 150, 150, 150, 150, 150, 100, 150, 200, 200, 100]
-        for i, width in enumerate(column_widths):
+        self.table.doubleClicked.connect(self.edit_record)
+        self.table.clicked.connect(self.show_issue_description)
+        for i, (_, _, width) in enumerate(COLUMNS):
             self.table.setColumnWidth(i, width)
         self.setCentralWidget(self.table)
 
@@ -115,6 +275,17 @@ class MainWindow(QMainWindow):
         self.add_action = QAction("Добавить запись", self)
         self.add_action.triggered.connect(self.add_record)
         self.toolbar.addAction(self.add_action)
+        self.delete_selected_action = QAction("Удалить выбранные", self)
+        self.delete_selected_action.triggered.connect(self.delete_selected_records)
+        self.toolbar.addAction(self.delete_selected_action)
+        self.status_menu = QMenu(self)
+        for status in STATUSES:
+            self.status_menu.addAction(status).triggered.connect(
+                lambda checked, status=status: self.set_selected_status(status))
+        self.status_action = QAction("Статус выбранных", self)
+        self.status_action.setMenu(self.status_menu)
+        self.toolbar.addAction(self.status_action)
+        self.toolbar.widgetForAction(self.status_action).setPopupMode(QToolButton.InstantPopup)
         self.delete_all_action = QAction("Удалить все", self)
         self.delete_all_action.triggered.connect(self.delete_all_records)
         self.toolbar.addAction(self.delete_all_action)
@@ -122,80 +293,224 @@ class MainWindow(QMainWindow):
         self.view_excel_action.triggered.connect(self.view_excel_file)
         self.toolbar.addAction(self.view_excel_action)
 
+        # Поиск по серверному полнотекстовому индексу; запрос уходит, когда ввод
+        # затих на SEARCH_DELAY мс
+        self.search_box = QLineEdit(self)
+        self.search_box.setPlaceholderText("Поиск: ФИО, серийный номер, модель, неисправность")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setMaximumWidth(400)
+        self.search_box.textChanged.connect(self.search_timer_restart)
+        self.toolbar.addSeparator()
+        self.toolbar.addWidget(self.search_box)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.search_records)
+
+        # Версия журнала изменений на сервере, до которой синхронизирована таблица
+        self.repairs_version = 0
+
+        # Изменения приходят через поток /events; опрос раз в 5 секунд включается,
+        # только пока поток недоступен
         self.timer = QTimer()
         self.timer.timeout.connect(self.load_data)
+        self.events = EventStream(FLASK_URL, lambda: self.repairs_version, self)
+        self.events.connected.connect(self.on_events_connected)
+        self.events.disconnected.connect(self.on_events_disconnected)
+        self.events.changes.connect(self.on_changes_loaded)
+        # Поток подписывается после первой загрузки: с since=0 он повторил бы её
+        self.events_started = False
+
+        # Пока идёт первый запрос, показываем данные с прошлого запуска
+        self.cache_path = os.path.join(
+            QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation),
+            client_cache.CACHE_FILE
+        )
+        self.load_cache()
+
+    def load_cache(self):
+        path = self.cache_path
+        self.api.submit(lambda session: client_cache.load(path, FLASK_URL),
+                        on_success=self.on_cache_loaded, on_error=lambda error: self.start_sync())
+
+    def on_cache_loaded(self, cache):
+        if cache:
+            self.model.load_snapshot(cache['columns'])
+            self.repairs_version = cache['version']
+            self.dictionaries.update(cache['dictionaries'])
+            self.dictionaries_etag = cache['dictionaries_etag']
+            self.statusBar().showMessage(CACHED_MESSAGE)
+        # Синхронизация начинается с версии кэша, поэтому придут только изменения
+        self.start_sync()
+
+    def start_sync(self):
         self.timer.start(5000)  # Обновление каждые 5 секунд
         self.load_data()
+        self.load_dictionaries()
 
-    def load_data(self):
+    def save_cache(self):
         try:
-            response = requests.get(f"{FLASK_URL}/get_repairs", timeout=5)
-            if response.status_code == 200:
-                rows = response.json()
-                self.table.setRowCount(len(rows))
-
-                # Обновляем списки пользовательских значений
-                new_device_types = set(self.custom_device_types)
-                new_manufacturers = set(self.custom_manufacturers)
-                new_accessories = set(self.custom_accessories)
-
-                for row in rows:
-                    if row['device_type'] and row['device_type'] not in new_device_types:
-                        new_device_types.add(row['device_type'])
-                    if row['manufacturer'] and row['manufacturer'] not in new_manufacturers:
-                        new_manufacturers.add(row['manufacturer'])
-                    if row['accessories'] and row['accessories'] not in new_accessories:
-                        new_accessories.add(row['accessories'])
-
-                # Обновляем списки
-                self.custom_device_types = sorted(list(new_device_types))
-                self.custom_manufacturers = sorted(list(new_manufacturers))
-                self.custom_accessories = sorted(list(new_accessories))
-
-                # Заполняем таблицу
-                for i, row in enumerate(rows):
-                    self.table.setItem(i, 0, QTableWidgetItem(str(row['id'])))
-                    self.table.setItem(i, 1, QTableWidgetItem(row['client_name']))
-                    self.table.setItem(i, 2, QTableWidgetItem(row['device_type']))
-                    self.table.setItem(i, 3, QTableWidgetItem(row['manufacturer']))
-                    self.table.setItem(i, 4, QTableWidgetItem(row['model']))
-                    self.table.setItem(i, 5, QTableWidgetItem(row['serial_number']))
-                    self.table.setItem(i, 6, QTableWidgetItem(row['accessories']))
-                    self.table.setItem(i, 7, QTableWidgetItem(row['client_address']))
-                    self.table.setItem(i, 8, QTableWidgetItem(row['status']))
-                    self.table.setItem(i, 9, QTableWidgetItem(row['status_timestamp']))
-                    self.table.setItem(i, 10, QTableWidgetItem(row['issue_description']))
-                    self.table.setItem(i, 11, QTableWidgetItem(row['notes']))
-                    delete_button = QPushButton("Удалить")
-                    delete_button.clicked.connect(
-                        lambda checked, r=i, id=row['id']: self.delete_record(r, id))
-                    self.table.setCellWidget(i, 12, delete_button)
-            else:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка сервера: {response.status_code}")
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {str(e)}")
+            client_cache.save(self.cache_path, FLASK_URL, self.repairs_version,
+                              self.model.snapshot(), self.dictionaries, self.dictionaries_etag)
+        except OSError as e:
+            logger.warning("Не удалось сохранить кэш %s: %s", self.cache_path, e)
+
+    def load_data(self):
+        since = self.repairs_version
+
+        def fetch(session):
+            # Записи приходят столбцами (без имён полей в каждой строке), словари
+            # собираются здесь, в фоновом потоке
+            changes = parse_response(session.get(
+                f"{FLASK_URL}/get_repairs", params={'since': since, 'format': 'columns'},
+                timeout=REQUEST_TIMEOUT
+            ))
+            upserts = changes['upserts']
+            changes['upserts'] = [dict(zip(upserts['columns'], row)) for row in upserts['rows']]
+            changes['since'] = since
+            return changes
+
+        # Пока предыдущий запрос не завершился, новые тики таймера его не дублируют
+        self.api.submit(fetch, on_success=self.on_changes_loaded, on_error=self.on_load_failed,
+                        key='load_data')
+
+    def on_changes_loaded(self, changes):
+        if changes['version'] < changes.get('since', 0):
+            # База на сервере пересоздана: кэш и таблица ей больше не соответствуют
+            self.model.load_snapshot({})
+            self.repairs_version = 0
+            self.statusBar().showMessage("Данные на сервере заменены, загрузка заново...")
+            self.load_data()
+            return
+        if self.statusBar().currentMessage() == CACHED_MESSAGE:
+            self.statusBar().clearMessage()
+        # Ответ опроса может прийти позже события из /events с более новыми данными
+        if changes['version'] > self.repairs_version:
+            self.apply_changes(changes['upserts'], changes['deleted'])
+            self.repairs_version = changes['version']
+        if not self.events_started:
+            self.events_started = True
+            self.events.start()
+
+    def on_events_connected(self):
+        self.timer.stop()
+        self.statusBar().clearMessage()
+        # Догоняем изменения, сделанные, пока подписки не было
+        self.load_data()
+
+    def on_events_disconnected(self):
+        if not self.timer.isActive():
+            self.timer.start(5000)
+
+    def on_load_failed(self, error):
+        # Опрос повторяется каждые 5 секунд, поэтому без модальных окон
+        self.statusBar().showMessage(f"Не удалось загрузить данные: {error}")
+
+    def apply_changes(self, upserts, deleted):
+        """Вливает изменения с сервера в модель, не перестраивая таблицу целиком"""
+        self.model.apply_changes(upserts, deleted)
+        if upserts or deleted:
+            # Среди найденных прежних ремонтов могли появиться новые
+            self.lookup.cache.clear()
+            # Сервер ответит 304, если новых значений в справочниках не появилось
+            self.load_dictionaries()
+
+    def load_dictionaries(self):
+        etag = self.dictionaries_etag
+
+        def fetch(session):
+            headers = {'If-None-Match': etag} if etag else {}
+            response = session.get(f"{FLASK_URL}/dictionaries", headers=headers,
+                                   timeout=REQUEST_TIMEOUT)
+            if response.status_code == 304:
+                return None
+            return response.headers.get('ETag'), parse_response(response)
+
+        self.api.submit(fetch, on_success=self.on_dictionaries_loaded,
+                        on_error=self.on_load_failed, key='dictionaries')
+
+    def on_dictionaries_loaded(self, result):
+        if result is None:
+            return
+        self.dictionaries_etag, dictionaries = result
+        for field, defaults in DEFAULT_DICTIONARIES.items():
+            values = [item['value'] for item in dictionaries.get(field, [])]
+            # Стандартные значения — после используемых, если их среди них нет
+            used = set(values)
+            self.dictionaries[field] = values + [value for value in defaults if value not in used]
+
+    def repair_dialog(self, data=None):
+        return RepairDialog(self, data, device_types=self.dictionaries['device_type'],
+                            manufacturers=self.dictionaries['manufacturer'],
+                            accessories=self.dictionaries['accessories'], lookup=self.lookup)
+
+    def record_id_at(self, index):
+        return self.model.record_id(self.proxy.mapToSource(index).row())
+
+    def row_data_at(self, index):
+        return self.model.row_data(self.proxy.mapToSource(index).row())
+
+    def search_timer_restart(self):
+        self.search_timer.start(SEARCH_DELAY)
+
+    def search_records(self):
+        text = self.search_box.text().strip()
+        if not text:
+            self.api.cancel_key('search')
+            self.proxy.set_search_results(None)
+            self.statusBar().clearMessage()
+            return
+        # Более новый запрос отменяет ещё не завершившийся предыдущий
+        self.api.get("/search", params={'q': text}, on_success=self.on_search_results,
+                     on_error=lambda e: self.show_error("Не удалось выполнить поиск", e),
+                     key='search', replace=True)
+
+    def on_search_results(self, results):
+        items = results['items']
+        self.proxy.set_search_results({item['id']: item['snippet'] for item in items})
+        self.statusBar().showMessage(f"Найдено записей: {len(items)}")
+
+    def show_error(self, message, error):
+        QMessageBox.critical(self, "Ошибка", f"{message}: {str(error)}")
 
     def save_data(self):
-        try:
-            data = [[self.table.item(i, j).text() for j in range(1, 12)]
-                    for i in range(self.table.rowCount())]
-            df = pd.DataFrame(data, columns=[
-                "ФИО клиента", "Тип устройства", "Изготовитель", "Модель",
-                "Серийный номер", "Комплектация", "Адрес клиента", "Статус",
-                "Время статуса", "Неисправность", "Примечания"
-            ])
-            file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить файл", "",
-                                                       "Excel files (*.xlsx)")
-            if file_path:
-                df.to_excel(file_path, index=False)
-                QMessageBox.information(self, "Успех", f"Данные выгружены в {file_path}")
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", str(e))
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Сохранить файл", "", ";;".join(EXPORT_FILTERS))
+        if not file_path:
+            return
+        export_format = EXPORT_FILTERS.get(selected_filter, "xlsx")
+        extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+        if extension in EXPORT_FILTERS.values():
+            export_format = extension
+        else:
+            file_path += f".{export_format}"
+
+        def download(session):
+            # Файл формирует сервер, клиент только пишет поток на диск; до конца
+            # загрузки данные лежат во временном файле рядом
+            with session.get(f"{FLASK_URL}/export", params={'format': export_format},
+                             stream=True, timeout=(REQUEST_TIMEOUT, 60)) as response:
+                if response.status_code != 200:
+                    parse_response(response)
+                partial_path = file_path + ".part"
+                with open(partial_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            os.replace(partial_path, file_path)
+            return file_path
+
+        def on_success(path):
+            self.statusBar().clearMessage()
+            QMessageBox.information(self, "Успех", f"Данные выгружены в {path}")
+
+        def on_error(error):
+            self.statusBar().clearMessage()
+            self.show_error("Не удалось выгрузить данные", error)
+
+        self.statusBar().showMessage("Выгрузка данных...")
+        self.api.submit(download, on_success=on_success, on_error=on_error)
 
     def add_record(self):
-        dialog = RepairDialog(self, device_types=self.custom_device_types,
-                              manufacturers=self.custom_manufacturers,
-                              accessories=self.custom_accessories)
+        dialog = self.repair_dialog()
         if dialog.exec_():
             data = {
                 'client_name': dialog.client_name.text(),
@@ -209,37 +524,29 @@ class MainWindow(QMainWindow):
                 'issue_description': dialog.issue_description.toPlainText(),
                 'notes': dialog.notes.toPlainText()
             }
+            # Проверяем по той же схеме, что и сервер, чтобы не отправлять заведомо
+            # некорректную запись
             try:
-                response = requests.post(f"{FLASK_URL}/receive", json=data, timeout=5)
-                if response.status_code == 200:
-                    # Добавляем пользовательские значения в списки
-                    if data['device_type'] and data['device_type'] not in self.custom_device_types:
-                        self.custom_device_types.append(data['device_type'])
-                        self.custom_device_types.sort()
-                    if data['manufacturer'] and data[
-                        'manufacturer'] not in self.custom_manufacturers:
-                        self.custom_manufacturers.append(data['manufacturer'])
-                        self.custom_manufacturers.sort()
-                    if data['accessories'] and data['accessories'] not in self.custom_accessories:
-                        self.custom_accessories.append(data['accessories'])
-                        self.custom_accessories.sort()
-                    QMessageBox.information(self, "Успех", "Запись добавлена")
-                    self.load_data()
-                else:
-                    QMessageBox.critical(self, "Ошибка", f"Ошибка сервера: {response.status_code}")
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось добавить запись: {str(e)}")
+                data = normalize_repair(data)
+            except ValidationError as e:
+                QMessageBox.warning(self, "Ошибка", str(e))
+                return
+
+            def on_success(result):
+                QMessageBox.information(self, "Успех", "Запись добавлена")
+                self.load_data()
+
+            self.api.post("/receive", json=data, on_success=on_success,
+                          on_error=lambda e: self.show_error("Не удалось добавить запись", e))
 
-    def edit_record(self, row, column):
-        if column == 12:
+    def edit_record(self, index):
+        if index.column() == ACTIONS_COLUMN:
             return
-        id_item = self.table.item(row, 0)
-        if id_item:
-            record_id = int(id_item.text())
-            data = [self.table.item(row, i).text() for i in range(1, 12)]
-            dialog = RepairDialog(self, data, device_types=self.custom_device_types,
-                                  manufacturers=self.custom_manufacturers,
-                                  accessories=self.custom_accessories)
+        row = self.row_data_at(index)
+        if row:
+            record_id = row['id']
+            data = ["" if row[field] is None else str(row[field]) for field in FIELDS[1:]]
+            dialog = self.repair_dialog(data)
             if dialog.exec_():
                 new_data = {
                     'client_name': dialog.client_name.text(),
@@ -253,139 +560,230 @@ class MainWindow(QMainWindow):
                     'issue_description': dialog.issue_description.toPlainText(),
                     'notes': dialog.notes.toPlainText()
                 }
+                # Отправляем только изменённые поля и версию, с которой начиналось
+                # редактирование
+                changes = {field: value for field, value in new_data.items()
+                           if value != ("" if row[field] is None else str(row[field]))}
+                if not changes:
+                    return
                 try:
-                    response = requests.delete(f"{FLASK_URL}/delete_repair/{record_id}", timeout=5)
-                    if response.status_code != 200:
-                        raise Exception(f"Ошибка удаления: {response.status_code}")
-                    response = requests.post(f"{FLASK_URL}/receive", json=new_data, timeout=5)
-                    if response.status_code == 200:
-                        # Добавляем пользовательские значения в списки
-                        if new_data['device_type'] and new_data[
-                            'device_type'] not in self.custom_device_types:
-                            self.custom_device_types.append(new_data['device_type'])
-                            self.custom_device_types.sort()
-                        if new_data['manufacturer'] and new_data[
-                            'manufacturer'] not in self.custom_manufacturers:
-                            self.custom_manufacturers.append(new_data['manufacturer'])
-                            self.custom_manufacturers.sort()
-                        if new_data['accessories'] and new_data[
-                            'accessories'] not in self.custom_accessories:
-                            self.custom_accessories.append(new_data['accessories'])
-                            self.custom_accessories.sort()
-                        QMessageBox.information(self, "Успех", "Запись обновлена")
-                        self.load_data()
+                    changes = normalize_repair(changes, partial=True)
+                except ValidationError as e:
+                    QMessageBox.warning(self, "Ошибка", str(e))
+                    return
+                changes['version'] = row['version']
+
+                def on_success(result):
+                    self.apply_changes([result['repair']], [])
+                    QMessageBox.information(self, "Успех", "Запись обновлена")
+
+                def on_error(error):
+                    if isinstance(error, ApiError) and error.status_code == 409:
+                        self.apply_changes([error.data['repair']], [])
+                        QMessageBox.warning(self, "Конфликт",
+                                            "Запись уже изменил другой пользователь. "
+                                            "Таблица обновлена, повторите изменение.")
                     else:
-                        raise Exception(f"Ошибка сервера: {response.status_code}")
-                except Exception as e:
-                    QMessageBox.critical(self, "Ошибка", f"Не удалось обновить запись: {str(e)}")
+                        self.show_error("Не удалось обновить запись", error)
 
-    def show_issue_description(self, row, column):
-        if column == 10:
-            issue = self.table.item(row, 10).text()
+                self.api.patch(f"/repairs/{record_id}", json=changes, on_success=on_success,
+                               on_error=on_error)
+
+    def show_issue_description(self, index):
+        if index.column() == 10:
+            issue = index.data()
             QMessageBox.information(self, "Неисправность", issue)
-        elif column == 11:
-            notes = self.table.item(row, 11).text()
+        elif index.column() == 11:
+            notes = index.data()
             QMessageBox.information(self, "Примечания", notes)
 
-    def delete_record(self, row, record_id):
+    def delete_record(self, record_id):
         reply = QMessageBox.question(self, "Подтверждение",
                                      f"Вы уверены, что хотите удалить запись ID {record_id}?",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            try:
-                response = requests.delete(f"{FLASK_URL}/delete_repair/{record_id}", timeout=5)
-                if response.status_code == 200:
-                    QMessageBox.information(self, "Успех", "Запись удалена")
-                    self.load_data()
-                else:
-                    QMessageBox.critical(self, "Ошибка", f"Ошибка сервера: {response.status_code}")
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось удалить запись: {str(e)}")
+            def on_success(result):
+                QMessageBox.information(self, "Успех", "Запись удалена")
+                self.load_data()
+
+            self.api.delete(f"/delete_repair/{record_id}", on_success=on_success,
+                            on_error=lambda e: self.show_error("Не удалось удалить запись", e))
 
     def delete_all_records(self):
         reply = QMessageBox.question(self, "Подтверждение",
                                      "Вы уверены, что хотите удалить все записи?",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            try:
-                response = requests.delete(f"{FLASK_URL}/delete_all_repairs", timeout=5)
-                if response.status_code == 200:
-                    # Очищаем пользовательские списки, оставляя только начальные значения
-                    self.custom_device_types = ["Смартфон", "Планшет", "Ноутбук", "ПК", "Другое"]
-                    self.custom_manufacturers = ["Apple", "Samsung", "Xiaomi", "HP", "Dell",
-                                                 "Другое"]
-                    self.custom_accessories = ["Коробка", "Наушники", "Блок питания", "Другое"]
-                    QMessageBox.information(self, "Успех", "Все записи удалены")
-                    self.load_data()
-                else:
-                    QMessageBox.critical(self, "Ошибка", f"Ошибка сервера: {response.status_code}")
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось удалить записи: {str(e)}")
+            self.run_bulk("DELETE", "/delete_all_repairs", None, "Удаление записей",
+                          "Удалено записей")
+
+    def selected_ids(self):
+        return [self.record_id_at(index) for index in self.table.selectionModel().selectedRows()]
+
+    def delete_selected_records(self):
+        ids = self.selected_ids()
+        if not ids:
+            QMessageBox.information(self, "Удаление", "Выберите записи в таблице")
+            return
+        reply = QMessageBox.question(self, "Подтверждение",
+                                     f"Удалить выбранные записи ({len(ids)})?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.run_bulk("POST", "/bulk", {"action": "delete", "ids": ids},
+                          "Удаление записей", "Удалено записей")
+
+    def set_selected_status(self, status):
+        ids = self.selected_ids()
+        if not ids:
+            QMessageBox.information(self, "Статус", "Выберите записи в таблице")
+            return
+        self.run_bulk("POST", "/bulk", {"action": "status", "status": status, "ids": ids},
+                      "Смена статуса", f"Переведено в статус «{status}» записей")
+
+    def run_bulk(self, method, path, payload, title, done_message):
+        """Запускает массовую операцию на сервере и показывает её ход; сами
+        изменения приходят в таблицу обычным путём (через /events)"""
+        progress_dialog = QProgressDialog(f"{title}...", "Отмена", 0, 0, self)
+        progress_dialog.setWindowTitle(title)
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+
+        def run(session, progress):
+            job = parse_response(session.request(method, f"{FLASK_URL}{path}", json=payload,
+                                                 timeout=REQUEST_TIMEOUT))['job']
+            while job['state'] == 'running':
+                if not progress((job['processed'], job['total'])):
+                    # Отмена останавливает задание; обработанные порции остаются
+                    session.delete(f"{FLASK_URL}/bulk/{job['id']}", timeout=REQUEST_TIMEOUT)
+                    break
+                time.sleep(BULK_POLL_INTERVAL)
+                job = parse_response(session.get(f"{FLASK_URL}/bulk/{job['id']}",
+                                                 timeout=REQUEST_TIMEOUT))['job']
+            return job
+
+        def on_progress(value):
+            processed, total = value
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(min(processed, total))
+
+        def on_success(job):
+            progress_dialog.close()
+            if job['state'] == 'failed':
+                QMessageBox.critical(self, "Ошибка", f"{title}: {job['error']}")
+            else:
+                QMessageBox.information(self, "Успех", f"{done_message}: {job['affected']}")
+            self.load_data()
+
+        def on_error(error):
+            progress_dialog.close()
+            self.show_error(f"{title}: ошибка", error)
+
+        task = self.api.submit(run, on_success=on_success, on_error=on_error,
+                               on_progress=on_progress)
+        progress_dialog.canceled.connect(task.cancel)
+        progress_dialog.show()
 
     def view_excel_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Выбрать файл Excel", "",
                                                    "Excel files (*.xlsx *.xls)")
         if file_path:
             try:
-                df = pd.read_excel(file_path)
-                dialog = QDialog(self)
-                dialog.setWindowTitle("Просмотр Excel")
-                layout = QVBoxLayout(dialog)
-                table = QTableWidget(dialog)
-                table.setRowCount(df.shape[0])
-                table.setColumnCount(df.shape[1])
-                table.setHorizontalHeaderLabels(df.columns)
-                for i in range(df.shape[0]):
-                    for j in range(df.shape[1]):
-                        table.setItem(i, j, QTableWidgetItem(str(df.iat[i, j])))
-                layout.addWidget(table)
-                dialog.setLayout(layout)
-                dialog.resize(800, 600)
+                # openpyxl (и pandas для .xls) загружаются при первом обращении,
+                # а не при запуске
+                from excel_viewer import ExcelViewerDialog
+                dialog = ExcelViewerDialog(file_path, self)
                 dialog.exec_()
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", str(e))
 
     def load_excel_file(self):
-        try:
-            file_path, _ = QFileDialog.getOpenFileName(self, "Выбрать файл Excel", "",
-                                                       "Excel files (*.xlsx *.xls)")
-            if file_path:
-                df = pd.read_excel(file_path)
-                for index, row in df.iterrows():
-                    data = {
-                        'client_name': str(row["ФИО клиента"]),
-                        'device_type': str(row["Тип устройства"]),
-                        'manufacturer': str(row["Изготовитель"]),
-                        'model': str(row["Модель"]),
-                        'serial_number': str(row["Серийный номер"]),
-                        'accessories': str(row["Комплектация"]),
-                        'client_address': str(row["Адрес клиента"]),
-                        'status': str(row["Статус"]),
-                        'issue_description': str(row["Неисправность"]),
-                        'notes': str(row["Примечания"])
-                    }
-                    response = requests.post(f"{FLASK_URL}/receive", json=data, timeout=5)
-                    if response.status_code != 200:
-                        raise Exception(f"Ошибка сервера: {response.status_code}")
-                    # Добавляем пользовательские значения в списки
-                    if data['device_type'] and data['device_type'] not in self.custom_device_types:
-                        self.custom_device_types.append(data['device_type'])
-                        self.custom_device_types.sort()
-                    if data['manufacturer'] and data[
-                        'manufacturer'] not in self.custom_manufacturers:
-                        self.custom_manufacturers.append(data['manufacturer'])
-                        self.custom_manufacturers.sort()
-                    if data['accessories'] and data['accessories'] not in self.custom_accessories:
-                        self.custom_accessories.append(data['accessories'])
-                        self.custom_accessories.sort()
-                QMessageBox.information(self, "Успех", "Данные загружены из файла")
-                self.load_data()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {str(e)}")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Выбрать файл Excel", "",
+                                                   "Excel files (*.xlsx *.xls)")
+        if not file_path:
+            return
+        progress_dialog = QProgressDialog("Загрузка данных из файла...", "Отмена", 0, 0, self)
+        progress_dialog.setWindowTitle("Загрузка")
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+
+        def upload(session, progress):
+            # Файл читается и отправляется порциями в фоновом потоке
+            from excel_import import read_batches
+            invalid = []
+            total, batches = read_batches(file_path, errors=invalid)
+            inserted, errors, done = 0, [], 0
+            for numbers, batch in batches:
+                result = parse_response(session.post(f"{FLASK_URL}/receive_bulk", json=batch,
+                                                     timeout=REQUEST_TIMEOUT * 6))
+                inserted += result['inserted']
+                errors.extend(f"Строка {numbers[error['row'] - 1]}: {error['message']}"
+                              for error in result['errors'])
+                done += len(batch)
+                if not progress((done, total)):
+                    break
+            errors[:0] = [f"Строка {number}: {message}" for number, message in invalid]
+            return inserted, errors
+
+        def on_progress(value):
+            done, total = value
+            if total:
+                progress_dialog.setMaximum(total)
+            progress_dialog.setValue(min(done, total) if total else 0)
+            progress_dialog.setLabelText(f"Загружено записей: {done}")
+
+        def on_success(result):
+            progress_dialog.close()
+            inserted, errors = result
+            message = f"Данные загружены из файла: {inserted} записей"
+            if errors:
+                message += f"\nНе загружено строк: {len(errors)}\n" + "\n".join(errors[:20])
+                QMessageBox.warning(self, "Загрузка", message)
+            else:
+                QMessageBox.information(self, "Успех", message)
+            self.load_data()
+
+        def on_error(error):
+            progress_dialog.close()
+            self.show_error("Не удалось загрузить данные", error)
+
+        task = self.api.submit(upload, on_success=on_success, on_error=on_error,
+                               on_progress=on_progress)
+        progress_dialog.canceled.connect(task.cancel)
+        progress_dialog.show()
+
+class FirstPaintProfiler(QObject):
+    """Для startup_profile.py: при первой отрисовке таблицы записывает отметки
+    времени запуска в STARTUP_PROFILE и закрывает приложение"""
+
+    def __init__(self, marks, parent=None):
+        super().__init__(parent)
+        self.marks = marks
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            obj.removeEventFilter(self)
+            self.marks['first_paint'] = time.perf_counter() - STARTED
+            with open(STARTUP_PROFILE, 'w', encoding='utf-8') as f:
+                json.dump({'marks': self.marks, 'first_paint_at': time.time()}, f)
+            QTimer.singleShot(0, QApplication.quit)
+        return False
 
 
 if __name__ == "__main__":
+    marks = {'imports': time.perf_counter() - STARTED}
     app = QApplication(sys.argv)
+    # Имя задаёт каталог кэша (QStandardPaths.AppLocalDataLocation)
+    app.setApplicationName("Repairs")
     window = MainWindow()
+    marks['window'] = time.perf_counter() - STARTED
+    if STARTUP_PROFILE:
+        profiler = FirstPaintProfiler(marks, window)
+        window.table.viewport().installEventFilter(profiler)
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    exit_code = app.exec_()
+    if not STARTUP_PROFILE:
+        window.save_cache()
+    window.events.stop()
+    window.api.cancel_all()
+    window.api.pool.waitForDone(REQUEST_TIMEOUT * 1000)
+    sys.exit(exit_code)
\ No newline at end of file
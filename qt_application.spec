@@ -1,16 +1,43 @@
 # -*- mode: python ; coding: utf-8 -*-
+# Сборка клиента:
+#   pyinstaller qt_application.spec                      # один файл (onefile)
+#   set REPAIRS_ONEDIR=1 && pyinstaller qt_application.spec
+# onedir-сборка (каталог dist/qt_application) запускается заметно быстрее:
+# onefile при каждом запуске распаковывает всё содержимое во временный каталог.
+# REPAIRS_NO_PANDAS=1 исключает pandas и numpy: сборка меньше, но без чтения .xls.
+# Время запуска: python startup_profile.py --exe dist/qt_application/qt_application.exe
+import os
 
+ONEDIR = os.environ.get('REPAIRS_ONEDIR') == '1'
+NO_PANDAS = os.environ.get('REPAIRS_NO_PANDAS') == '1'
+
+# Модули, которые клиенту не нужны, но подтягиваются анализом зависимостей
+# (серверная часть, бот, тестовые и научные пакеты, неиспользуемые модули Qt)
+EXCLUDES = [
+    'tkinter', 'test', 'lib2to3',
+    'flask', 'werkzeug', 'jinja2', 'gunicorn', 'telegram', 'httpx', 'apscheduler',
+    'orjson', 'brotli', 'pyarrow', 'fastparquet',
+    'matplotlib', 'scipy', 'IPython', 'jedi', 'sqlalchemy', 'pytest',
+    'pandas.tests', 'numpy.tests', 'openpyxl.tests',
+    'PyQt5.QtWebEngine', 'PyQt5.QtWebEngineCore', 'PyQt5.QtWebEngineWidgets',
+    'PyQt5.QtQml', 'PyQt5.QtQuick', 'PyQt5.QtMultimedia', 'PyQt5.QtBluetooth',
+    'PyQt5.QtNetwork', 'PyQt5.QtSql', 'PyQt5.QtSvg', 'PyQt5.QtOpenGL',
+    'PyQt5.QtPrintSupport', 'PyQt5.QtXml', 'PyQt5.QtDBus', 'PyQt5.QtDesigner',
+]
+if NO_PANDAS:
+    EXCLUDES += ['pandas', 'numpy']
 
 a = Analysis(
     ['qt_application.py'],
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # Импортируются внутри функций (при первом обращении к Excel)
+    hiddenimports=['excel_import', 'excel_viewer'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=EXCLUDES,
     noarchive=False,
     optimize=0,
 )
@@ -19,14 +46,16 @@ pyz = PYZ(a.pure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
+    [] if ONEDIR else a.binaries,
+    [] if ONEDIR else a.datas,
     [],
+    exclude_binaries=ONEDIR,
     name='qt_application',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # Сжатые UPX библиотеки распаковываются при каждой загрузке, что замедляет запуск
+    upx=False,
     upx_exclude=[],
     runtime_tmpdir=None,
     console=True,
@@ -36,3 +65,14 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+if ONEDIR:
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='qt_application',
+    )
@@ -0,0 +1,84 @@
+"""Подсказки прежних ремонтов для RepairDialog: запросы к /lookup с кэшем"""
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from api_client import parse_response, REQUEST_TIMEOUT
+from repair_schema import LOOKUP_FIELDS, LOOKUP_KEYS, LOOKUP_MIN_LENGTH
+
+LOOKUP_LIMIT = 20
+CACHE_SIZE = 200
+# Сколько секунд ответ считается свежим; при изменениях с сервера кэш сбрасывается
+CACHE_TTL = 120
+
+
+class LookupCache:
+    """Ответы /lookup по (вид ключа, префикс ключа), не больше size штук. Если
+    для более короткого префикса сервер вернул все совпадения (complete), ответ
+    для более длинного получается из него фильтрацией, без запроса."""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, by, key):
+        now = time.monotonic()
+        for length in range(len(key), LOOKUP_MIN_LENGTH[by] - 1, -1):
+            entry = self._entries.get((by, key[:length]))
+            if entry is None or now - entry[0] > self.ttl:
+                continue
+            _, repairs, complete = entry
+            if length == len(key):
+                self._entries.move_to_end((by, key))
+                return repairs
+            if complete:
+                to_key = LOOKUP_KEYS[by]
+                return [repair for repair in repairs
+                        if (to_key(repair.get(LOOKUP_FIELDS[by])) or "").startswith(key)]
+        return None
+
+    def put(self, by, key, repairs, complete):
+        self._entries[(by, key)] = (time.monotonic(), repairs, complete)
+        self._entries.move_to_end((by, key))
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class RepairLookup(QObject):
+    """Ищет прежние ремонты в фоне; результат приходит сигналом found(вид, ключ,
+    ремонты). Новый запрос того же вида отменяет ещё не завершённый."""
+    found = pyqtSignal(str, str, list)
+
+    def __init__(self, api, parent=None):
+        super().__init__(parent)
+        self.api = api
+        self.cache = LookupCache()
+
+    def lookup(self, by, text):
+        key = LOOKUP_KEYS[by](text, partial=True) or ""
+        if len(key) < LOOKUP_MIN_LENGTH[by]:
+            self.found.emit(by, key, [])
+            return
+        cached = self.cache.get(by, key)
+        if cached is not None:
+            self.found.emit(by, key, cached)
+            return
+        url = f"{self.api.base_url}/lookup"
+
+        def fetch(session):
+            return parse_response(session.get(
+                url, params={'by': by, 'q': text, 'limit': LOOKUP_LIMIT}, timeout=REQUEST_TIMEOUT
+            ))
+
+        def on_success(result):
+            self.cache.put(by, key, result['repairs'], result.get('complete', False))
+            self.found.emit(by, key, result['repairs'])
+
+        # Подсказки не критичны: при ошибке поле просто остаётся без них
+        self.api.submit(fetch, on_success=on_success, on_error=lambda error: None,
+                        key=f"lookup-{by}", replace=True)
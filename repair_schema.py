@@ -0,0 +1,148 @@
+"""Общая схема заявки на ремонт для сервера, бота и приложения.
+
+Версия 1 — поля таблицы repairs. Заявки бота (type, description, contact, user)
+приводятся к ним функцией from_bot; старые заявки бота без schema_version,
+которые могли остаться в очереди, сервер распознаёт и приводит сам."""
+import re
+
+SCHEMA_VERSION = 1
+
+STATUSES = ["принят", "сдан в ремонт", "готов", "выдан"]
+DEFAULT_STATUS = "принят"
+
+# Поле -> максимальная длина; длиннее обрезается
+FIELD_LIMITS = {
+    "client_name": 200,
+    "device_type": 100,
+    "manufacturer": 100,
+    "model": 200,
+    "serial_number": 100,
+    "accessories": 200,
+    "client_address": 300,
+    "status": 20,
+    "issue_description": 5000,
+    "notes": 5000,
+}
+FIELDS = tuple(FIELD_LIMITS)
+
+# Поле заявки бота -> поле ремонта
+BOT_FIELDS = {
+    "type": "device_type",
+    "description": "issue_description",
+    "contact": "client_address",
+    "user": "client_name",
+}
+BOT_NOTE = "Заявка из Telegram-бота"
+
+
+# Поиск прежних ремонтов (/lookup): вид ключа -> поле ремонта. Ключи хранятся
+# в отдельных индексированных столбцах repairs (db.LOOKUP_COLUMNS)
+LOOKUP_FIELDS = {
+    "serial": "serial_number",
+    "phone": "client_address",
+    "name": "client_name",
+}
+# Минимальная длина ключа для поиска по префиксу
+LOOKUP_MIN_LENGTH = {"serial": 3, "phone": 4, "name": 3}
+PHONE_RE = re.compile(r"\+?\d[\d\s()-]{5,}\d")
+
+
+class ValidationError(ValueError):
+    pass
+
+
+def _text_validator(field, limit):
+    def validate(value):
+        if value is None:
+            return ""
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValidationError(f"Поле {field} должно быть строкой")
+        if not isinstance(value, str):
+            value = str(value)
+        return value.strip()[:limit]
+    return validate
+
+
+def _status_validator(value):
+    status = _text_validator("status", FIELD_LIMITS["status"])(value).lower()
+    if not status:
+        return DEFAULT_STATUS
+    if status not in STATUSES:
+        raise ValidationError(f"Неизвестный статус: {status}")
+    return status
+
+
+# Проверки строятся один раз при импорте, а не на каждую запись
+VALIDATORS = {field: _text_validator(field, limit) for field, limit in FIELD_LIMITS.items()}
+VALIDATORS["status"] = _status_validator
+
+
+def is_bot_payload(data):
+    return "schema_version" not in data and any(key in data for key in BOT_FIELDS) \
+        and not any(key in data for key in FIELDS)
+
+
+def from_bot(data):
+    """Заявка бота в полях ремонта (версия схемы SCHEMA_VERSION)"""
+    record = {field: data.get(key, "") for key, field in BOT_FIELDS.items()}
+    record["notes"] = BOT_NOTE
+    record["schema_version"] = SCHEMA_VERSION
+    return record
+
+
+def normalize_repair(data, partial=False):
+    """Проверяет и нормализует запись. Возвращает словарь только с полями ремонта;
+    при partial=True — только с переданными полями (для PATCH). Поля вне схемы
+    отбрасываются, некорректные значения дают ValidationError."""
+    if not isinstance(data, dict):
+        raise ValidationError("Запись должна быть объектом")
+    if is_bot_payload(data):
+        data = from_bot(data)
+    version = data.get("schema_version", SCHEMA_VERSION)
+    if version != SCHEMA_VERSION:
+        raise ValidationError(f"Версия схемы {version} не поддерживается")
+    if partial:
+        return {field: VALIDATORS[field](data[field]) for field in FIELDS if field in data}
+    record = {field: VALIDATORS[field](data.get(field)) for field in FIELDS}
+    if not any(record[field] for field in FIELDS if field != "status"):
+        raise ValidationError("Пустая заявка")
+    return record
+
+
+def serial_key(value, partial=False):
+    """Серийный номер без пробелов, дефисов и прочих разделителей, в верхнем регистре"""
+    return re.sub(r"[\W_]+", "", value or "").upper() or None
+
+
+def phone_key(value, partial=False):
+    """Цифры первого телефона в строке (адрес клиента может содержать и другой
+    текст); у российских номеров префикс +7/8 отбрасывается. partial=True —
+    начало номера, набираемое в поле поиска: берутся все цифры, а первая 7 или 8
+    отбрасывается, как только набрана вторая цифра — в сохранённых ключах кода
+    страны нет, поэтому «7916» ищется как «916»"""
+    value = value or ""
+    if partial:
+        digits = re.sub(r"\D", "", value)
+        if len(digits) >= 2 and digits[0] in "78":
+            digits = digits[1:]
+        return digits or None
+    match = PHONE_RE.search(value)
+    if not match:
+        return None
+    digits = re.sub(r"\D", "", match.group())
+    if len(digits) == 11 and digits[0] in "78":
+        digits = digits[1:]
+    return digits
+
+
+def name_key(value, partial=False):
+    """ФИО в нижнем регистре, с одиночными пробелами и «е» вместо «ё»"""
+    return " ".join((value or "").lower().replace("ё", "е").split()) or None
+
+
+LOOKUP_KEYS = {"serial": serial_key, "phone": phone_key, "name": name_key}
+
+
+def lookup_keys(record):
+    """Ключи поиска записи: вид ключа -> значение (None, если поле пустое)"""
+    return {by: LOOKUP_KEYS[by](record.get(field)) for by, field in LOOKUP_FIELDS.items()}
@@ -0,0 +1,199 @@
+"""Модель таблицы ремонтов для QTableView"""
+from PyQt5.QtCore import (
+    Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel, QEvent, pyqtSignal
+)
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+
+# (поле записи, заголовок, ширина столбца)
+COLUMNS = [
+    ("id", "ID", 0),
+    ("client_name", "ФИО клиента", 150),
+    ("device_type", "Тип устройства", 150),
+    ("manufacturer", "Изготовитель", 150),
+    ("model", "Модель", 150),
+    ("serial_number", "Серийный номер", 150),
+    ("accessories", "Комплектация", 150),
+    ("client_address", "Адрес клиента", 150),
+    ("status", "Статус", 100),
+    ("status_timestamp", "Время статуса", 150),
+    ("issue_description", "Неисправность", 200),
+    ("notes", "Примечания", 200),
+    (None, "Действия", 100),
+]
+FIELDS = [field for field, _, _ in COLUMNS if field]
+# Поля записи, которые модель хранит, но не показывает
+RECORD_FIELDS = FIELDS + ["version"]
+ACTIONS_COLUMN = len(COLUMNS) - 1
+# Сколько строк показывать за один fetchMore
+FETCH_BATCH = 500
+
+
+class RepairsModel(QAbstractTableModel):
+    """Записи хранятся по столбцам (список значений на поле), строки отдаются
+    представлению порциями через fetchMore, изменения с сервера применяются
+    точечно: dataChanged для изменённых строк, rowsInserted/rowsRemoved для остальных."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._columns = {field: [] for field in RECORD_FIELDS}
+        self._row_of_id = {}
+        # Сколько строк уже отдано представлению
+        self._loaded = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+        if column == ACTIONS_COLUMN:
+            return "Удалить" if role == Qt.DisplayRole else None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            value = self._columns[FIELDS[column]][index.row()]
+            return "" if value is None else str(value)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section][1]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded < len(self._columns["id"])
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(FETCH_BATCH, len(self._columns["id"]) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def fetch_all(self):
+        while self.canFetchMore():
+            self.fetchMore()
+
+    def record_id(self, row):
+        return self._columns["id"][row]
+
+    def row_data(self, row):
+        return {field: self._columns[field][row] for field in RECORD_FIELDS}
+
+    def rows(self):
+        """Все записи модели, в том числе ещё не показанные"""
+        return (self.row_data(row) for row in range(len(self._columns["id"])))
+
+    def snapshot(self):
+        """Копия всех записей по столбцам (для кэша на диске)"""
+        return {field: list(values) for field, values in self._columns.items()}
+
+    def load_snapshot(self, columns):
+        """Заменяет содержимое модели записями из snapshot(); показывается
+        первая порция строк, остальные подгрузит fetchMore"""
+        self.beginResetModel()
+        count = len(columns.get("id", []))
+        self._columns = {field: list(columns.get(field) or [None] * count)
+                         for field in RECORD_FIELDS}
+        self._row_of_id = {record_id: row for row, record_id in enumerate(self._columns["id"])}
+        self._loaded = min(count, FETCH_BATCH)
+        self.endResetModel()
+
+    def apply_changes(self, upserts, deleted):
+        removed_rows = sorted((self._row_of_id.pop(record_id) for record_id in deleted
+                               if record_id in self._row_of_id), reverse=True)
+        for row in removed_rows:
+            visible = row < self._loaded
+            if visible:
+                self.beginRemoveRows(QModelIndex(), row, row)
+            for values in self._columns.values():
+                del values[row]
+            if visible:
+                self._loaded -= 1
+                self.endRemoveRows()
+        if removed_rows:
+            self._row_of_id = {record_id: row for row, record_id in enumerate(self._columns["id"])}
+
+        new_rows = []
+        for record in upserts:
+            row = self._row_of_id.get(record["id"])
+            if row is None:
+                new_rows.append(record)
+                continue
+            if any(self._columns[field][row] != record.get(field) for field in RECORD_FIELDS):
+                changed = [column for column, field in enumerate(FIELDS)
+                           if self._columns[field][row] != record.get(field)]
+                for field in RECORD_FIELDS:
+                    self._columns[field][row] = record.get(field)
+                if changed and row < self._loaded:
+                    self.dataChanged.emit(self.index(row, changed[0]),
+                                          self.index(row, changed[-1]))
+
+        if new_rows:
+            first = len(self._columns["id"])
+            # Если все строки уже показаны, новые (не больше порции) показываем сразу,
+            # остальные подгрузит fetchMore при прокрутке
+            visible = min(len(new_rows), FETCH_BATCH) if self._loaded == first else 0
+            if visible:
+                self.beginInsertRows(QModelIndex(), first, first + visible - 1)
+            for offset, record in enumerate(new_rows):
+                self._row_of_id[record["id"]] = first + offset
+                for field in RECORD_FIELDS:
+                    self._columns[field].append(record.get(field))
+            if visible:
+                self._loaded += visible
+                self.endInsertRows()
+
+
+class RepairsFilterModel(QSortFilterProxyModel):
+    """Оставляет только записи из результатов поиска и показывает
+    найденный фрагмент во всплывающей подсказке"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # id записи -> фрагмент с совпадением; None — поиск не активен
+        self.search_results = None
+
+    def set_search_results(self, results):
+        if results is not None:
+            # Результаты могут оказаться среди ещё не показанных строк
+            self.sourceModel().fetch_all()
+        self.search_results = results
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.search_results is None:
+            return True
+        return self.sourceModel().record_id(source_row) in self.search_results
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.ToolTipRole and self.search_results is not None:
+            record_id = self.sourceModel().record_id(self.mapToSource(index).row())
+            return self.search_results.get(record_id)
+        return super().data(index, role)
+
+
+class DeleteButtonDelegate(QStyledItemDelegate):
+    """Рисует кнопку «Удалить» в ячейке вместо отдельного виджета на каждую строку"""
+    clicked = pyqtSignal(QModelIndex)
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = index.data()
+        button.state = QStyle.State_Enabled
+        if option.state & QStyle.State_MouseOver:
+            button.state |= QStyle.State_MouseOver
+        QApplication.style().drawControl(QStyle.CE_PushButton, button, painter)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton \
+                and option.rect.contains(event.pos()):
+            self.clicked.emit(index)
+            return True
+        return super().editorEvent(event, model, option, index)
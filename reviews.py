@@ -0,0 +1,70 @@
+"""Отзывы с сайта: проверка присланного отзыва и кэш списка одобренных"""
+from repair_schema import ValidationError
+
+# Статусы, которые назначает модератор (новый отзыв — pending)
+MODERATION_STATUSES = ("approved", "rejected")
+MAX_AUTHOR_LENGTH = 100
+MAX_EMAIL_LENGTH = 200
+MAX_TEXT_LENGTH = 5000
+# Сколько последних одобренных отзывов показывать на сайте
+APPROVED_LIMIT = 50
+REVIEW_FIELDS = ["id", "author", "rating", "text", "created_at"]
+MODERATION_FIELDS = ["id", "author", "email", "rating", "text", "status", "created_at",
+                     "moderated_at"]
+
+INSERT_REVIEW = "INSERT INTO reviews (author, email, rating, text, created_at) " \
+                "VALUES (?, ?, ?, ?, ?)"
+
+
+def normalize_review(data):
+    """Отзыв из формы сайта ({"name", "email", "rating", "text"}; текст может
+    прийти и как "review" — имя поля формы) или ValidationError"""
+    if not isinstance(data, dict):
+        raise ValidationError("Ожидается JSON-объект")
+    author = str(data.get('name') or '').strip()
+    email = str(data.get('email') or '').strip()
+    text = str(data.get('text') or data.get('review') or '').strip()
+    if not author or len(author) > MAX_AUTHOR_LENGTH:
+        raise ValidationError(f"Имя: от 1 до {MAX_AUTHOR_LENGTH} символов")
+    if len(email) > MAX_EMAIL_LENGTH or (email and '@' not in email):
+        raise ValidationError("Некорректный email")
+    if not text or len(text) > MAX_TEXT_LENGTH:
+        raise ValidationError(f"Отзыв: от 1 до {MAX_TEXT_LENGTH} символов")
+    try:
+        rating = int(data.get('rating'))
+    except (TypeError, ValueError):
+        rating = 0
+    if not 1 <= rating <= 5:
+        raise ValidationError("Оценка: целое число от 1 до 5")
+    return {"author": author, "email": email or None, "rating": rating, "text": text}
+
+
+class ApprovedReviews:
+    """Последние одобренные отзывы. Список перечитывается, только когда растёт
+    review_version (её увеличивают триггеры при модерации, см. db.init_reviews),
+    поэтому обычный запрос стоит чтения одной строки. Версия общая для всех
+    процессов: модерация в одном воркере сбрасывает кэш и в остальных."""
+
+    def __init__(self, limit=APPROVED_LIMIT):
+        self.limit = limit
+        self._cached = (None, [])
+
+    def get(self, conn):
+        """(версия, время изменения UTC, отзывы)"""
+        version, updated_at = conn.execute(
+            "SELECT version, updated_at FROM review_version"
+        ).fetchone()
+        cached_version, reviews = self._cached
+        if cached_version != version:
+            # Версия прочитана раньше списка: если отзыв одобрят между запросами,
+            # список окажется новее версии и просто будет перечитан ещё раз
+            rows = conn.execute(
+                f"SELECT {', '.join(REVIEW_FIELDS)} FROM reviews WHERE status = 'approved' "
+                "ORDER BY created_at DESC, id DESC LIMIT ?", (self.limit,)
+            ).fetchall()
+            reviews = [dict(zip(REVIEW_FIELDS, row)) for row in rows]
+            self._cached = (version, reviews)
+        return version, updated_at, reviews
+
+
+approved_reviews = ApprovedReviews()
@@ -1,93 +1,978 @@
-from flask import Flask, render_template, request, jsonify
-import sqlite3
-from datetime import datetime
+from flask import Flask, render_template, request, jsonify, Response, g, abort, redirect
+from werkzeug.datastructures import MultiDict
+from datetime import datetime, timedelta, timezone
+import base64
+import csv
+import gzip
+import hmac
+import io
+import json
+import os
+import tempfile
+import time
+import zlib
 
-app = Flask(__name__)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import bulk_jobs
+import db
+import metrics
+from events import notifier
+from write_queue import writer
+from repair_schema import (
+    LOOKUP_FIELDS, LOOKUP_KEYS, LOOKUP_MIN_LENGTH, ValidationError, lookup_keys, normalize_repair
+)
+from reviews import (
+    INSERT_REVIEW, MODERATION_FIELDS, MODERATION_STATUSES, approved_reviews, normalize_review
+)
+from web_cache import REVALIDATE, Content, PageCache, StaticAssets
+
+# Статические файлы отдаёт static_file: с отпечатком в имени и заранее сжатыми
+app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = 'yandexlyceum_secret_key'
+db.init_db()
+assets = StaticAssets()
+pages = PageCache()
+app.add_template_global(assets.url, 'asset_url')
+
+
+# Обработчики after_request вызываются в обратном порядке, поэтому этот,
+# объявленный первым, видит уже сжатый ответ
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if metrics.ENABLED and 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        # У потоковых ответов (/export, /events) размер заранее неизвестен
+        size = None if response.is_streamed else response.content_length
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - g.request_started,
+                                request.content_length, size)
+    return response
+
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    if 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else request.path
+        metrics.profiler.stop(f"{request.method} {route}", time.perf_counter() - g.request_started)
+
+REPAIR_FIELDS = [
+    "id", "client_name", "device_type", "manufacturer", "model", "serial_number",
+    "accessories", "client_address", "status", "status_timestamp", "issue_description", "notes",
+    "version"
+]
+# Столбцы, по которым можно сортировать и фильтровать список. Страница читается
+# сразу в нужном порядке по индексу (см. db.init_db), если фильтра нет, фильтр по
+# тому же столбцу или сортировка по времени статуса с фильтром по одному значению;
+# при фильтре по одному столбцу и сортировке по другому отобранные строки сортируются
+SORT_COLUMNS = {"id", "client_name", "device_type", "manufacturer", "status", "status_timestamp"}
+FILTER_COLUMNS = ("status", "device_type", "manufacturer")
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Веса столбцов db.FTS_COLUMNS при ранжировании результатов поиска (bm25)
+SEARCH_WEIGHTS = (10.0, 10.0, 5.0, 1.0, 1.0)
+SEARCH_LIMIT = 50
+# Сколько прежних ремонтов отдаёт /lookup
+LOOKUP_LIMIT = 20
+MAX_LOOKUP_LIMIT = 100
+# Сколько записей принимает один запрос /receive_bulk
+MAX_BULK_ROWS = 5000
+
+# Столбцы выгрузки и их заголовки (как в таблице приложения)
+EXPORT_COLUMNS = [
+    ("client_name", "ФИО клиента"),
+    ("device_type", "Тип устройства"),
+    ("manufacturer", "Изготовитель"),
+    ("model", "Модель"),
+    ("serial_number", "Серийный номер"),
+    ("accessories", "Комплектация"),
+    ("client_address", "Адрес клиента"),
+    ("status", "Статус"),
+    ("status_timestamp", "Время статуса"),
+    ("issue_description", "Неисправность"),
+    ("notes", "Примечания"),
+]
+EXPORT_CHUNK = 1000
+EXPORT_MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Интервал комментариев-пингов в потоке /events, чтобы соединение не считалось
+# зависшим клиентом и прокси
+EVENTS_HEARTBEAT = 15
+
+# Значение параметра archive -> схемы, из которых читать (архив см. archive.py)
+ARCHIVE_SCOPES = {"0": ("main",), "1": ("main", "archive"), "only": ("archive",)}
+
+# Период переходов по дням в /analytics по умолчанию
+ANALYTICS_DAYS = 30
+# Перцентили сроков ремонта в /analytics
+TURNAROUND_PERCENTILES = (50, 90, 95)
+
+# Модерация отзывов требует заголовок X-Moderation-Token с этим значением; пока
+# переменная не задана, модерация недоступна (сайт публичный)
+MODERATION_TOKEN = os.environ.get('REPAIRS_MODERATION_TOKEN')
+# Сколько отзывов на модерации отдаёт /reviews/pending
+PENDING_LIMIT = 100
+MONTHS = ("января", "февраля", "марта", "апреля", "мая", "июня", "июля", "августа",
+          "сентября", "октября", "ноября", "декабря")
+
+# Ответы меньше этого размера не сжимаются: выигрыш меньше затрат
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/css", "application/javascript"}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+INSERT_REPAIR = """INSERT INTO repairs (
+    client_name, device_type, manufacturer, model, serial_number,
+    accessories, client_address, status, status_timestamp, issue_description, notes,
+    serial_key, phone_key, name_key
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+@app.after_request
+def notify_changes(response):
+    # Любой успешный изменяющий запрос может добавить записи в журнал изменений
+    if request.method in ('POST', 'PATCH', 'DELETE') and response.status_code < 400:
+        notifier.notify()
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Сжимает готовые ответы brotli (если установлен) или gzip. Потоковые ответы
+    (/events, /export) не трогаем: их нельзя сжать целиком заранее."""
+    if response.direct_passthrough or response.is_streamed \
+            or response.mimetype not in COMPRESS_MIMETYPES \
+            or not 200 <= response.status_code < 300 or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def json_response(payload, status=200):
+    """JSON-ответ через orjson, если он установлен: для больших списков он в разы
+    быстрее jsonify"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+    return Response(body, status=status, mimetype='application/json')
+
+
+def listing_etag(cursor):
+    """ETag списка: версия журнала изменений растёт при любой вставке, правке и
+    удалении, а параметры запроса различают разные выборки"""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM repair_changes")
+    version = cursor.fetchone()[0]
+    return f"{version}-{zlib.crc32(request.query_string):x}"
+
+
+def etag_response(etag, build):
+    """304, если у клиента уже есть эта версия, иначе ответ из build() с ETag"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = json_response(build())
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def rows_payload(rows, columnar):
+    """Записи списком объектов или, при format=columns, как {"columns", "rows"}:
+    имена полей не повторяются в каждой строке, строки — кортежи из курсора как есть"""
+    if columnar:
+        return {"columns": REPAIR_FIELDS, "rows": rows}
+    return [dict(zip(REPAIR_FIELDS, r)) for r in rows]
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus (см. metrics.py)"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    asset = assets.get(filename)
+    if asset is None:
+        abort(404)
+    content, cache_control = asset
+    return content.response(request, cache_control)
+
+
+def template_modified(name):
+    path = os.path.join(app.root_path, app.template_folder, name)
+    return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+
+
+@app.template_filter('initials')
+def initials(name):
+    return ''.join(word[0] for word in name.split()[:2]).upper()
+
+
+@app.template_filter('review_date')
+def review_date(timestamp):
+    """'2023-05-15 12:00:00' -> '15 мая 2023'"""
+    date = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+    return f"{date.day} {MONTHS[date.month - 1]} {date.year}"
 
 
 @app.route('/')
 @app.route('/index')
 def display():
-    return render_template('index.html')
+    """Страница не зависит от данных: отрисовывается и сжимается один раз"""
+    page = pages.get('index.html', None, lambda: Content(
+        render_template('index.html').encode(), 'text/html', template_modified('index.html')
+    ))
+    return page.response(request, REVALIDATE)
 
 
-@app.route('/reviews')
+@app.route('/reviews', methods=['GET'])
 def reviews():
-    return render_template('reviews.html')
+    """Страница отзывов перерисовывается, только когда меняется набор одобренных
+    отзывов; повторный запрос браузера с If-None-Match/If-Modified-Since — 304"""
+    with db.connection() as conn:
+        version, updated_at, items = approved_reviews.get(conn)
+
+    def build():
+        modified = datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        return Content(render_template('reviews.html', reviews=items).encode(), 'text/html',
+                       max(modified, template_modified('reviews.html')))
+
+    return pages.get('reviews.html', version, build).response(request, REVALIDATE)
+
+
+@app.route('/reviews', methods=['POST'])
+def submit_review():
+    """Новый отзыв (JSON или обычная отправка формы) сохраняется на модерацию.
+    Запись идёт через общий писатель: одновременные отзывы фиксируются одной
+    транзакцией. Форма без JavaScript после отправки возвращается на страницу."""
+    data = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+    try:
+        review = normalize_review(data)
+        values = (review['author'], review['email'], review['rating'], review['text'], now())
+        review_id = writer.submit(lambda conn: conn.execute(INSERT_REVIEW, values).lastrowid)
+        if not request.is_json:
+            return redirect('/reviews', code=303)
+        return jsonify({"status": "success", "id": review_id, "review_status": "pending"}), 201
+    except ValidationError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/reviews/approved', methods=['GET'])
+def approved_reviews_list():
+    """Последние одобренные отзывы из кэша; ETag — версия набора одобренных"""
+    try:
+        with db.connection() as conn:
+            version, _, items = approved_reviews.get(conn)
+        return etag_response(f"reviews-{version}", lambda: {"reviews": items})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def moderation_allowed():
+    if not MODERATION_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Moderation-Token', ''), MODERATION_TOKEN)
+
+
+@app.route('/reviews/pending', methods=['GET'])
+def pending_reviews():
+    """Отзывы, ожидающие модерации, старые первыми"""
+    if not moderation_allowed():
+        return jsonify({"status": "error", "message": "Нет доступа"}), 403
+    try:
+        with db.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(MODERATION_FIELDS)} FROM reviews WHERE status = 'pending' "
+                "ORDER BY created_at, id LIMIT ?", (PENDING_LIMIT,)
+            ).fetchall()
+        return jsonify({"status": "success",
+                        "reviews": [dict(zip(MODERATION_FIELDS, row)) for row in rows]}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/reviews/<int:review_id>', methods=['PATCH'])
+def moderate_review(review_id):
+    """Модерация: {"status": "approved" | "rejected"}. Одобрение или снятие
+    одобренного отзыва увеличивает review_version, и кэш списка и страницы
+    отзывов сбрасывается во всех процессах."""
+    if not moderation_allowed():
+        return jsonify({"status": "error", "message": "Нет доступа"}), 403
+    data = request.get_json(silent=True)
+    status = data.get('status') if isinstance(data, dict) else None
+    if status not in MODERATION_STATUSES:
+        return jsonify({"status": "error",
+                        "message": f"Статус: одно из {', '.join(MODERATION_STATUSES)}"}), 400
+    try:
+        updated = writer.submit(lambda conn: conn.execute(
+            "UPDATE reviews SET status = ?, moderated_at = ? WHERE id = ?",
+            (status, now(), review_id)
+        ).rowcount)
+        if updated == 0:
+            return jsonify({"status": "error", "message": "Отзыв не найден"}), 404
+        return jsonify({"status": "success"}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 
 @app.route('/receive', methods=['POST'])
 def receive_data():
-    data = request.get_json()
-    try:
-        conn = sqlite3.connect('repairs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO repairs (
-                client_name, device_type, manufacturer, model, serial_number, 
-                accessories, client_address, status, status_timestamp, issue_description, notes
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                data.get('client_name', ''),
-                data.get('device_type', ''),
-                data.get('manufacturer', ''),
-                data.get('model', ''),
-                data.get('serial_number', ''),
-                data.get('accessories', ''),
-                data.get('client_address', ''),
-                data.get('status', 'принят'),
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                data.get('issue_description', ''),
-                data.get('notes', '')
-            )
-        )
-        conn.commit()
-        conn.close()
+    data = request.get_json(silent=True)
+    try:
+        values = repair_values(data, now())
+    except ValidationError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        # Ответ уходит, когда группа, в которую попала вставка, записана на диск
+        writer.submit(lambda conn: conn.execute(INSERT_REPAIR, values))
         return jsonify({"status": "success"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def repair_values(data, timestamp):
+    """Параметры INSERT_REPAIR из присланной записи (в формате приложения или бота);
+    некорректная запись даёт ValidationError"""
+    record = normalize_repair(data)
+    keys = lookup_keys(record)
+    return (
+        record['client_name'],
+        record['device_type'],
+        record['manufacturer'],
+        record['model'],
+        record['serial_number'],
+        record['accessories'],
+        record['client_address'],
+        record['status'],
+        timestamp,
+        record['issue_description'],
+        record['notes'],
+        keys['serial'],
+        keys['phone'],
+        keys['name']
+    )
+
+
+@app.route('/receive_bulk', methods=['POST'])
+def receive_bulk():
+    """Пакетная вставка: JSON-массив записей или NDJSON (по записи в строке,
+    Content-Type: application/x-ndjson). Корректные записи вставляются одной
+    транзакцией, по некорректным возвращается номер строки и причина."""
+    errors = []
+    timestamp = now()
+
+    def values():
+        for number, data in enumerate(bulk_records(), start=1):
+            if number > MAX_BULK_ROWS:
+                raise ValueError(f"В одном запросе не больше {MAX_BULK_ROWS} записей")
+            if isinstance(data, Exception):
+                errors.append({"row": number, "message": str(data)})
+                continue
+            try:
+                yield repair_values(data, timestamp)
+            except ValidationError as e:
+                errors.append({"row": number, "message": str(e)})
+
+    try:
+        # Тело разбирается до постановки в очередь: писатель не ждёт чтения запроса
+        rows = list(values())
+        inserted = writer.submit(lambda conn: conn.executemany(INSERT_REPAIR, rows).rowcount)
+        return jsonify({"status": "success", "inserted": inserted, "errors": errors}), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def bulk_records():
+    """Записи из тела запроса; строка NDJSON, которую не удалось разобрать,
+    отдаётся как исключение, чтобы не прерывать остальную вставку"""
+    if request.mimetype == 'application/x-ndjson':
+        # Тело читается потоком, не целиком в память
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Некорректный JSON: {e}")
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            raise ValueError("Ожидается JSON-массив записей")
+        yield from records
+
+
 @app.route('/get_repairs', methods=['GET'])
 def get_repairs():
+    since = request.args.get('since', type=int)
+    paged = any(key in request.args for key in
+                ('limit', 'cursor', 'sort', 'order', 'date_from', 'date_to') + FILTER_COLUMNS)
+    columnar = request.args.get('format') == 'columns'
+    try:
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            etag = listing_etag(cursor)
+
+            def build():
+                if since is not None:
+                    return get_changes(cursor, since, columnar)
+                if paged:
+                    return get_page(cursor, request.args, columnar)
+                cursor.execute(f"SELECT {', '.join(REPAIR_FIELDS)} FROM repairs")
+                return rows_payload(cursor.fetchall(), columnar)
+
+            return etag_response(etag, build)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def repairs_filter(args):
+    """Собирает WHERE-условие по фильтрам запроса: status, device_type, manufacturer
+    (можно передать несколько значений) и диапазон date_from/date_to по status_timestamp"""
+    conditions, params = [], []
+    for column in FILTER_COLUMNS:
+        values = [value for value in args.getlist(column) if value]
+        if len(values) == 1:
+            conditions.append(f"{column} = ?")
+        elif values:
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    if args.get('date_from'):
+        conditions.append("status_timestamp >= ?")
+        params.append(args['date_from'])
+    if args.get('date_to'):
+        date_to = args['date_to']
+        # Дата без времени включает весь день
+        if len(date_to) == 10:
+            date_to += ' 23:59:59'
+        conditions.append("status_timestamp <= ?")
+        params.append(date_to)
+    return conditions, params
+
+
+def archive_schemas(args):
+    """Схемы, из которых читать записи: main, archive или обе (параметр archive)"""
+    scope = args.get('archive', '0')
+    if scope not in ARCHIVE_SCOPES:
+        raise ValueError(f"Некорректное значение archive: {scope}")
+    return ARCHIVE_SCOPES[scope]
+
+
+def repairs_source(args):
+    """Источник записей для выгрузки: repairs или вместе с архивом. Запись, которая
+    переносится в архив прямо сейчас, может на миг оказаться в обеих таблицах —
+    берётся копия из repairs."""
+    schemas = archive_schemas(args)
+    if schemas == ("main",):
+        return "main.repairs"
+    columns = ', '.join(db.REPAIR_COLUMNS)
+    parts = [f"SELECT {columns} FROM main.repairs" if schema == "main" else
+             f"SELECT {columns} FROM archive.repairs WHERE id NOT IN (SELECT id FROM main.repairs)"
+             for schema in schemas]
+    return f"({' UNION ALL '.join(parts)})"
+
+
+def encode_cursor(value, record_id):
+    return base64.urlsafe_b64encode(json.dumps([value, record_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(record_id)
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+
+def get_page(cursor, args, columnar=False):
+    """Страница списка по ключу (keyset): следующая страница начинается строго после
+    последней строки предыдущей, поэтому её стоимость не зависит от размера таблицы"""
+    sort = args.get('sort', 'id')
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Сортировка по {sort} не поддерживается")
+    descending = args.get('order', 'asc').lower() == 'desc'
+    limit = min(max(args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    conditions, params = repairs_filter(args)
+    if args.get('cursor'):
+        value, record_id = decode_cursor(args['cursor'])
+        op = '<' if descending else '>'
+        if sort == 'id':
+            conditions.append(f"id {op} ?")
+            params.append(record_id)
+        else:
+            conditions.append(f"({sort}, id) {op} (?, ?)")
+            params.extend([value, record_id])
+    direction = 'DESC' if descending else 'ASC'
+    order_by = f"id {direction}" if sort == 'id' else f"{sort} {direction}, id {direction}"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT {', '.join(REPAIR_FIELDS)} FROM repairs {where} "
+                   f"ORDER BY {order_by} LIMIT ?",
+                   params + [limit + 1])
+    rows = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last[REPAIR_FIELDS.index(sort)], last[0])
+    return {"items": rows_payload(rows[:limit], columnar), "next_cursor": next_cursor}
+
+
+def get_changes(cursor, since, columnar=False):
+    """Возвращает изменения после версии since: изменённые записи и id удалённых"""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM repair_changes")
+    version = cursor.fetchone()[0]
+    columns = ', '.join(f"r.{field}" for field in REPAIR_FIELDS)
+    cursor.execute(
+        f"""SELECT c.version, c.repair_id, c.deleted, {columns}
+            FROM repair_changes c LEFT JOIN repairs r ON r.id = c.repair_id
+            WHERE c.version > ? AND c.version <= ?
+            ORDER BY c.version""",
+        (since, version)
+    )
+    upserts, deleted = [], []
+    for row in cursor.fetchall():
+        if row[2] or row[3] is None:
+            # При первой синхронизации (since=0) удалённые записи клиенту не нужны
+            if since:
+                deleted.append(row[1])
+        else:
+            upserts.append(row[3:])
+    return {"version": version, "upserts": rows_payload(upserts, columnar), "deleted": deleted}
+
+
+@app.route('/events', methods=['GET'])
+def events():
+    """Поток Server-Sent Events: событие changes с тем же содержимым, что и
+    /get_repairs?since=..., приходит сразу после каждого изменения. Начальная
+    версия берётся из since или из Last-Event-ID при переподключении. Без неё
+    (since=0) поток начинается с текущей версии и не повторяет всю таблицу:
+    первую загрузку клиент получает из /get_repairs."""
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+    if since <= 0:
+        with db.connection() as conn:
+            since = conn.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM repair_changes"
+            ).fetchone()[0]
+
+    def stream(version):
+        # id без данных только запоминается: переподключение продолжит с этой версии
+        yield f"retry: 3000\nid: {version}\n\n"
+        while True:
+            if notifier.wait(version, EVENTS_HEARTBEAT) <= version:
+                yield ": ping\n\n"
+                continue
+            with db.connection() as conn:
+                changes = get_changes(conn.cursor(), version)
+            if changes['version'] <= version:
+                continue
+            version = changes['version']
+            yield f"id: {version}\nevent: changes\ndata: {json.dumps(changes)}\n\n"
+
+    return Response(stream(since), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/search', methods=['GET'])
+def search():
+    """Полнотекстовый поиск; archive=1 ищет и в архиве закрытых ремонтов,
+    archive=only — только в нём. У архивных результатов archived=true."""
+    match = fts_query(request.args.get('q', ''))
+    if not match:
+        return jsonify({"items": []}), 200
+    limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        schemas = archive_schemas(request.args)
+        columns = ', '.join(f"r.{column}" for column in db.REPAIR_COLUMNS)
+        # Ранги bm25 двух индексов сравнимы лишь приблизительно: у каждого своя статистика
+        sql = " UNION ALL ".join(
+            f"""SELECT {columns}, snippet(repairs_fts, -1, '[', ']', '…', 10),
+                       bm25(repairs_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) AS rank,
+                       {int(schema == 'archive')}
+                FROM {schema}.repairs_fts JOIN {schema}.repairs r ON r.id = repairs_fts.rowid
+                WHERE repairs_fts MATCH ?
+                {"AND r.id NOT IN (SELECT id FROM main.repairs)" if schema == 'archive' else ""}"""
+            for schema in schemas
+        ) + " ORDER BY rank LIMIT ?"
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            etag = listing_etag(cursor)
+
+            def build():
+                cursor.execute(sql, [match] * len(schemas) + [limit])
+                items = []
+                for r in cursor:
+                    item = dict(zip(REPAIR_FIELDS, r))
+                    item["snippet"] = r[-3]
+                    if r[-1]:
+                        item["archived"] = True
+                    items.append(item)
+                return {"items": items}
+
+            return etag_response(etag, build)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/lookup', methods=['GET'])
+def lookup():
+    """Прежние ремонты клиента или устройства: by=serial (серийный номер),
+    by=phone (телефон из адреса клиента) или by=name (ФИО), q — начало значения.
+    Ищется по префиксу нормализованного ключа — диапазон по индексу, в том числе
+    в архиве. Записи упорядочены по ключу, внутри ключа — сначала последние;
+    complete=true означает, что других совпадений нет (клиент может уточнять
+    префикс без новых запросов)."""
+    by = request.args.get('by')
+    if by not in LOOKUP_KEYS:
+        return jsonify({"status": "error",
+                        "message": f"Параметр by: одно из {', '.join(LOOKUP_KEYS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', LOOKUP_LIMIT)), 1), MAX_LOOKUP_LIMIT)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    key = LOOKUP_KEYS[by](request.args.get('q', ''), partial=True)
+    if not key or len(key) < LOOKUP_MIN_LENGTH[by]:
+        return jsonify({"status": "success", "repairs": [], "complete": False}), 200
+    column = db.LOOKUP_COLUMNS[by]
+    # Все строки, начинающиеся с key: key <= значение < key с увеличенным последним символом
+    upper = key[:-1] + chr(ord(key[-1]) + 1)
     try:
-        conn = sqlite3.connect('repairs.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM repairs")
-        rows = cursor.fetchall()
-        repairs = [
-            {
-                "id": r[0],
-                "client_name": r[1],
-                "device_type": r[2],
-                "manufacturer": r[3],
-                "model": r[4],
-                "serial_number": r[5],
-                "accessories": r[6],
-                "client_address": r[7],
-                "status": r[8],
-                "status_timestamp": r[9],
-                "issue_description": r[10],
-                "notes": r[11]
-            } for r in rows
-        ]
-        conn.close()
-        return jsonify(repairs), 200
+        found = []
+        complete = True
+        with db.connection() as conn:
+            for schema in ('main', 'archive'):
+                rows = conn.execute(
+                    f"SELECT {', '.join(REPAIR_FIELDS)}, {column} FROM {schema}.repairs "
+                    f"WHERE {column} >= ? AND {column} < ? ORDER BY {column}, id DESC LIMIT ?",
+                    (key, upper, limit)
+                ).fetchall()
+                complete = complete and len(rows) < limit
+                found.extend((row[-1], -row[0], schema == 'archive', row[:-1]) for row in rows)
+        found.sort(key=lambda item: item[:2])
+        repairs = [dict(zip(REPAIR_FIELDS, row), archived=archived)
+                   for _, _, archived, row in found[:limit]]
+        return jsonify({"status": "success", "repairs": repairs,
+                        "complete": complete and len(found) <= limit}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/dictionaries', methods=['GET'])
+def dictionaries():
+    """Значения типов устройств, изготовителей и комплектации с числом записей,
+    самые частые первыми. ETag — версия набора значений, поэтому повторный запрос
+    с If-None-Match стоит 304, пока не появилось новое значение."""
+    try:
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM dictionary_version")
+            etag = str(cursor.fetchone()[0])
+
+            def build():
+                result = {field: [] for field in db.DICTIONARY_FIELDS}
+                cursor.execute("SELECT field, value, count FROM dictionary_values "
+                               "ORDER BY field, count DESC, value")
+                for field, value, count in cursor:
+                    result[field].append({"value": value, "count": count})
+                return result
+
+            return etag_response(etag, build)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/analytics', methods=['GET'])
+def analytics():
+    """Сводка по ремонтам: число записей в каждом статусе, переходы в статусы по дням
+    (date_from/date_to, по умолчанию последние ANALYTICS_DAYS дней) и сроки ремонта
+    в разрезе by=device_type|manufacturer. Читаются только сводные таблицы, которые
+    ведут триггеры, поэтому время ответа не зависит от длины журнала статусов."""
+    by = request.args.get('by', '')
+    try:
+        if by not in db.TURNAROUND_DIMENSIONS:
+            raise ValueError(f"Разрез {by} не поддерживается")
+        date_to = request.args.get('date_to') or datetime.now().strftime("%Y-%m-%d")
+        date_from = request.args.get('date_from') or (
+            datetime.strptime(date_to[:10], "%Y-%m-%d") - timedelta(days=ANALYTICS_DAYS - 1)
+        ).strftime("%Y-%m-%d")
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            # Окно по умолчанию сдвигается с датой, поэтому входит в ETag вместе с версией
+            etag = f"{listing_etag(cursor)}-{date_from[:10]}-{date_to[:10]}"
+
+            def build():
+                cursor.execute("SELECT status, count FROM status_backlog WHERE count > 0 "
+                               "ORDER BY count DESC")
+                backlog = dict(cursor.fetchall())
+                throughput = {}
+                cursor.execute("SELECT day, status, count FROM status_daily "
+                               "WHERE day BETWEEN ? AND ? ORDER BY day",
+                               (date_from[:10], date_to[:10]))
+                for day, status, count in cursor:
+                    throughput.setdefault(day, {})[status] = count
+                groups = {}
+                cursor.execute("SELECT key, bucket, count, total_hours FROM turnaround_buckets "
+                               "WHERE dimension = ? ORDER BY key, bucket", (by,))
+                for key, bucket, count, total_hours in cursor:
+                    groups.setdefault(key, []).append((bucket, count, total_hours))
+                turnaround = [dict(turnaround_stats(buckets), key=key)
+                              for key, buckets in groups.items()]
+                turnaround.sort(key=lambda item: item["count"], reverse=True)
+                return {"backlog": backlog, "throughput": throughput,
+                        "turnaround": {"by": by, "from": db.TURNAROUND_FROM,
+                                       "to": db.TURNAROUND_TO, "groups": turnaround}}
+
+            return etag_response(etag, build)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def turnaround_stats(buckets):
+    """Число ремонтов, средний срок и перцентили по гистограмме [(корзина, число,
+    сумма часов)]. Перцентиль — верхняя граница корзины в часах; None означает
+    «дольше последней границы»."""
+    total = sum(count for _, count, _ in buckets)
+    stats = {"count": total,
+             "avg_hours": round(sum(hours for _, _, hours in buckets) / total, 1)}
+    for percentile in TURNAROUND_PERCENTILES:
+        cumulative = 0
+        for bucket, count, _ in buckets:
+            cumulative += count
+            if cumulative * 100 >= percentile * total:
+                break
+        stats[f"p{percentile}_hours"] = db.TURNAROUND_BUCKETS[bucket] \
+            if bucket < len(db.TURNAROUND_BUCKETS) else None
+    return stats
+
+
+@app.route('/repairs/<int:record_id>/history', methods=['GET'])
+def repair_history(record_id):
+    """Смены статуса записи по порядку"""
+    try:
+        with db.connection() as conn:
+            rows = conn.execute(
+                "SELECT old_status, new_status, changed_at FROM status_history "
+                "WHERE repair_id = ? ORDER BY id", (record_id,)
+            ).fetchall()
+        return json_response([{"old_status": old, "new_status": new, "changed_at": changed_at}
+                              for old, new, changed_at in rows])
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def fts_query(text):
+    """Превращает строку пользователя в запрос FTS5: каждое слово ищется по префиксу,
+    все слова должны встретиться. Спецсимволы FTS5 из ввода не пропускаются."""
+    words = ''.join(ch if ch.isalnum() else ' ' for ch in text).split()
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+@app.route('/repairs/<int:record_id>', methods=['PATCH'])
+def update_repair(record_id):
+    """Меняет только переданные поля одним UPDATE. Если передана version и запись
+    с тех пор изменилась, возвращает 409 и актуальную запись. Время статуса
+    обновляется, только если статус действительно поменялся."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Ожидается JSON-объект"}), 400
+    expected_version = data.pop('version', None)
+    try:
+        changes = normalize_repair(data, partial=True)
+    except ValidationError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    def update(conn):
+        updated = 0
+        if changes:
+            assignments = [f"{field} = ?" for field in changes]
+            params = list(changes.values())
+            # Ключи поиска прежних ремонтов пересчитываются вместе со своими полями
+            for by, field in LOOKUP_FIELDS.items():
+                if field in changes:
+                    assignments.append(f"{db.LOOKUP_COLUMNS[by]} = ?")
+                    params.append(LOOKUP_KEYS[by](changes[field]))
+            if 'status' in changes:
+                # В SET используются значения строки до обновления
+                assignments.append(
+                    "status_timestamp = CASE WHEN status IS ? THEN status_timestamp ELSE ? END"
+                )
+                params.extend([changes['status'], now()])
+            sql = f"UPDATE repairs SET {', '.join(assignments)}, version = version + 1 " \
+                  "WHERE id = ?"
+            params.append(record_id)
+            if expected_version is not None:
+                sql += " AND version = ?"
+                params.append(expected_version)
+            updated = conn.execute(sql, params).rowcount
+        row = conn.execute(f"SELECT {', '.join(REPAIR_FIELDS)} FROM repairs WHERE id = ?",
+                           (record_id,)).fetchone()
+        return updated, row
+
+    try:
+        updated, row = writer.submit(update)
+        if row is None:
+            return jsonify({"status": "error", "message": "Запись не найдена"}), 404
+        record = dict(zip(REPAIR_FIELDS, row))
+        if changes and not updated:
+            return jsonify({"status": "error", "message": "Запись уже изменена другим пользователем",
+                            "repair": record}), 409
+        return jsonify({"status": "success", "repair": record}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/export', methods=['GET'])
+def export():
+    """Выгрузка записей в CSV, XLSX или Parquet с теми же фильтрами, что и у списка
+    (archive=1 добавляет архив закрытых ремонтов, archive=only — только архив).
+    Строки читаются из курсора порциями и сразу пишутся в ответ (CSV) или во
+    временный файл, который затем отдаётся потоком (XLSX, Parquet)."""
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({"status": "error",
+                        "message": f"Формат {export_format} не поддерживается"}), 400
+    conditions, params = repairs_filter(request.args)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    columns = ', '.join(field for field, _ in EXPORT_COLUMNS)
+    try:
+        source = repairs_source(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    sql = f"SELECT {columns} FROM {source} {where} ORDER BY id"
+    try:
+        if export_format == 'csv':
+            body = export_csv(sql, params)
+        elif export_format == 'xlsx':
+            body = stream_file(export_xlsx(sql, params))
+        else:
+            body = stream_file(export_parquet(sql, params))
+    except ImportError as e:
+        return jsonify({"status": "error", "message": f"Формат недоступен на сервере: {e}"}), 501
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    filename = f"repairs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(body, mimetype=EXPORT_MIMETYPES[export_format],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+def export_chunks(sql, params):
+    with db.connection() as conn:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                break
+            yield rows
+
+
+def export_csv(sql, params):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel открывал файл в UTF-8
+    buffer.write('\ufeff')
+    writer.writerow([header for _, header in EXPORT_COLUMNS])
+    for rows in export_chunks(sql, params):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_xlsx(sql, params):
+    from openpyxl import Workbook
+
+    # write_only: строки не держатся в памяти, а сразу сериализуются
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Ремонты")
+    sheet.append([header for _, header in EXPORT_COLUMNS])
+    for rows in export_chunks(sql, params):
+        for row in rows:
+            sheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    return output
+
+
+def export_parquet(sql, params):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(header, pa.string()) for _, header in EXPORT_COLUMNS])
+    output = tempfile.TemporaryFile()
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for rows in export_chunks(sql, params):
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(column, pa.string()) for column in columns], schema=schema))
+    return output
+
+
+def stream_file(output, chunk_size=64 * 1024):
+    output.seek(0)
+
+    def generate():
+        with output:
+            while True:
+                chunk = output.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    return generate()
+
+
 @app.route('/delete_repair/<int:record_id>', methods=['DELETE'])
 def delete_repair(record_id):
     try:
-        conn = sqlite3.connect('repairs.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM repairs WHERE id=?", (record_id,))
-        if cursor.rowcount == 0:
+        deleted = writer.submit(
+            lambda conn: conn.execute("DELETE FROM repairs WHERE id=?", (record_id,)).rowcount
+        )
+        if deleted == 0:
             return jsonify({"status": "error", "message": "Запись не найдена"}), 404
-        conn.commit()
-        conn.close()
         return jsonify({"status": "success"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -95,38 +980,89 @@ def delete_repair(record_id):
 
 @app.route('/delete_all_repairs', methods=['DELETE'])
 def delete_all_repairs():
+    """Удаляет все записи фоновым заданием (см. /bulk), порциями, чтобы не держать
+    блокировку записи; возвращает 202 и задание"""
     try:
-        conn = sqlite3.connect('repairs.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM repairs")
-        conn.commit()
-        conn.close()
-        return jsonify({"status": "success"}), 200
+        job = bulk_jobs.start('delete', None, [], [])
+        return jsonify({"status": "success", "job": job}), 202
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/bulk', methods=['POST'])
+def start_bulk():
+    """Массовая операция: {"action": "delete" | "status", "status": новый статус,
+    "ids": [...], "filters": {как у /get_repairs}, "all": true}. Выполняется
+    в фоне порциями; возвращает 202 и задание, ход — GET /bulk/<id>,
+    отмена — DELETE /bulk/<id>."""
+    data = request.get_json(silent=True)
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("Ожидается JSON-объект")
+        action = data.get('action')
+        value = None
+        if action == 'status':
+            if not data.get('status'):
+                raise ValueError("Не указан статус")
+            value = normalize_repair({"status": data['status']}, partial=True)['status']
+        conditions, params = bulk_selection(data)
+        job = bulk_jobs.start(action, value, conditions, params)
+        return jsonify({"status": "success", "job": job}), 202
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def bulk_selection(data):
+    """WHERE-условие массовой операции по выбранным id и фильтрам списка. Без них
+    операция затрагивает все записи только при явном "all": true."""
+    ids = data.get('ids') or []
+    filters = data.get('filters') or {}
+    if not isinstance(ids, list) or not isinstance(filters, dict):
+        raise ValueError("Некорректный выбор записей")
+    if len(ids) > MAX_BULK_ROWS:
+        raise ValueError(f"В одном запросе не больше {MAX_BULK_ROWS} id")
+    conditions, params = repairs_filter(MultiDict(
+        [(key, value) for key, values in filters.items()
+         for value in (values if isinstance(values, list) else [values])]
+    ))
+    if ids:
+        try:
+            ids = [int(record_id) for record_id in ids]
+        except (TypeError, ValueError):
+            raise ValueError("id записей должны быть числами")
+        conditions.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    if not conditions and data.get('all') is not True:
+        raise ValueError("Не выбраны записи: укажите ids, filters или all")
+    return conditions, params
+
+
+@app.route('/bulk/<job_id>', methods=['GET'])
+def bulk_status(job_id):
+    try:
+        job = bulk_jobs.get(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "Задание не найдено"}), 404
+        return jsonify({"status": "success", "job": job}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/bulk/<job_id>', methods=['DELETE'])
+def cancel_bulk(job_id):
+    try:
+        job = bulk_jobs.cancel(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "Задание не найдено"}), 404
+        return jsonify({"status": "success", "job": job}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
 if __name__ == '__main__':
-    conn = sqlite3.connect('repairs.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS repairs (
-            id INTEGER PRIMARY KEY,
-            client_name TEXT,
-            device_type TEXT,
-            manufacturer TEXT,
-            model TEXT,
-            serial_number TEXT,
-            accessories TEXT,
-            client_address TEXT,
-            status TEXT,
-            status_timestamp TEXT,
-            issue_description TEXT,
-            notes TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
-    # Для хостинга используйте WSGI-сервер, например, gunicorn:
-    # gunicorn -w 4 -b 0.0.0.0:5000 site:app
+    # Для хостинга используйте WSGI-сервер, например, gunicorn. Поток /events держит
+    # соединение открытым, поэтому нужны воркеры с потоками:
+    # gunicorn -w 4 -k gthread --threads 32 -b 0.0.0.0:5000 wsgi:app
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,100 @@
+"""Профиль запуска клиента (qt_application.py).
+
+    python startup_profile.py                      # из исходников, 5 запусков
+    python startup_profile.py --exe dist/qt_application/qt_application.exe
+    python startup_profile.py --runs 10 --output startup.json
+
+Приложение запускается с переменной REPAIRS_STARTUP_PROFILE: при первой
+отрисовке таблицы оно записывает отметки времени и закрывается. Время до первой
+отрисовки считается от запуска процесса, поэтому для собранного exe в него входит
+и распаковка onefile-архива. Для запуска из исходников дополнительно
+включается -X importtime и выводятся модули, дольше всего импортируемые при
+старте (время с учётом вложенных импортов)."""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(BASE_DIR, 'qt_application.py')
+RUNS = 5
+TOP_IMPORTS = 20
+STARTUP_TIMEOUT = 120
+
+
+def parse_importtime(stderr):
+    """Импорты верхнего уровня из вывода -X importtime: модуль -> cumulative, с"""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Вложенные импорты выводятся с дополнительным отступом
+        if name.startswith('  '):
+            continue
+        imports[name.strip()] = int(cumulative) / 1e6
+    return imports
+
+
+def run_once(exe):
+    with tempfile.TemporaryDirectory() as tmp:
+        profile_path = os.path.join(tmp, 'profile.json')
+        env = dict(os.environ, REPAIRS_STARTUP_PROFILE=profile_path)
+        command = [exe] if exe else [sys.executable, '-X', 'importtime', APP]
+        launched = time.time()
+        process = subprocess.run(command, env=env, capture_output=True, text=True,
+                                 timeout=STARTUP_TIMEOUT)
+        if not os.path.exists(profile_path):
+            raise RuntimeError(f"Приложение завершилось без профиля (код {process.returncode}):\n"
+                               f"{process.stderr[-2000:]}")
+        with open(profile_path, encoding='utf-8') as f:
+            profile = json.load(f)
+    marks = profile['marks']
+    marks['first_paint_from_launch'] = profile['first_paint_at'] - launched
+    return marks, parse_importtime(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профиль запуска клиента")
+    parser.add_argument('--exe', help="собранный исполняемый файл вместо qt_application.py")
+    parser.add_argument('--runs', type=int, default=RUNS)
+    parser.add_argument('--top', type=int, default=TOP_IMPORTS)
+    parser.add_argument('--output', help="записать результат в JSON")
+    args = parser.parse_args()
+
+    runs = []
+    imports = {}
+    for number in range(args.runs):
+        marks, run_imports = run_once(args.exe)
+        print(f"Запуск {number + 1}: первая отрисовка через "
+              f"{marks['first_paint_from_launch']:.3f} с")
+        runs.append(marks)
+        for name, seconds in run_imports.items():
+            imports.setdefault(name, []).append(seconds)
+
+    result = {
+        'target': args.exe or APP,
+        'runs': runs,
+        # Медианы по запускам; отметки — секунды от начала qt_application.py
+        'marks': {mark: statistics.median(run[mark] for run in runs) for mark in runs[0]},
+        'imports': dict(sorted(((name, statistics.median(values)) for name, values in imports.items()),
+                               key=lambda item: item[1], reverse=True)[:args.top]),
+    }
+    print("\nМедианы, с:")
+    for mark, seconds in result['marks'].items():
+        print(f"  {mark:<26} {seconds:8.3f}")
+    if result['imports']:
+        print("\nСамые долгие импорты при запуске, с:")
+        for name, seconds in result['imports'].items():
+            print(f"  {name:<40} {seconds:8.3f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+// Отправка отзыва: сохраняется на сервере и появляется на сайте после модерации
+document.getElementById('review-form').addEventListener('submit', function (e) {
+    e.preventDefault();
+    var form = this;
+    var button = form.querySelector('.submit-btn');
+    var message = document.getElementById('review-message');
+    var review = {
+        name: form.elements.name.value,
+        email: form.elements.email.value,
+        rating: Number(form.elements.rating.value),
+        text: form.elements.review.value
+    };
+
+    function show(text, error) {
+        message.textContent = text;
+        message.className = error ? 'form-message error' : 'form-message';
+    }
+
+    button.disabled = true;
+    fetch(form.action, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(review)
+    }).then(function (response) {
+        return response.json().then(function (result) {
+            if (!response.ok) {
+                throw new Error(result.message || 'Не удалось отправить отзыв');
+            }
+            show('Спасибо за ваш отзыв! После модерации он появится на сайте.', false);
+            form.reset();
+        });
+    }).catch(function (error) {
+        show(error.message, true);
+    }).finally(function () {
+        button.disabled = false;
+    });
+});
@@ -1,18 +1,24 @@
+import asyncio
 import logging
 import json
-import requests
+import os
+import httpx
 from config import BOT_TOKEN
 from dotenv import load_dotenv
-from datetime import date
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,
+    PersistenceInput,
+    PicklePersistence,
     filters
 )
+from outbox import Outbox
+from repair_schema import from_bot
 
 # Включим логирование
 logging.basicConfig(
@@ -38,7 +44,61 @@ logging.basicConfig(
 )
 
 # URL Flask-сервера (замените на актуальный домен/IP и порт при хостинге)
-FLASK_URL = "http://192.168.1.103:5000/receive"  # При хостинге: "https://your-domain.com/receive"
+FLASK_URL = "http://192.168.1.103:5000"  # При хостинге: "https://your-domain.com"
+
+# Режим webhook: если задан публичный адрес, Telegram сам присылает обновления на
+# встроенный HTTP-сервер бота (порт за обратным прокси с HTTPS или с cert/key);
+# иначе бот опрашивает Telegram (long polling)
+WEBHOOK_URL = os.environ.get("BOT_WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("BOT_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("BOT_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("BOT_WEBHOOK_PATH", "bot")
+# Telegram передаёт его в заголовке каждого запроса; чужие запросы отклоняются
+WEBHOOK_SECRET = os.environ.get("BOT_WEBHOOK_SECRET")
+WEBHOOK_CERT = os.environ.get("BOT_WEBHOOK_CERT")
+WEBHOOK_KEY = os.environ.get("BOT_WEBHOOK_KEY")
+# Бот обрабатывает только текстовые сообщения, остальные типы обновлений не запрашиваем
+ALLOWED_UPDATES = [Update.MESSAGE]
+# Сколько обновлений обрабатывать одновременно (разных чатов)
+CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "32"))
+# Состояние диалогов и введённые поля переживают перезапуск бота
+STATE_PATH = os.environ.get("BOT_STATE_PATH", "bot_state.pickle")
+# Как часто сохранять состояние на диск, секунды (при остановке — сразу)
+STATE_SAVE_INTERVAL = 5
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обновления разных чатов обрабатываются параллельно, одного чата — строго по
+    очереди: иначе два быстрых сообщения одного пользователя могли бы пройти
+    ConversationHandler в одном и том же состоянии"""
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        lock = self._locks.setdefault(chat.id, asyncio.Lock())
+        self._waiting[chat.id] = self._waiting.get(chat.id, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._waiting[chat.id] -= 1
+            if not self._waiting[chat.id]:
+                del self._waiting[chat.id]
+                del self._locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет приветственное сообщение и показывает главное меню"""
@@ -117,25 +177,15 @@ async def confirm_request(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if update.message.text.lower() == 'да':
         request_data = context.user_data.copy()
         request_data["user"] = user.full_name
-        request_data["time"] = str(date.today())
-        try:
-            response = requests.post(FLASK_URL, json=request_data, timeout=5)
-            if response.status_code == 200:
-                await update.message.reply_text(
-                    "✅ Ваша заявка принята и отправлена в приложение! Мы свяжемся с вами в ближайшее время.",
-                    reply_markup=ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True)
-                )
-            else:
-                await update.message.reply_text(
-                    f"❌ Ошибка при отправке заявки: {response.status_code}",
-                    reply_markup=ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True)
-                )
-        except Exception as e:
-            logger.error("Ошибка отправки: %s", e)
-            await update.message.reply_text(
-                "❌ Ошибка при отправке заявки: сервер не отвечает.",
-                reply_markup=ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True)
-            )
+        # Заявка уходит на сервер уже в полях таблицы repairs
+        request_data = from_bot(request_data)
+        # Заявка сохраняется в локальную очередь и отправляется на сервер в фоне,
+        # поэтому ответ пользователю не зависит от доступности сервера
+        await context.application.bot_data['outbox'].put(request_data)
+        await update.message.reply_text(
+            "✅ Ваша заявка принята и отправлена в приложение! Мы свяжемся с вами в ближайшее время.",
+            reply_markup=ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True)
+        )
         logger.info(
             "Новая заявка:\n"
             f"Пользователь: {user.full_name} (ID: {user.id})\n"
@@ -162,9 +212,51 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
     return ConversationHandler.END
 
-def main() -> None:
-    """Запуск бота"""
-    application = Application.builder().token(BOT_TOKEN).build()
+async def post_init(application: Application) -> None:
+    """Открывает очередь заявок и запускает её отправку на сервер"""
+    # Очередь и клиент могут быть переданы заранее (bot_harness.py)
+    if 'outbox' not in application.bot_data:
+        application.bot_data['outbox'] = Outbox()
+    if 'http_client' not in application.bot_data:
+        application.bot_data['http_client'] = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=2)
+        )
+    outbox = application.bot_data['outbox']
+    client = application.bot_data['http_client']
+    application.bot_data['outbox_task'] = asyncio.create_task(
+        outbox.drain(client, f"{FLASK_URL}/receive_bulk")
+    )
+
+async def post_shutdown(application: Application) -> None:
+    """Останавливает отправку; неотправленные заявки остаются в очереди до следующего запуска"""
+    task = application.bot_data['outbox_task']
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await application.bot_data['http_client'].aclose()
+    application.bot_data['outbox'].close()
+
+def build_application(token, request=None, state_path=STATE_PATH) -> Application:
+    """Бот со всеми обработчиками; request подменяет обращения к Bot API"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    if state_path:
+        # bot_data не сохраняется: там очередь заявок и HTTP-клиент
+        builder = builder.persistence(PicklePersistence(
+            state_path,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=STATE_SAVE_INTERVAL,
+        ))
+    application = builder.build()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     conv_handler = ConversationHandler(
@@ -176,9 +268,28 @@ def main() -> None:
             CONFIRM: [MessageHandler(filters.Regex("^(Да|Нет)$"), confirm_request)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="repair_request",
+        persistent=bool(state_path),
     )
     application.add_handler(conv_handler)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
+
+def main() -> None:
+    """Запуск бота"""
+    application = build_application(BOT_TOKEN)
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            cert=WEBHOOK_CERT,
+            key=WEBHOOK_KEY,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,174 @@
+"""Проверка обновления схемы на базах, созданных прежними версиями.
+
+    python upgrade_check.py --rev 1b4e75d --rev c0dc2b7
+    python upgrade_check.py repairs.db --workers 8
+
+--rev создаёт базу кодом указанной ревизии (git archive во временный каталог,
+db.init_db оттуда и несколько записей со сменой статуса), пути — готовые базы;
+они копируются (архив для них создаётся пустым), исходные файлы не меняются.
+К копии одновременно подключаются --workers процессов с текущим db.init_db, как
+воркеры gunicorn при запуске.
+Затем проверяется, что ни один процесс не упал, записи и журналы на месте,
+схема совпадает со схемой новой базы, индексы целы, а новый номер записи
+больше всех прежних, в том числе архивных."""
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Записи для базы, созданной прежней ревизией: только столбцы, что были всегда
+SEED = """
+import db
+db.init_db()
+with db.connection() as conn:
+    for i in range(50):
+        conn.execute(
+            "INSERT INTO repairs (client_name, device_type, manufacturer, serial_number, "
+            "client_address, status, status_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (f"Иванов {i}", "Телефон", "Acme", f"SN{i:05d}", f"+7 916 000-00-{i:02d}",
+             "принят", "2026-01-01 00:00:00")
+        )
+    conn.execute("UPDATE repairs SET status = 'готов', status_timestamp = '2026-01-03 00:00:00' "
+                 "WHERE id <= 10")
+    conn.execute("DELETE FROM repairs WHERE id = 50")
+"""
+INIT = "import db; db.init_db()"
+# Таблицы, число строк в которых обновление не должно менять
+KEPT_TABLES = ("repairs", "repair_changes", "status_history", "dictionary_values")
+
+
+def run_python(code, directory, database):
+    env = dict(os.environ, REPAIRS_DB=database, REPAIRS_ARCHIVE_DB=database + ".archive",
+               REPAIRS_METRICS="0")
+    return subprocess.Popen([sys.executable, "-c", code], cwd=directory, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def create_at(rev, database):
+    """База, созданная кодом ревизии rev"""
+    with tempfile.TemporaryDirectory() as tree:
+        archive = subprocess.run(["git", "archive", rev], cwd=ROOT, check=True,
+                                 capture_output=True).stdout
+        subprocess.run(["tar", "-x", "-C", tree], input=archive, check=True)
+        process = run_python(SEED, tree, database)
+        _, stderr = process.communicate()
+        if process.returncode:
+            raise RuntimeError(f"Не удалось создать базу на {rev}:\n{stderr}")
+
+
+def counts(database):
+    conn = sqlite3.connect(database)
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in KEPT_TABLES if table in existing}
+    finally:
+        conn.close()
+
+
+def schema(database):
+    """Имена и тип объектов main, кроме служебных таблиц полнотекстового индекса"""
+    conn = sqlite3.connect(database)
+    try:
+        return {(row[0], row[1]) for row in conn.execute(
+            "SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' "
+            "AND name NOT LIKE 'repairs_fts_%'"
+        )}
+    finally:
+        conn.close()
+
+
+def check(database, workers, reference):
+    problems = []
+    before = counts(database)
+    processes = [run_python(INIT, ROOT, database) for _ in range(workers)]
+    for process in processes:
+        _, stderr = process.communicate()
+        if process.returncode:
+            problems.append(f"init_db завершился с ошибкой:\n{stderr.strip()}")
+    if problems:
+        return problems
+
+    after = counts(database)
+    for table, count in before.items():
+        if after.get(table) != count:
+            problems.append(f"{table}: было {count} строк, стало {after.get(table)}")
+    missing = reference - schema(database)
+    if missing:
+        problems.append(f"Нет объектов схемы: {sorted(missing)}")
+
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (database + ".archive",))
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'repairs'").fetchone()[0]
+        if "AUTOINCREMENT" not in sql.upper():
+            problems.append("repairs.id без AUTOINCREMENT")
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            problems.append(f"integrity_check: {result}")
+        try:
+            conn.execute("INSERT INTO repairs_fts (repairs_fts) VALUES ('integrity-check')")
+        except sqlite3.DatabaseError as e:
+            problems.append(f"Полнотекстовый индекс: {e}")
+        last_id = conn.execute("""
+            SELECT MAX(COALESCE((SELECT MAX(id) FROM main.repairs), 0),
+                       COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name = 'repairs'), 0),
+                       COALESCE((SELECT MAX(id) FROM archive.repairs), 0))
+        """).fetchone()[0]
+        new_id = conn.execute("INSERT INTO repairs (client_name) VALUES ('проверка')").lastrowid
+        if new_id <= last_id:
+            problems.append(f"Новая запись получила уже выданный номер {new_id}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка обновления схемы repairs.db")
+    parser.add_argument('databases', nargs='*', help="готовые базы (копируются)")
+    parser.add_argument('--rev', action='append', default=[],
+                        help="создать базу кодом этой ревизии git (можно несколько раз)")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="процессов, одновременно вызывающих init_db")
+    args = parser.parse_args()
+    if not args.databases and not args.rev:
+        parser.error("укажите базы или --rev")
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        reference_db = os.path.join(tmp, "reference.db")
+        process = run_python(INIT, ROOT, reference_db)
+        _, stderr = process.communicate()
+        if process.returncode:
+            sys.exit(f"Новая база не создаётся:\n{stderr}")
+        reference = schema(reference_db)
+
+        cases = []
+        for number, rev in enumerate(args.rev):
+            database = os.path.join(tmp, f"rev{number}.db")
+            create_at(rev, database)
+            cases.append((f"--rev {rev}", database))
+        for number, path in enumerate(args.databases):
+            database = os.path.join(tmp, f"copy{number}.db")
+            for suffix in ("", "-wal"):
+                if os.path.exists(path + suffix):
+                    shutil.copyfile(path + suffix, database + suffix)
+            cases.append((path, database))
+
+        for name, database in cases:
+            problems = check(database, args.workers, reference)
+            print(f"{'OK  ' if not problems else 'FAIL'} {name}")
+            for problem in problems:
+                print(f"     {problem}")
+            failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Готовые ответы сайта-визитки: статические файлы и отрисованные страницы.
+
+Тело ответа сжимается один раз, когда файл прочитан или страница отрисована, а
+не при каждом запросе. Статические файлы (каталог static/) читаются при
+запуске; в их адрес входит начало хэша содержимого (reviews.css ->
+/static/reviews.1a2b3c4d5e.css), поэтому такой адрес никогда не указывает на
+другое содержимое и отдаётся с годовым сроком кэширования (immutable):
+браузер не перепроверяет его вовсе, а после правки файла шаблоны ссылаются на
+новый адрес. По исходному имени файл тоже доступен, но с перепроверкой.
+Изменения в static/ видны после перезапуска сервера."""
+import gzip
+import hashlib
+import mimetypes
+import os
+from datetime import datetime, timezone
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_URL = '/static/'
+# Сколько символов хэша содержимого входит в имя файла
+FINGERPRINT_LENGTH = 10
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Браузер хранит ответ, но перед использованием спрашивает сервер (обычно 304)
+REVALIDATE = 'no-cache'
+COMPRESS_MIMETYPES = {"text/html", "text/css", "application/javascript", "text/javascript",
+                      "image/svg+xml", "application/json"}
+# Сжатие выполняется один раз, поэтому со степенью выше, чем у ответов API
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+class Content:
+    """Тело ответа с заранее сжатыми вариантами, ETag и временем изменения"""
+
+    def __init__(self, body, mimetype, last_modified):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:FINGERPRINT_LENGTH]
+        # В Last-Modified и If-Modified-Since время с точностью до секунды
+        self.last_modified = last_modified.replace(microsecond=0)
+        self.encoded = {}
+        if mimetype in COMPRESS_MIMETYPES:
+            variants = {'gzip': gzip.compress(body, GZIP_LEVEL, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+            # Крошечным файлам сжатие не помогает
+            self.encoded = {encoding: data for encoding, data in variants.items()
+                            if len(data) < len(body)}
+
+    def is_fresh(self, request):
+        """У клиента уже эта версия: If-None-Match, а без него If-Modified-Since"""
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        since = request.if_modified_since
+        return since is not None and self.last_modified <= since
+
+    def response(self, request, cache_control):
+        if self.is_fresh(request):
+            response = Response(status=304)
+        else:
+            accepted = request.accept_encodings
+            encoding = next((encoding for encoding in ('br', 'gzip')
+                             if encoding in self.encoded and accepted[encoding]), None)
+            response = Response(self.encoded.get(encoding, self.body), mimetype=self.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        if self.encoded:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(self.etag, weak=True)
+        response.last_modified = self.last_modified
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+
+class StaticAssets:
+    """Файлы каталога static/ по адресу с отпечатком и по исходному имени"""
+
+    def __init__(self, directory=STATIC_DIR):
+        self._urls = {}
+        # Имя в адресе -> (Content, Cache-Control)
+        self._files = {}
+        if not os.path.isdir(directory):
+            return
+        for root, _, names in os.walk(directory):
+            for filename in names:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, directory).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    body = f.read()
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+                content = Content(body, mimetype, modified)
+                stem, extension = os.path.splitext(name)
+                fingerprinted = f"{stem}.{content.etag}{extension}"
+                self._files[fingerprinted] = (content, IMMUTABLE)
+                self._files[name] = (content, REVALIDATE)
+                self._urls[name] = STATIC_URL + fingerprinted
+
+    def url(self, name):
+        """Адрес файла с отпечатком (для шаблонов); неизвестное имя — KeyError,
+        чтобы опечатка в шаблоне не превращалась в битую ссылку"""
+        return self._urls[name]
+
+    def get(self, name):
+        """(Content, Cache-Control) по имени из адреса или None"""
+        return self._files.get(name)
+
+
+class PageCache:
+    """Отрисованные страницы. Страница строится заново (build() -> Content),
+    только когда меняется версия её данных; между процессами кэш не делится,
+    но версия берётся из базы и одинакова для всех."""
+
+    def __init__(self):
+        # Имя страницы -> (версия, Content)
+        self._pages = {}
+
+    def get(self, name, version, build):
+        cached = self._pages.get(name)
+        if cached is None or cached[0] != version:
+            # Два потока могут отрисовать страницу одновременно — результат тот же
+            cached = (version, build())
+            self._pages[name] = cached
+        return cached[1]
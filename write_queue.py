@@ -0,0 +1,119 @@
+"""Групповая фиксация изменений базы (ремонты, отзывы с сайта).
+
+Изменяющие запросы не открывают каждый свою транзакцию, а ставят операцию в
+очередь единственного на процесс потока-писателя. Он забирает всё, что
+накопилось (не больше GROUP_SIZE операций, дожидаясь новых не дольше
+GROUP_DELAY), выполняет операции в одной транзакции — каждую в своей точке
+сохранения, чтобы ошибка одной не отменяла остальные — и фиксирует группу одним
+fsync (synchronous=FULL у соединения писателя). Вызывающий получает результат
+только после того, как группа записана на диск.
+
+Между процессами (воркерами gunicorn) блокировку записи по-прежнему делит
+SQLite, но транзакций во столько раз меньше, сколько операций попадает в
+группу, а BEGIN IMMEDIATE ждёт блокировку по busy_timeout, а не получает
+«database is locked» при попытке повысить блокировку чтения."""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GROUP_SIZE = 64
+# Сколько секунд после первой операции ждать, пока подойдут ещё
+GROUP_DELAY = 0.002
+
+
+class WriteQueue:
+    def __init__(self, group_size=GROUP_SIZE, group_delay=GROUP_DELAY):
+        self.group_size = group_size
+        self.group_delay = group_delay
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Потоки не переживают fork, поэтому писатель запускается в каждом процессе
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name="repairs-writer",
+                                 daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, operation):
+        """Выполняет operation(conn) в потоке-писателе и возвращает её результат
+        после фиксации группы; исключение операции поднимается здесь же"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+
+    def _run(self, operations):
+        conn = None
+        while True:
+            group = self._collect(operations)
+            try:
+                if conn is None:
+                    conn = db.connect()
+                    # Подтверждение получает только группа, уже записанная на диск
+                    conn.execute("PRAGMA synchronous=FULL")
+                self._commit_group(conn, group)
+            except Exception as e:
+                logger.exception("Не удалось записать группу из %d операций", len(group))
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None:
+                    # После сбоя соединение открывается заново
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+
+    def _collect(self, operations):
+        group = [operations.get()]
+        deadline = time.monotonic() + self.group_delay
+        while len(group) < self.group_size:
+            try:
+                group.append(operations.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return group
+
+    def _commit_group(self, conn, group):
+        metrics.WRITE_GROUP_SIZE.observe(len(group))
+        started = time.perf_counter()
+        done = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for operation, future in group:
+                conn.execute("SAVEPOINT operation")
+                try:
+                    result = operation(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operation")
+                    conn.execute("RELEASE operation")
+                    future.set_exception(e)
+                    continue
+                conn.execute("RELEASE operation")
+                done.append((future, result))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        metrics.WRITE_GROUP_DURATION.observe(time.perf_counter() - started)
+        for future, result in done:
+            future.set_result(result)
+
+
+writer = WriteQueue()
@@ -0,0 +1,18 @@
+"""Точка входа для WSGI-серверов: gunicorn -w 4 -k gthread --threads 32 wsgi:app
+
+Модуль site.py совпадает по имени со стандартным модулем site, который Python
+загружает при запуске, поэтому указать site:app нельзя — приложение загружается
+из файла напрямую."""
+import importlib.util
+import os
+import sys
+
+_spec = importlib.util.spec_from_file_location(
+    "repairs_site", os.path.join(os.path.dirname(os.path.abspath(__file__)), "site.py")
+)
+_module = importlib.util.module_from_spec(_spec)
+# Flask ищет шаблоны относительно модуля, зарегистрированного в sys.modules
+sys.modules[_spec.name] = _module
+_spec.loader.exec_module(_module)
+
+app = _module.app